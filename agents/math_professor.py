@@ -1,5 +1,20 @@
 from functions import math
-from goog.agent import agent
+from goog.agent import AgentSpec
+
+_MATH_PROFESSOR = AgentSpec(
+    str,
+    name="math_professor",
+    instruction=(
+        "You are an expert with math. Please solve this math problem. "
+        "When you need several results, evaluate all the expressions in one call to math_batch."
+    ),
+    tools=[
+        math.math,
+        math.math_batch,
+        math.diff_date,
+    ],
+    model_name="gemini-1.5-flash-latest",
+)
 
 
 async def math_professor(request: str) -> str:
@@ -11,13 +26,4 @@ async def math_professor(request: str) -> str:
     Returns:
         The response from Bob.
     """
-    return await agent(
-        str,
-        instruction="You are an expert with math. Please solve this math problem.",
-        data=request,
-        tools=[
-            math.math,
-            math.diff_date,
-        ],
-        model_name="gemini-1.5-flash-latest",
-    )
+    return await _MATH_PROFESSOR(request)
@@ -1,7 +1,9 @@
-from agents.webber import web_researcher
 from functions.real_time import current_datetime
-from goog import agent
+from goog.agent import AgentSpec
+from goog.events import Event
+from goog.lazy_tools import lazy_tool
 from pydantic import BaseModel, Field, model_validator
+from typing import AsyncIterator
 from typing_extensions import Self
 
 
@@ -25,6 +27,27 @@ class NextTopics(BaseModel):
         return self
 
 
+_NEXT_SEARCH_RECOMMENDER = AgentSpec(
+    NextTopics,
+    name="next_search_recommender",
+    instruction=(
+        "You are an expert in suggesting what are the next list of topics to search on as a followup on some article. "
+        "For example, after reading a biography of a famous person, if the article has only a brief description on some key events, you may suggest to search more on that key events as the next step. "
+        "Another example: if the article is a photo, spot any interesting object in the photo and suggest to search more about that object.\n\n"
+        "I will give you a topic or an URL. "
+        "If it is a topic, search the internet for a relevant article. "
+        "If it is an URL, just fetch the article pointed by the URL. "
+        "Read the article carefully and suggest the top 5 topics to search for next. "
+    ),
+    tools=[
+        current_datetime,
+        lazy_tool("agents.webber:web_researcher"),
+    ],
+    model_name="gemini-1.5-flash-latest",
+    json_final_turn=True,
+)
+
+
 async def next_search_recommender(request: str) -> NextTopics:
     """next_search_recommender is an expert in suggesting the next topics to search for after reading an article.
 
@@ -34,21 +57,17 @@ async def next_search_recommender(request: str) -> NextTopics:
     Returns:
         The response from next_search_recommender.
     """
-    return await agent.agent(
-        NextTopics,
-        instruction=(
-            "You are an expert in suggesting what are the next list of topics to search on as a followup on some article. "
-            "For example, after reading a biography of a famous person, if the article has only a brief description on some key events, you may suggest to search more on that key events as the next step. "
-            "Another example: if the article is a photo, spot any interesting object in the photo and suggest to search more about that object.\n\n"
-            "I will give you a topic or an URL. "
-            "If it is a topic, search the internet for a relevant article. "
-            "If it is an URL, just fetch the article pointed by the URL. "
-            "Read the article carefully and suggest the top 5 topics to search for next. "
-        ),
-        data=request,
-        tools=[
-            current_datetime,
-            web_researcher,
-        ],
-        model_name="gemini-1.5-flash-latest",
-    )
+    return await _NEXT_SEARCH_RECOMMENDER(request)
+
+
+async def next_search_recommender_stream(request: str) -> AsyncIterator[Event]:
+    """Streams the events of next_search_recommender as they happen.
+
+    Args:
+        request: The request to next_search_recommender.
+
+    Yields:
+        The events of next_search_recommender, ending with the `NextTopics`.
+    """
+    async for event in _NEXT_SEARCH_RECOMMENDER.stream(request):
+        yield event
@@ -1,31 +1,19 @@
-from functions.web import web_scrape, web_search
-from goog.agent import agent
-from .math_professor import math_professor
+from goog.agent import AgentSpec
+from goog.compaction import CompactionPolicy
+from goog.lazy_tools import lazy_tool
+from goog.tool_policy import ToolPolicy
 
-
-async def web_researcher(request: str) -> str:
-    """web_researcher is an expert in web research.
-
-    Give him a topic and he will find the best information on the internet on that topic.
-
-    Args:
-        request: The request to web_researcher.
-
-    Returns:
-        The response from web_researcher.
-    """
-    return await agent(
-        str,
-        instruction=(
-            "You are an expert in web research. "
-            "You have two agents who can help you gather the information. "
-            "Once they have found you the information, "
-            "you will assemble the information into a coherent presentation on the topic."
-        ),
-        data=request,
-        tools=[math_professor, web_searcher, web_scraper],
-        model_name="gemini-1.5-flash-latest",
-    )
+_WEB_SEARCHER = AgentSpec(
+    str,
+    name="web_searcher",
+    instruction=(
+        "You are an expert with Google search. "
+        "When you receive a request for a topic, figure out what would be the best query to search for that topic. "
+        "Then, use your queries to search the web."
+    ),
+    tools=[lazy_tool("functions.web:web_search")],
+    model_name="gemini-1.5-flash-latest",
+)
 
 
 async def web_searcher(request: str) -> str:
@@ -37,17 +25,25 @@ async def web_searcher(request: str) -> str:
     Returns:
         The response from web_searcher.
     """
-    return await agent(
-        str,
-        instruction=(
-            "You are an expert with Google search. "
-            "When you receive a request for a topic, figure out what would be the best query to search for that topic. "
-            "Then, use your queries to search the web."
-        ),
-        data=request,
-        tools=[web_search],
-        model_name="gemini-1.5-flash-latest",
-    )
+    return await _WEB_SEARCHER(request)
+
+
+_WEB_SCRAPER = AgentSpec(
+    str,
+    name="web_scraper",
+    instruction=(
+        "You are an expert at scraping content from an URL. "
+        "You know how to extract text and links from a webpage. "
+        "Clean up the content and filter out the noise. "
+        "Retain only the text and links that can lead to more information on the topic. "
+        "If the request says what to look for, pass it as the query, "
+        "so that only the relevant passages of the page are returned."
+    ),
+    tools=[lazy_tool("functions.web:web_scrape")],
+    model_name="gemini-1.5-flash-latest",
+    compaction=CompactionPolicy(),
+    tool_policy=ToolPolicy(timeout_seconds=60),
+)
 
 
 async def web_scraper(request: str) -> str:
@@ -59,15 +55,39 @@ async def web_scraper(request: str) -> str:
     Returns:
         The response from web_scraper.
     """
-    return await agent(
-        str,
-        instruction=(
-            "You are an expert at scraping content from an URL. "
-            "You know how to extract text and links from a webpage. "
-            "Clean up the content and filter out the noise. "
-            "Retain only the text and links that can lead to more information on the topic."
-        ),
-        data=request,
-        tools=[web_scrape],
-        model_name="gemini-1.5-flash-latest",
-    )
+    return await _WEB_SCRAPER(request)
+
+
+_WEB_RESEARCHER = AgentSpec(
+    str,
+    name="web_researcher",
+    instruction=(
+        "You are an expert in web research. "
+        "You have two agents who can help you gather the information. "
+        "Once they have found you the information, "
+        "you will assemble the information into a coherent presentation on the topic."
+    ),
+    tools=[
+        lazy_tool("agents.math_professor:math_professor"),
+        web_searcher,
+        web_scraper,
+    ],
+    model_name="gemini-1.5-flash-latest",
+    compaction=CompactionPolicy(),
+    # A hung page must not hold the whole research.
+    tool_policy=ToolPolicy(max_concurrency={"web_scraper": 4}, timeout_seconds=300),
+)
+
+
+async def web_researcher(request: str) -> str:
+    """web_researcher is an expert in web research.
+
+    Give him a topic and he will find the best information on the internet on that topic.
+
+    Args:
+        request: The request to web_researcher.
+
+    Returns:
+        The response from web_researcher.
+    """
+    return await _WEB_RESEARCHER(request)
@@ -0,0 +1,42 @@
+"""Measures the per-call setup overhead of `agent` against a precompiled `AgentSpec`.
+
+Run with `python -m bench.agent_spec`. No model is called: only the work done
+before the first request is timed.
+"""
+
+from functions.web import web_scrape
+from goog.agent import AgentSpec
+from goog.compaction import CompactionPolicy
+from main.agent import Payment
+import timeit
+
+_ITERATIONS = 200
+
+
+def _new_spec(output_type: type) -> AgentSpec:
+    return AgentSpec(
+        output_type,
+        instruction="You are an expert at scraping content from an URL.",
+        tools=[web_scrape],
+        model_name="gemini-1.5-flash-latest",
+        compaction=CompactionPolicy(),
+    )
+
+
+def main() -> None:
+    for output_type in (str, Payment):
+        spec = _new_spec(output_type)
+        per_call = timeit.timeit(
+            lambda: _new_spec(output_type)._new_chat(), number=_ITERATIONS
+        )
+        precompiled = timeit.timeit(lambda: spec._new_chat(), number=_ITERATIONS)
+        print(
+            f"{output_type.__name__:>8}: "
+            f"agent() setup {per_call / _ITERATIONS * 1e6:8.1f} us/call, "
+            f"AgentSpec setup {precompiled / _ITERATIONS * 1e6:8.1f} us/call, "
+            f"{per_call / precompiled:5.1f}x faster"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Benchmarks whole agent trees against a local stand-in for Gemini.
+
+Run with `python -m bench.agents`. The real agents of `main.agent` and
+`agents.next_search_recommender` are run, but every model call is answered by
+`bench.fake_gemini.FakeGemini`. The scripted models call the tools of the boss
+tree, but the web agents answer without searching, so nothing leaves the
+machine. Some final responses are malformed to exercise the feedback path, and
+some calls fail with `ResourceExhausted` to exercise the retries.
+"""
+
+from agents.next_search_recommender import next_search_recommender
+import asyncio
+from bench.fake_gemini import (
+    FakeGemini,
+    Responder,
+    function_call,
+    is_feedback,
+    json_block,
+    request_of,
+    text,
+    tool_rounds,
+)
+import contextlib
+from goog import function_calling
+from google.ai import generativelanguage as glm
+import io
+import logging
+from main.agent import boss
+from pydantic import BaseModel
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Awaitable, Callable
+
+_REQUESTS = 100
+_CONCURRENCY = 10
+_LATENCY_SECONDS = 0.05
+_LATENCY_JITTER_SECONDS = 0.05
+_RESOURCE_EXHAUSTED_RATE = 0.01
+_MALFORMED_RATE = 0.2
+_LOOP_MONITOR_INTERVAL_SECONDS = 0.001
+# Shorter delays are the usual overhead of scheduling, not blocking.
+_LOOP_STALL_SECONDS = 0.001
+
+
+class Report(BaseModel):
+    """The measurements of a scenario."""
+
+    scenario: str
+    requests: int
+    errors: int
+    latencies_seconds: list[float]
+    model_calls: int
+    resource_exhausted: int
+    loop_blocked_seconds: float
+    loop_max_lag_seconds: float
+    peak_memory_bytes: int
+
+    def summary(self) -> str:
+        cuts = statistics.quantiles(self.latencies_seconds, n=100)
+        return (
+            f"{self.scenario}: {self.requests} requests, {self.errors} errors\n"
+            f"  latency p50 {cuts[49] * 1e3:7.1f} ms, p90 {cuts[89] * 1e3:7.1f} ms, "
+            f"p99 {cuts[98] * 1e3:7.1f} ms, max {max(self.latencies_seconds) * 1e3:7.1f} ms\n"
+            f"  {self.model_calls / self.requests:.1f} model calls/request, "
+            f"{self.resource_exhausted} injected quota errors\n"
+            f"  event loop stalled {self.loop_blocked_seconds * 1e3:.1f} ms in total, "
+            f"longest {self.loop_max_lag_seconds * 1e3:.1f} ms\n"
+            f"  peak memory {self.peak_memory_bytes / 2**20:.1f} MiB"
+        )
+
+
+def boss_responders(rng: random.Random) -> dict[str, Responder]:
+    def boss(contents: list[glm.Content]) -> list[glm.Part]:
+        request = request_of(contents)
+        if is_feedback(contents):
+            return [json_block(_PAYMENT)]
+        match tool_rounds(contents):
+            case 0:
+                return [
+                    function_call("dave", request=f"When was Easter 2022? {request}"),
+                    function_call("dave", request=f"When is Christmas 2024? {request}"),
+                    function_call(
+                        "web_searcher", request=f"Minimum wage in New York. {request}"
+                    ),
+                ]
+            case 1:
+                return [
+                    function_call(
+                        "math_professor",
+                        request=f"How much is 3.5 * 15 * 8 * 5 * 140? {request}",
+                    )
+                ]
+            case 2:
+                return [function_call("alice", request=f"Zoey is paid. {request}")]
+            case 3:
+                return [function_call("carol", request=f"Email Zoey. {request}")]
+        if rng.random() < _MALFORMED_RATE:
+            return [json_block({**_PAYMENT, "amount": "a lot"})]
+        return [json_block(_PAYMENT)]
+
+    def math_professor(contents: list[glm.Content]) -> list[glm.Part]:
+        if tool_rounds(contents) == 0:
+            return [
+                function_call("math", expression="3.5 * 15 * 8 * 5 * 140"),
+                function_call("diff_date", a="2024-12-25", b="2022-04-17"),
+            ]
+        return [text("The payment is 294000.")]
+
+    def tool_user(name: str, answer: str) -> Responder:
+        def respond(contents: list[glm.Content]) -> list[glm.Part]:
+            if tool_rounds(contents) == 0:
+                return [function_call(name)]
+            return [text(answer)]
+
+        return respond
+
+    return {
+        "You are the boss.": boss,
+        "flattering": lambda _: [text("Zoey, your work is outstanding.")],
+        "expert with email": tool_user("send_mail", "The email is sent."),
+        "the clock": tool_user("current_datetime", "It is April 17, 2022."),
+        "expert with math": math_professor,
+        "Google search": lambda _: [text("The minimum wage is $15 per hour.")],
+        "scraping content": lambda _: [text("The page is about wages.")],
+    }
+
+
+def next_search_recommender_responders(
+    rng: random.Random,
+) -> dict[str, Responder]:
+    def recommender(contents: list[glm.Content]) -> list[glm.Part]:
+        topics = {"original_topic": request_of(contents), "next_topics": _NEXT_TOPICS}
+        if is_feedback(contents):
+            return [json_block(topics)]
+        if tool_rounds(contents) == 0:
+            return [
+                function_call("current_datetime"),
+                function_call("web_researcher", request=request_of(contents)),
+            ]
+        if rng.random() < _MALFORMED_RATE:
+            # Fails the validator, since the list of topics cannot be empty.
+            return [json_block({**topics, "next_topics": []})]
+        return [json_block(topics)]
+
+    return {
+        "next list of topics": recommender,
+        "web research": lambda _: [text("The article is about Singapore.")],
+    }
+
+
+_PAYMENT = {
+    "amount": 294000.0,
+    "recipient": "Zoey",
+    "date": {"day": 17, "month": 10, "year": 2024},
+}
+_NEXT_TOPICS = ["Marina Bay", "Gardens by the Bay", "Hawker centres"]
+
+
+async def _boss(i: int) -> None:
+    await boss(f"Pay Zoey for project #{i}.")
+
+
+async def _next_search_recommender(i: int) -> None:
+    await next_search_recommender(f"Singapore, part {i}")
+
+
+async def _monitor_loop(lags: list[float]) -> None:
+    """Records how late the event loop wakes up, which is the time it was blocked."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(_LOOP_MONITOR_INTERVAL_SECONDS)
+        lags.append(
+            max(0.0, time.perf_counter() - start - _LOOP_MONITOR_INTERVAL_SECONDS)
+        )
+
+
+async def _run(
+    scenario: str,
+    request: Callable[[int], Awaitable[None]],
+    responders: dict[str, Responder],
+) -> Report:
+    backend = FakeGemini(
+        responders,
+        latency_seconds=_LATENCY_SECONDS,
+        latency_jitter_seconds=_LATENCY_JITTER_SECONDS,
+        resource_exhausted_rate=_RESOURCE_EXHAUSTED_RATE,
+    )
+    function_calling.configure(backend=backend)
+    semaphore = asyncio.Semaphore(_CONCURRENCY)
+    latencies: list[float] = []
+    errors = 0
+
+    async def timed(i: int) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await request(i)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    lags: list[float] = []
+    monitor = asyncio.create_task(_monitor_loop(lags))
+    tracemalloc.start()
+    try:
+        await asyncio.gather(*(timed(i) for i in range(_REQUESTS)))
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        monitor.cancel()
+        function_calling.configure(backend=None)
+
+    return Report(
+        scenario=scenario,
+        requests=_REQUESTS,
+        errors=errors,
+        latencies_seconds=latencies,
+        model_calls=backend.stats.calls,
+        resource_exhausted=backend.stats.resource_exhausted,
+        loop_blocked_seconds=sum(lag for lag in lags if lag > _LOOP_STALL_SECONDS),
+        loop_max_lag_seconds=max(lags, default=0.0),
+        peak_memory_bytes=peak_memory,
+    )
+
+
+async def main() -> None:
+    rng = random.Random(0)
+    # The injected failures are logged with their stack traces.
+    logging.disable(logging.CRITICAL)
+    # The tools of the boss tree print what they do.
+    with contextlib.redirect_stdout(io.StringIO()):
+        reports = [
+            await _run("boss", _boss, boss_responders(rng)),
+            await _run(
+                "next_search_recommender",
+                _next_search_recommender,
+                next_search_recommender_responders(rng),
+            ),
+        ]
+    for report in reports:
+        print(report.summary())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,140 @@
+"""A local stand-in for Gemini, to run agents without the network.
+
+Install it with `goog.function_calling.configure(backend=FakeGemini(...))`.
+Each model is routed to a responder by its system instruction, and the
+responder scripts the reply from the conversation so far.
+"""
+
+import asyncio
+from goog.model_spec import ModelSpec
+from goog.tokens import estimate_tokens
+from google.ai import generativelanguage as glm
+from google.api_core.exceptions import ResourceExhausted
+import google.generativeai as genai
+from google.generativeai.types import generation_types
+import json
+from pydantic import BaseModel
+import random
+from typing import Any, Callable
+
+Responder = Callable[[list[glm.Content]], list[glm.Part]]
+
+
+class FakeGeminiStats(BaseModel):
+    """Counters of a fake backend."""
+
+    calls: int = 0
+    resource_exhausted: int = 0
+
+
+class FakeGemini:
+    """Generates scripted responses with a simulated latency."""
+
+    def __init__(
+        self,
+        responders: dict[str, Responder],
+        *,
+        latency_seconds: float = 0.05,
+        latency_jitter_seconds: float = 0.0,
+        resource_exhausted_rate: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """Initializes the backend.
+
+        Args:
+            responders: The responders by a part of the system instruction of the models they answer.
+            latency_seconds: The minimum latency of a call.
+            latency_jitter_seconds: The maximum latency added at random to a call.
+            resource_exhausted_rate: The fraction of calls failing with `ResourceExhausted`.
+            seed: The seed of the random latencies and failures.
+        """
+        self.responders = responders
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.resource_exhausted_rate = resource_exhausted_rate
+        self.stats = FakeGeminiStats()
+        self._random = random.Random(seed)
+
+    async def __call__(
+        self,
+        model: ModelSpec,
+        contents: list[glm.Content],
+        stream: bool,
+    ) -> genai.types.AsyncGenerateContentResponse:
+        self.stats.calls += 1
+        await asyncio.sleep(
+            self.latency_seconds + self._random.uniform(0, self.latency_jitter_seconds)
+        )
+        if self._random.random() < self.resource_exhausted_rate:
+            self.stats.resource_exhausted += 1
+            raise ResourceExhausted("Injected by the fake backend.")
+
+        content = glm.Content(parts=self._responder(model)(contents), role="model")
+        response = glm.GenerateContentResponse(
+            candidates=[
+                glm.Candidate(
+                    content=content, finish_reason=glm.Candidate.FinishReason.STOP
+                )
+            ],
+            usage_metadata=glm.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=estimate_tokens(contents),
+                candidates_token_count=estimate_tokens([content]),
+                total_token_count=estimate_tokens(contents)
+                + estimate_tokens([content]),
+            ),
+        )
+        if not stream:
+            return generation_types.AsyncGenerateContentResponse.from_response(response)
+
+        async def chunks():
+            yield response
+
+        return await generation_types.AsyncGenerateContentResponse.from_aiterator(
+            chunks()
+        )
+
+    def _responder(self, model: ModelSpec) -> Responder:
+        instruction = model.system_instruction or ""
+        for key, responder in self.responders.items():
+            if key in instruction:
+                return responder
+        raise KeyError(f"No responder for the instruction: {instruction[:80]}")
+
+
+def text(text: str) -> glm.Part:
+    """Returns a text part."""
+    return glm.Part(text=text)
+
+
+def json_block(value: Any) -> glm.Part:
+    """Returns a text part ending with a value in a ```json code block."""
+    return glm.Part(
+        text=f"Here is the final response.\n```json\n{json.dumps(value)}\n```"
+    )
+
+
+def function_call(name: str, **args: Any) -> glm.Part:
+    """Returns a function call part."""
+    return glm.Part(function_call=glm.FunctionCall(name=name, args=args))
+
+
+def request_of(contents: list[glm.Content]) -> str:
+    """Returns the text of the first message."""
+    return "".join(part.text for part in contents[0].parts if "text" in part)
+
+
+def tool_rounds(contents: list[glm.Content]) -> int:
+    """Returns the number of function responses sent back so far."""
+    return sum(
+        1
+        for content in contents
+        if any("function_response" in part for part in content.parts)
+    )
+
+
+def is_feedback(contents: list[glm.Content]) -> bool:
+    """Returns whether the last message asks to fix an unparsable final response."""
+    return any(
+        "text" in part and part.text.startswith("Failed to parse")
+        for part in contents[-1].parts
+    )
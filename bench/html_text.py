@@ -0,0 +1,100 @@
+"""Compares `functions.html_text.extract_text` with the BeautifulSoup extractor it replaced.
+
+Run with `python -m bench.html_text`. Pages saved as `bench/pages/*.html` make
+up the corpus; without any, synthetic articles of growing size are used.
+"""
+
+from bs4 import BeautifulSoup, Comment, NavigableString
+from functions.html_text import extract_text
+import glob
+import os
+import timeit
+
+_CORPUS_DIRECTORY = os.path.join(os.path.dirname(__file__), "pages")
+_REPEATS = 5
+
+
+def _baseline(html: str) -> str:
+    """The extraction of `web_scrape` before `functions.html_text`."""
+    soup = BeautifulSoup(html, "html.parser")
+    title_tag = soup.find("title")
+    title_text = title_tag.text if title_tag else "No title found"
+    return f"Title: {title_text}\n{_baseline_text_and_links(soup.body)}"
+
+
+def _baseline_text_and_links(element) -> str:
+    parts = []
+    for content in element:
+        if isinstance(content, NavigableString):
+            parts.append(str(content))
+        elif content.name == "a":
+            href = content.get("href", "")
+            if href.startswith("http://") or href.startswith("https://"):
+                parts.append(f"[{content.get_text()}]({href})")
+            else:
+                parts.append(content.get_text())
+        elif content.name in ["script", "style", "iframe", "noscript"]:
+            continue
+        elif isinstance(content, Comment):
+            continue
+        else:
+            parts.append(_baseline_text_and_links(content))
+    return "".join(parts)
+
+
+def _synthetic_page(paragraphs: int, depth: int = 10) -> str:
+    body = []
+    for i in range(paragraphs):
+        body.append(
+            "<div class='c'>" * depth
+            + f"<!-- tracking comment {i} -->"
+            + f"<p>Paragraph {i} of the article, with "
+            + f"<a href='https://example.com/{i}'>a link</a> and "
+            + f"<a href='#note{i}'>a note</a>.</p>"
+            + f"<script>var x{i} = '{'y' * 200}';</script>"
+            + "</div>" * depth
+        )
+    return (
+        "<html><head><title>Article</title>"
+        "<style>p { color: red; }</style></head><body>"
+        + "".join(body)
+        + "</body></html>"
+    )
+
+
+def _corpus() -> list[tuple[str, str]]:
+    paths = sorted(glob.glob(os.path.join(_CORPUS_DIRECTORY, "*.html")))
+    if paths:
+        pages = []
+        for path in paths:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                pages.append((os.path.basename(path), f.read()))
+        return pages
+    return [
+        (f"synthetic-{paragraphs}", _synthetic_page(paragraphs))
+        for paragraphs in (10, 100, 1_000)
+    ] + [("synthetic-deep", _synthetic_page(1, depth=2_000))]
+
+
+def main() -> None:
+    for name, html in _corpus():
+        extracted = extract_text(html)
+        new = timeit.timeit(lambda: extract_text(html), number=_REPEATS) / _REPEATS
+        try:
+            baseline_text = _baseline(html)
+            old = timeit.timeit(lambda: _baseline(html), number=_REPEATS) / _REPEATS
+            baseline = (
+                f"baseline {old * 1e3:8.2f} ms, {old / new:5.1f}x faster, "
+                f"baseline leaks comments: {'<!--' not in baseline_text and 'tracking comment' in baseline_text}"
+            )
+        except RecursionError:
+            baseline = "baseline hits the recursion limit"
+        print(
+            f"{name:>20} ({len(html) / 1024:8.1f} KiB): "
+            f"new {new * 1e3:8.2f} ms, {baseline}"
+        )
+        assert "tracking comment" not in extracted.text
+
+
+if __name__ == "__main__":
+    main()
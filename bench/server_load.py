@@ -0,0 +1,135 @@
+"""Load-tests `main.server` with many concurrent sessions.
+
+Run with `python -m bench.server_load`. The server runs in the same process
+against `bench.fake_gemini.FakeGemini`, so the numbers reflect the server and
+the agents, not Gemini. Each client opens a session and sends its requests one
+after another over a keep-alive connection, half of them streamed.
+"""
+
+import asyncio
+from bench.agents import next_search_recommender_responders
+from bench.fake_gemini import FakeGemini
+import collections
+from goog import function_calling
+import json
+import logging
+from main.server import Server
+import random
+import statistics
+import time
+
+_CLIENTS = 50
+_REQUESTS_PER_CLIENT = 10
+_MAX_IN_FLIGHT = 32
+_LATENCY_SECONDS = 0.05
+
+
+class _Client:
+    def __init__(self, port: int) -> None:
+        self.port = port
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    async def request(
+        self, method: str, path: str, body: object | None = None
+    ) -> tuple[int, bytes]:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(
+                "127.0.0.1", self.port
+            )
+        assert self._reader
+        data = json.dumps(body).encode() if body is not None else b""
+        self._writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode()
+            + data
+        )
+        await self._writer.drain()
+
+        head = (await self._reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+        status = int(head.split(" ", 2)[1])
+        headers = {
+            name.strip().lower(): value.strip()
+            for name, value in (
+                line.split(":", 1) for line in head.split("\r\n")[1:] if ":" in line
+            )
+        }
+        if headers.get("transfer-encoding") == "chunked":
+            body_bytes = b""
+            while True:
+                size = int(await self._reader.readuntil(b"\r\n"), 16)
+                chunk = await self._reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                body_bytes += chunk[:-2]
+        else:
+            body_bytes = await self._reader.readexactly(
+                int(headers.get("content-length", "0"))
+            )
+        if headers.get("connection") == "close":
+            self.close()
+        return status, body_bytes
+
+    def close(self) -> None:
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+async def _client(
+    port: int, i: int, latencies: list[float], statuses: list[int]
+) -> None:
+    client = _Client(port)
+    try:
+        _, body = await client.request("POST", "/sessions")
+        session_id = json.loads(body)["session_id"]
+        for j in range(_REQUESTS_PER_CLIENT):
+            start = time.perf_counter()
+            status, _ = await client.request(
+                "POST",
+                f"/sessions/{session_id}/messages",
+                {"message": f"Topic {i}.{j}", "stream": j % 2 == 1},
+            )
+            latencies.append(time.perf_counter() - start)
+            statuses.append(status)
+    finally:
+        client.close()
+
+
+async def main() -> None:
+    # The malformed responses are logged with their stack traces.
+    logging.disable(logging.CRITICAL)
+    function_calling.configure(
+        backend=FakeGemini(
+            next_search_recommender_responders(random.Random(0)),
+            latency_seconds=_LATENCY_SECONDS,
+            latency_jitter_seconds=_LATENCY_SECONDS,
+        )
+    )
+    server = Server(max_in_flight=_MAX_IN_FLIGHT)
+    listening = await server.start()
+    port = listening.sockets[0].getsockname()[1]
+
+    latencies: list[float] = []
+    statuses: list[int] = []
+    start = time.perf_counter()
+    async with listening:
+        await asyncio.gather(
+            *(_client(port, i, latencies, statuses) for i in range(_CLIENTS))
+        )
+    elapsed = time.perf_counter() - start
+
+    ok = [latency for latency, status in zip(latencies, statuses) if status == 200]
+    cuts = statistics.quantiles(ok, n=100)
+    print(
+        f"{_CLIENTS} sessions, {len(statuses)} requests in {elapsed:.1f} s: "
+        f"{len(ok) / elapsed:.1f} successful requests/s\n"
+        f"  latency p50 {cuts[49] * 1e3:7.1f} ms, p90 {cuts[89] * 1e3:7.1f} ms, "
+        f"p99 {cuts[98] * 1e3:7.1f} ms\n"
+        f"  statuses {dict(sorted(collections.Counter(statuses).items()))}\n"
+        f"  {server.stats}"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+"""Measures the import cost of the entry points with `python -X importtime`.
+
+Run with `python -m bench.startup`. Each module is imported in a fresh
+interpreter a few times; the median of its cumulative import time is
+reported, with the heaviest imports it pulls in and whether the tools that
+are meant to load lazily stayed unimported.
+"""
+
+import collections
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# main.chelsea is left out as it opens its log file on import; its cost is
+# that of agents.next_search_recommender.
+_MODULES = [
+    "agents.next_search_recommender",
+    "main.agent",
+    "agents.webber",
+    "goog.agent",
+    "functions.web",
+]
+# Only imported on the first call of a tool that needs them.
+_LAZY_MODULES = ["agents.webber", "agents.math_professor", "functions.web"]
+_REPEATS = 5
+_TOP_IMPORTS = 5
+
+# "import time:      self [us] |   cumulative | imported package", indented by depth.
+_IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def _import_times(module: str) -> tuple[dict[str, int], set[str]]:
+    """Imports a module in a fresh interpreter.
+
+    Returns:
+        The cumulative import time of the module and of its direct imports,
+        in microseconds, and the modules imported along the way.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import {module}, sys; print(*sys.modules)",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    lines = [
+        (len(match.group(3)), match.group(4), int(match.group(2)))
+        for match in map(_IMPORTTIME_LINE.match, result.stderr.splitlines())
+        if match
+    ]
+    # A module is reported after its imports, so the direct imports of the
+    # entry point are the ones one level deeper right before it.
+    cumulative: dict[str, int] = {}
+    for depth, name, microseconds in reversed(lines):
+        if cumulative and depth <= 1:
+            break
+        if name == module or (cumulative and depth == 3):
+            cumulative[name] = microseconds
+    return cumulative, set(result.stdout.split())
+
+
+def main() -> None:
+    for module in _MODULES:
+        runs = [_import_times(module) for _ in range(_REPEATS)]
+        totals = [cumulative[module] for cumulative, _ in runs]
+        imports: dict[str, list[int]] = collections.defaultdict(list)
+        for cumulative, _ in runs:
+            for name, microseconds in cumulative.items():
+                if name != module:
+                    imports[name].append(microseconds)
+        heaviest = sorted(
+            imports, key=lambda name: statistics.median(imports[name]), reverse=True
+        )[:_TOP_IMPORTS]
+        loaded = [
+            name for name in _LAZY_MODULES if name != module and name in runs[0][1]
+        ]
+
+        print(
+            f"{module}: {statistics.median(totals) / 1e3:7.1f} ms "
+            f"(min {min(totals) / 1e3:.1f} ms)"
+        )
+        for name in heaviest:
+            print(f"  {statistics.median(imports[name]) / 1e3:7.1f} ms  {name}")
+        print(f"  lazy modules imported: {', '.join(loaded) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,598 @@
+"""An async HTTP/1.1 client with keep-alive connection pooling.
+
+It is small on purpose: it only needs to GET web pages for the tools, and it
+must never block the event loop or let a huge or slow page pin a worker.
+Like urllib, it goes through the proxies of the `http_proxy`, `https_proxy`
+and `no_proxy` environment variables.
+"""
+
+import asyncio
+import base64
+import codecs
+import collections
+import contextlib
+import logging
+from pydantic import BaseModel
+import re
+import socket
+import ssl
+import time
+from typing import AsyncIterator, Iterable
+import urllib.parse
+import urllib.request
+import zlib
+
+
+class FetchError(RuntimeError):
+    """Raised when a page cannot be fetched."""
+
+
+class Page(BaseModel):
+    """A fetched web page."""
+
+    url: str
+    status: int
+    headers: dict[str, str]
+    content_type: str
+    charset: str
+    text: str
+    truncated: bool
+
+
+# The scheme, host and port of the server, and the proxy to reach it through.
+_Key = tuple[str, str, int, str | None]
+
+
+class _Connection:
+    def __init__(
+        self, key: _Key, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+        self.idle_since = 0.0
+
+    def close(self) -> None:
+        try:
+            self.writer.close()
+        except RuntimeError:
+            # The event loop of the connection is closed, so only its socket
+            # can still be shut down.
+            sock = self.writer.get_extra_info("socket")
+            if sock is not None:
+                with contextlib.suppress(OSError):
+                    sock.shutdown(socket.SHUT_RDWR)
+
+
+class _Response:
+    def __init__(
+        self, connection: _Connection, status: int, headers: dict[str, str]
+    ) -> None:
+        self.connection = connection
+        self.status = status
+        self.headers = headers
+        self.complete = False
+
+
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# The most bytes decompressed at once, so that a small compressed chunk cannot
+# inflate into a huge one before the size limit is checked.
+_DECOMPRESS_CHUNK_BYTES = 64 * 1024
+_CHARSET_PATTERN = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class Fetcher:
+    """Fetches pages over a pool of keep-alive connections.
+
+    The number of requests in flight is capped globally and per host, and
+    every request is bounded in time and size. Idle connections are kept for
+    reuse up to the same caps, and closed once idle for `idle_timeout`.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_connections: int = 32,
+        max_connections_per_host: int = 4,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 20.0,
+        total_timeout: float = 60.0,
+        max_body_bytes: int = 5 * 1024 * 1024,
+        max_redirects: int = 5,
+        idle_timeout: float = 30.0,
+        user_agent: str = "Mozilla/5.0 (compatible; singapore-hackathon-2024)",
+        proxies: dict[str, str] | None = None,
+    ) -> None:
+        """Initializes the fetcher.
+
+        Args:
+            max_connections: The maximum number of requests in flight.
+            max_connections_per_host: The maximum number of requests in flight per host.
+            connect_timeout: The timeout to open a connection, in seconds.
+            read_timeout: The timeout of each read from a connection, in seconds.
+            total_timeout: The timeout of a whole fetch including redirects, in seconds.
+            max_body_bytes: The maximum number of decoded bytes to read from a body.
+                Longer bodies are truncated.
+            max_redirects: The maximum number of redirects to follow.
+            idle_timeout: How long an idle connection is kept for reuse, in seconds.
+            user_agent: The User-Agent header to send.
+            proxies: The URLs of the HTTP proxies by scheme, e.g. {"https": "http://proxy:3128"},
+                as returned by `urllib.request.getproxies`. None to read them from the
+                environment. The hosts that `urllib.request.proxy_bypass` excludes, e.g.
+                those of `no_proxy`, are reached directly.
+        """
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_timeout = total_timeout
+        self.max_body_bytes = max_body_bytes
+        self.max_redirects = max_redirects
+        self.idle_timeout = idle_timeout
+        self.user_agent = user_agent
+        self.proxies = urllib.request.getproxies() if proxies is None else proxies
+        self._ssl_context = ssl.create_default_context()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._reset()
+
+    async def fetch(
+        self,
+        url: str,
+        *,
+        content_types: Iterable[str] | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> Page:
+        """Fetches a page, following redirects.
+
+        Args:
+            url: The URL to fetch.
+            content_types: The accepted content types, e.g. ["text/html"]. The body
+                of any other content type is not downloaded.
+            headers: Extra request headers, e.g. for a conditional request.
+
+        Returns:
+            The page. It is empty, with status 304, if a conditional request
+            found it unchanged.
+
+        Raises:
+            FetchError: The page cannot be fetched.
+            NotImplementedError: The content type is not accepted.
+            TimeoutError: The fetch took too long.
+        """
+        self._bind_to_running_loop()
+        async with asyncio.timeout(self.total_timeout):
+            for _ in range(self.max_redirects + 1):
+                page_or_location = await self._fetch_once(url, content_types, headers)
+                if isinstance(page_or_location, Page):
+                    return page_or_location
+                url = urllib.parse.urljoin(url, page_or_location)
+        raise FetchError(f"Too many redirects for {url}.")
+
+    async def close(self) -> None:
+        """Closes all idle connections."""
+        self._close_idle()
+
+    def _close_idle(self) -> None:
+        for connections in self._idle.values():
+            for connection in connections:
+                connection.close()
+        self._idle.clear()
+
+    def _reset(self) -> None:
+        self._idle: dict[_Key, collections.deque[_Connection]] = {}
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        # The semaphores of the hosts with requests in flight, and the number
+        # of those requests, so that they are dropped once unused.
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+        self._host_requests: collections.Counter[str] = collections.Counter()
+
+    def _bind_to_running_loop(self) -> None:
+        # Connections and semaphores belong to the loop that created them.
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            if self._loop is not None:
+                self._close_idle()
+            self._loop = loop
+            self._reset()
+
+    async def _fetch_once(
+        self,
+        url: str,
+        content_types: Iterable[str] | None,
+        headers: dict[str, str] | None,
+    ) -> Page | str:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise FetchError(f"Unsupported URL: {url}.")
+        host = parts.hostname.encode("idna").decode("ascii")
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        proxy = self._proxy(parts.scheme, host)
+        key = (parts.scheme, host, port, proxy)
+        target = urllib.parse.quote(parts.path or "/", safe="/%:@&=+$,;~!*'()")
+        if parts.query:
+            target += "?" + urllib.parse.quote(parts.query, safe="/%:@&=+$,;~!*'()?")
+        if proxy and parts.scheme == "http":
+            # A plain HTTP proxy is sent the whole URL.
+            target = f"http://{_authority(host, port)}{target}"
+
+        host_semaphore = self._host_semaphores.get(host)
+        if host_semaphore is None:
+            host_semaphore = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_semaphores[host] = host_semaphore
+        self._host_requests[host] += 1
+        try:
+            async with self._semaphore, host_semaphore:
+                return await self._fetch_from(key, url, target, content_types, headers)
+        finally:
+            self._host_requests[host] -= 1
+            if not self._host_requests[host]:
+                del self._host_requests[host]
+                del self._host_semaphores[host]
+
+    async def _fetch_from(
+        self,
+        key: _Key,
+        url: str,
+        target: str,
+        content_types: Iterable[str] | None,
+        headers: dict[str, str] | None,
+    ) -> Page | str:
+        response = await self._request(key, target, headers)
+        try:
+            if response.status in _REDIRECT_STATUSES and (
+                location := response.headers.get("location")
+            ):
+                # A redirect body is not read, so that its size does not
+                # matter: unless empty, its connection is closed, not reused.
+                if response.headers.get("content-length", "").strip() == "0":
+                    response.complete = True
+                return location
+            if response.status >= 400:
+                raise FetchError(f"HTTP {response.status} for {url}.")
+            if response.status == 304:
+                async for _ in self._read_body(response):
+                    pass
+                return Page(
+                    url=url,
+                    status=304,
+                    headers=response.headers,
+                    content_type="",
+                    charset="",
+                    text="",
+                    truncated=False,
+                )
+
+            content_type, charset = _parse_content_type(
+                response.headers.get("content-type", "")
+            )
+            if content_types is not None and content_type not in content_types:
+                raise NotImplementedError(f"Content type {content_type} not supported")
+
+            text, charset, truncated = await self._read_text(response, charset)
+            return Page(
+                url=url,
+                status=response.status,
+                headers=response.headers,
+                content_type=content_type,
+                charset=charset,
+                text=text,
+                truncated=truncated,
+            )
+        finally:
+            self._release(response)
+
+    def _proxy(self, scheme: str, host: str) -> str | None:
+        proxy = self.proxies.get(scheme)
+        if not proxy or urllib.request.proxy_bypass(host):
+            return None
+        if "://" not in proxy:
+            proxy = f"http://{proxy}"
+        if not proxy.startswith("http://"):
+            raise FetchError(f"Unsupported proxy: {proxy}.")
+        return proxy
+
+    async def _request(
+        self, key: _Key, target: str, headers: dict[str, str] | None
+    ) -> _Response:
+        scheme, host, port, proxy = key
+        headers = dict(headers or {})
+        if (
+            proxy
+            and scheme == "http"
+            and (authorization := _proxy_authorization(proxy))
+        ):
+            headers["Proxy-Authorization"] = authorization
+        extra_headers = "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        request = (
+            f"GET {target} HTTP/1.1\r\n"
+            f"Host: {_authority(host, port)}\r\n"
+            f"User-Agent: {self.user_agent}\r\n"
+            "Accept: text/html,application/xhtml+xml,*/*;q=0.8\r\n"
+            "Accept-Encoding: gzip, deflate\r\n"
+            "Connection: keep-alive\r\n"
+            f"{extra_headers}"
+            "\r\n"
+        ).encode("latin-1")
+
+        while True:
+            connection = await self._connect(key)
+            try:
+                connection.writer.write(request)
+                await asyncio.wait_for(connection.writer.drain(), self.read_timeout)
+                return await self._read_head(connection)
+            except (ConnectionError, asyncio.IncompleteReadError, FetchError):
+                connection.close()
+                if not connection.reused:
+                    raise
+                # The server closed the idle connection. Try a fresh one.
+            except BaseException:
+                connection.close()
+                raise
+
+    async def _connect(self, key: _Key) -> _Connection:
+        self._expire_idle()
+        idle = self._idle.get(key)
+        while idle:
+            connection = idle.pop()
+            if not idle:
+                del self._idle[key]
+            if not connection.reader.at_eof():
+                connection.reused = True
+                return connection
+            connection.close()
+
+        scheme, host, port, proxy = key
+        if proxy is None:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    host,
+                    port,
+                    ssl=self._ssl_context if scheme == "https" else None,
+                ),
+                self.connect_timeout,
+            )
+            return _Connection(key, reader, writer)
+
+        proxy_parts = urllib.parse.urlsplit(proxy)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(proxy_parts.hostname, proxy_parts.port or 80),
+            self.connect_timeout,
+        )
+        connection = _Connection(key, reader, writer)
+        if scheme == "https":
+            try:
+                await asyncio.wait_for(self._tunnel(connection), self.connect_timeout)
+            except BaseException:
+                connection.close()
+                raise
+        return connection
+
+    async def _tunnel(self, connection: _Connection) -> None:
+        """Opens a TLS tunnel to the server through the proxy."""
+        _, host, port, proxy = connection.key
+        assert proxy
+        authorization = _proxy_authorization(proxy)
+        connection.writer.write(
+            (
+                f"CONNECT {host}:{port} HTTP/1.1\r\n"
+                f"Host: {host}:{port}\r\n"
+                + (f"Proxy-Authorization: {authorization}\r\n" if authorization else "")
+                + "\r\n"
+            ).encode("latin-1")
+        )
+        await connection.writer.drain()
+        response = await self._read_head(connection)
+        if not 200 <= response.status < 300:
+            raise FetchError(
+                f"The proxy refused to connect to {host}:{port}: HTTP {response.status}."
+            )
+        await connection.writer.start_tls(self._ssl_context, server_hostname=host)
+
+    async def _read_head(self, connection: _Connection) -> _Response:
+        while True:
+            status_line = await self._readline(connection)
+            if not status_line:
+                raise asyncio.IncompleteReadError(b"", None)
+            try:
+                _, status, *_ = status_line.decode("latin-1").split(" ", 2)
+                status_code = int(status)
+            except ValueError as e:
+                raise FetchError(f"Malformed status line: {status_line!r}.") from e
+
+            headers: dict[str, str] = {}
+            while line := (await self._readline(connection)).rstrip(b"\r\n"):
+                name, _, value = line.decode("latin-1").partition(":")
+                name = name.strip().lower()
+                value = value.strip()
+                headers[name] = (
+                    f"{headers[name]}, {value}" if name in headers else value
+                )
+            # Interim responses, such as 100 Continue, precede the final one.
+            if not 100 <= status_code < 200:
+                return _Response(connection, status_code, headers)
+            if status_code == 101:
+                raise FetchError("Unexpected protocol switch.")
+
+    async def _readline(self, connection: _Connection) -> bytes:
+        return await asyncio.wait_for(connection.reader.readline(), self.read_timeout)
+
+    async def _read_text(
+        self, response: _Response, charset: str | None
+    ) -> tuple[str, str, bool]:
+        """Decodes the body as a stream, stopping at the size limit."""
+        decoder = None
+        pieces: list[str] = []
+        size = 0
+        truncated = False
+        async for chunk in self._read_body(response):
+            if size + len(chunk) > self.max_body_bytes:
+                chunk = chunk[: self.max_body_bytes - size]
+                truncated = True
+            size += len(chunk)
+            if decoder is None:
+                charset = _lookup_charset(charset or _sniff_charset(chunk))
+                decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+            pieces.append(decoder.decode(chunk))
+            if truncated:
+                break
+        if decoder:
+            pieces.append(decoder.decode(b"", final=True))
+        return "".join(pieces), charset or "utf-8", truncated
+
+    async def _read_body(self, response: _Response) -> AsyncIterator[bytes]:
+        """Yields the decompressed body in chunks."""
+        if response.status in (204, 304):
+            response.complete = True
+            return
+
+        encoding = response.headers.get("content-encoding", "identity").lower()
+        if encoding == "gzip":
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == "deflate":
+            decompressor = zlib.decompressobj()
+        elif encoding == "identity":
+            decompressor = None
+        else:
+            raise FetchError(f"Unsupported content encoding: {encoding}.")
+
+        async for chunk in self._read_raw_body(response):
+            if not decompressor:
+                yield chunk
+                continue
+            # The reader stops at its size limit between the pieces.
+            while chunk:
+                piece = decompressor.decompress(chunk, _DECOMPRESS_CHUNK_BYTES)
+                chunk = decompressor.unconsumed_tail
+                if piece:
+                    yield piece
+        if decompressor and (tail := decompressor.flush()):
+            yield tail
+
+    async def _read_raw_body(self, response: _Response) -> AsyncIterator[bytes]:
+        reader = response.connection.reader
+        if "chunked" in response.headers.get("transfer-encoding", "").lower():
+            while True:
+                size_line = await self._readline(response.connection)
+                size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+                if size == 0:
+                    # Skip the trailers.
+                    while (await self._readline(response.connection)).strip():
+                        pass
+                    break
+                yield await self._readexactly(reader, size)
+                await self._readexactly(reader, 2)
+            response.complete = True
+        elif "content-length" in response.headers:
+            remaining = int(response.headers["content-length"])
+            while remaining > 0:
+                chunk = await self._read(reader, min(remaining, 64 * 1024))
+                if not chunk:
+                    raise FetchError("Connection closed before the end of the body.")
+                remaining -= len(chunk)
+                yield chunk
+            response.complete = True
+        else:
+            # The body ends when the server closes the connection.
+            while chunk := await self._read(reader, 64 * 1024):
+                yield chunk
+
+    async def _read(self, reader: asyncio.StreamReader, size: int) -> bytes:
+        return await asyncio.wait_for(reader.read(size), self.read_timeout)
+
+    async def _readexactly(self, reader: asyncio.StreamReader, size: int) -> bytes:
+        return await asyncio.wait_for(reader.readexactly(size), self.read_timeout)
+
+    def _release(self, response: _Response) -> None:
+        connection = response.connection
+        if (
+            not response.complete
+            or response.headers.get("connection", "").lower() == "close"
+        ):
+            connection.close()
+            return
+        connection.idle_since = time.monotonic()
+        idle = self._idle.setdefault(connection.key, collections.deque())
+        idle.append(connection)
+        if len(idle) > self.max_connections_per_host:
+            idle.popleft().close()
+        self._expire_idle()
+        # Close the longest idle connections over the global cap.
+        while sum(len(idle) for idle in self._idle.values()) > self.max_connections:
+            key = min(self._idle, key=lambda key: self._idle[key][0].idle_since)
+            self._idle[key].popleft().close()
+            if not self._idle[key]:
+                del self._idle[key]
+
+    def _expire_idle(self) -> None:
+        """Closes the connections idle for longer than the idle timeout."""
+        expired = time.monotonic() - self.idle_timeout
+        for key in list(self._idle):
+            idle = self._idle[key]
+            # The oldest connections are on the left.
+            while idle and idle[0].idle_since < expired:
+                idle.popleft().close()
+            if not idle:
+                del self._idle[key]
+
+
+def _authority(host: str, port: int) -> str:
+    """Returns the host, with the port unless it is the default one."""
+    return host if port in (80, 443) else f"{host}:{port}"
+
+
+def _proxy_authorization(proxy: str) -> str | None:
+    parts = urllib.parse.urlsplit(proxy)
+    if parts.username is None:
+        return None
+    credentials = (
+        f"{urllib.parse.unquote(parts.username)}:"
+        f"{urllib.parse.unquote(parts.password or '')}"
+    )
+    return "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+
+
+def _parse_content_type(header: str) -> tuple[str, str | None]:
+    content_type, *params = header.split(";")
+    charset = None
+    for param in params:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            charset = value.strip().strip("\"'")
+    return content_type.strip().lower(), charset
+
+
+def _sniff_charset(head: bytes) -> str | None:
+    match = _CHARSET_PATTERN.search(head[:4096])
+    return match.group(1).decode("ascii") if match else None
+
+
+def _lookup_charset(charset: str | None) -> str:
+    try:
+        return codecs.lookup(charset or "utf-8").name
+    except LookupError:
+        logging.warning("Unknown charset %s. Falling back to UTF-8.", charset)
+        return "utf-8"
+
+
+_FETCHER: Fetcher | None = None
+
+
+def configure(**kwargs) -> None:
+    """Replaces the shared fetcher with one of the given limits.
+
+    Args:
+        **kwargs: The arguments to `Fetcher`.
+    """
+    global _FETCHER
+    _FETCHER = Fetcher(**kwargs)
+
+
+def get_fetcher() -> Fetcher:
+    """Returns the fetcher shared by all tools."""
+    global _FETCHER
+    if _FETCHER is None:
+        _FETCHER = Fetcher()
+    return _FETCHER
@@ -0,0 +1,302 @@
+"""Extraction of the text and links of HTML pages.
+
+The page is tokenized in a single pass, without building a tree, so the cost
+is linear in the size of the page and deep nesting cannot overflow the stack.
+Big pages can be extracted in the process pool shared with the tools, to keep
+the event loop free.
+The text can also be split into passages, each with the anchor it is under.
+"""
+
+import asyncio
+from goog.tool_policy import shared_process_pool
+from html.parser import HTMLParser
+from pydantic import BaseModel
+
+_SKIPPED_TAGS = frozenset(["script", "style", "iframe", "noscript", "template"])
+_HEADING_TAGS = frozenset(["h1", "h2", "h3", "h4", "h5", "h6"])
+# Tags that end a block of text. Blocks are never split across one of these.
+_BLOCK_TAGS = _HEADING_TAGS | frozenset(
+    [
+        "address",
+        "article",
+        "aside",
+        "blockquote",
+        "br",
+        "dd",
+        "div",
+        "dl",
+        "dt",
+        "figcaption",
+        "footer",
+        "header",
+        "hr",
+        "li",
+        "main",
+        "nav",
+        "ol",
+        "p",
+        "pre",
+        "section",
+        "table",
+        "td",
+        "th",
+        "tr",
+        "ul",
+    ]
+)
+_FEED_CHARS = 64 * 1024
+_OFFLOAD_CHARS = 256 * 1024
+
+
+class ExtractedText(BaseModel):
+    """The text of a page."""
+
+    title: str
+    text: str
+    truncated: bool
+
+
+class Passage(BaseModel):
+    """A passage of the text of a page."""
+
+    text: str
+    heading: str | None
+    # The id of the closest element at or before the passage, to link to it.
+    anchor: str | None
+
+
+class ChunkedText(BaseModel):
+    """The passages of a page."""
+
+    title: str
+    passages: list[Passage]
+
+
+class _TextExtractor(HTMLParser):
+    """Collects the text of the body, formatting external links in markdown.
+
+    Comments are dropped, since `handle_comment` is not overridden.
+    """
+
+    def __init__(self, max_chars: int | None) -> None:
+        super().__init__(convert_charrefs=True)
+        self.max_chars = max_chars
+        self.title: list[str] = []
+        self.parts: list[str] = []
+        self.chars = 0
+        self.done = False
+        self._skip_depth = 0
+        self._in_head = False
+        self._in_body = False
+        self._in_title = False
+        self._link_href: str | None = None
+        self._link_text: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag == "head":
+            self._in_head = True
+        elif tag == "body":
+            self._in_head = False
+            self._in_body = True
+        elif tag == "title" and not self._in_body:
+            # Only the title of the head: an SVG in the body has its own.
+            self._in_title = True
+        elif tag == "a":
+            self._end_link()
+            href = dict(attrs).get("href") or ""
+            # Links to JavaScript and anchors keep only their text.
+            self._link_href = href if href.startswith(("http://", "https://")) else None
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "head":
+            self._in_head = False
+        elif tag == "title":
+            self._in_title = False
+        elif tag == "a":
+            self._end_link()
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self.title.append(data)
+        elif self._skip_depth or self._in_head or self.done:
+            return
+        elif self._link_href is not None:
+            self._link_text.append(data)
+        else:
+            self._append(data)
+
+    def close(self) -> None:
+        super().close()
+        self._end_link()
+
+    def _end_link(self) -> None:
+        if self._link_href is not None:
+            self._append(f"[{''.join(self._link_text)}]({self._link_href})")
+        self._link_href = None
+        self._link_text = []
+
+    def _append(self, text: str) -> None:
+        if self.done:
+            return
+        if self.max_chars is not None and self.chars + len(text) >= self.max_chars:
+            text = text[: self.max_chars - self.chars]
+            self.done = True
+        self.parts.append(text)
+        self.chars += len(text)
+
+
+class _PassageExtractor(_TextExtractor):
+    """Collects the text of the body as blocks, each with its heading and anchor."""
+
+    def __init__(self) -> None:
+        super().__init__(max_chars=None)
+        self.blocks: list[Passage] = []
+        self._heading: str | None = None
+        self._in_heading = False
+        self._anchor: str | None = None
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, str | None]]) -> None:
+        if tag in _BLOCK_TAGS:
+            self._end_block()
+            self._in_heading = tag in _HEADING_TAGS
+        anchor = dict(attrs).get("id") or (tag == "a" and dict(attrs).get("name"))
+        if anchor and not self._skip_depth and not self._in_head:
+            if not "".join(self.parts).strip():
+                self._anchor = anchor
+        super().handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag: str) -> None:
+        super().handle_endtag(tag)
+        if tag in _BLOCK_TAGS:
+            self._end_block()
+
+    def close(self) -> None:
+        super().close()
+        self._end_block()
+
+    def _end_block(self) -> None:
+        self._end_link()
+        text = " ".join("".join(self.parts).split())
+        self.parts = []
+        if text:
+            if self._in_heading:
+                self._heading = text
+            self.blocks.append(
+                Passage(text=text, heading=self._heading, anchor=self._anchor)
+            )
+        self._in_heading = False
+
+
+def chunk_passages(html: str, *, max_words: int = 200) -> ChunkedText:
+    """Splits the text of the body of a page into passages.
+
+    Consecutive blocks of text, such as paragraphs and list items, are merged
+    into passages of up to `max_words` words. A heading always starts a new
+    passage, and a block longer than `max_words` is split.
+
+    Args:
+        html: The page.
+        max_words: The maximum number of words in a passage.
+
+    Returns:
+        The title of the page and its passages in the order of the page.
+    """
+    extractor = _PassageExtractor()
+    extractor.feed(html)
+    extractor.close()
+
+    passages: list[Passage] = []
+    words: list[str] = []
+    first: Passage | None = None
+    for block in extractor.blocks:
+        if first is not None and (
+            block.heading != first.heading
+            or len(words) + len(block.text.split()) > max_words
+        ):
+            passages.append(first.model_copy(update={"text": " ".join(words)}))
+            words, first = [], None
+        block_words = block.text.split()
+        while len(block_words) > max_words:
+            passages.append(
+                block.model_copy(update={"text": " ".join(block_words[:max_words])})
+            )
+            block_words = block_words[max_words:]
+        if block_words:
+            words += block_words
+            first = first or block
+    if first is not None:
+        passages.append(first.model_copy(update={"text": " ".join(words)}))
+    return ChunkedText(title=_title_of(extractor), passages=passages)
+
+
+async def chunk_passages_async(html: str, *, max_words: int = 200) -> ChunkedText:
+    """Splits the text of a page like `chunk_passages`, in a process pool if the page is big."""
+    if len(html) < _OFFLOAD_CHARS:
+        return chunk_passages(html, max_words=max_words)
+    return await asyncio.get_running_loop().run_in_executor(
+        shared_process_pool(), _chunk_passages, html, max_words
+    )
+
+
+def extract_text(html: str, *, max_chars: int | None = None) -> ExtractedText:
+    """Extracts the title and the text of the body of a page.
+
+    Scripts, styles, frames and comments are skipped. Links to other pages
+    are kept in markdown.
+
+    Args:
+        html: The page.
+        max_chars: The maximum length of the text. None for no limit.
+
+    Returns:
+        The title and the text of the page.
+    """
+    extractor = _TextExtractor(max_chars)
+    # Feed the page piece by piece, so that parsing stops once the text is full.
+    for start in range(0, len(html), _FEED_CHARS):
+        extractor.feed(html[start : start + _FEED_CHARS])
+        if extractor.done:
+            break
+    else:
+        extractor.close()
+    return ExtractedText(
+        title=_title_of(extractor),
+        text="".join(extractor.parts),
+        truncated=extractor.done,
+    )
+
+
+async def extract_text_async(
+    html: str, *, max_chars: int | None = None
+) -> ExtractedText:
+    """Extracts the text of a page like `extract_text`, in a process pool if the page is big.
+
+    Args:
+        html: The page.
+        max_chars: The maximum length of the text. None for no limit.
+
+    Returns:
+        The title and the text of the page.
+    """
+    if len(html) < _OFFLOAD_CHARS:
+        return extract_text(html, max_chars=max_chars)
+
+    return await asyncio.get_running_loop().run_in_executor(
+        shared_process_pool(), _extract_text, html, max_chars
+    )
+
+
+def _title_of(extractor: _TextExtractor) -> str:
+    return "".join(extractor.title).strip() or "No title found"
+
+
+def _extract_text(html: str, max_chars: int | None) -> ExtractedText:
+    return extract_text(html, max_chars=max_chars)
+
+
+def _chunk_passages(html: str, max_words: int) -> ChunkedText:
+    return chunk_passages(html, max_words=max_words)
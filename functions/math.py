@@ -2,55 +2,122 @@
 
 import ast
 import datetime
+import functools
+from goog.decorators import memoize, run_in
 import logging
+import math as _math
 import operator
-
-
-def _evaluate_arithmetic_expression(expression_str: str):
+import re
+import time
+from typing import Any
+
+_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+# Results are returned as floats, so nothing larger can be represented.
+_MAX_MAGNITUDE = 1.7e308
+_MAX_EXPRESSION_CHARS = 1_000
+_MAX_EVALUATION_SECONDS = 0.1
+_MAX_BATCH_EXPRESSIONS = 100
+# A name, then a single "=", so that "x == 1" is not taken for an assignment.
+_ASSIGNMENT_PATTERN = re.compile(r"\s*([^\W\d]\w*)\s*=(?!=)(.*)", re.DOTALL)
+
+
+def _evaluate_arithmetic_expression(
+    expression_str: str, variables: dict[str, float] | None = None
+):
     """Evaluates a string containing a valid arithmetic expression.
 
+    The evaluation is bounded: powers whose result would be too large to be
+    represented are refused before they are computed, and so is any result
+    out of the range of a float.
+
     Args:
         expression_str: The string representation of the arithmetic expression.
+        variables: The values of the names used in the expression.
 
     Returns:
-        The calculated result of the expression, or None if the expression is
-        invalid.
-    """
+        The calculated result of the expression.
 
-    # Define allowed operators
-    allowed_operators = {
-        ast.Add: operator.add,
-        ast.Sub: operator.sub,
-        ast.Mult: operator.mul,
-        ast.Div: operator.truediv,
-        ast.Pow: operator.pow,
-        ast.USub: operator.neg,
-    }
-
-    # Parse the expression into an AST
-    tree = ast.parse(expression_str, mode="eval").body
+    Raises:
+        ValueError: The expression is invalid or out of bounds.
+    """
+    variables = variables or {}
+    deadline = time.monotonic() + _MAX_EVALUATION_SECONDS
 
     # Function to recursively evaluate the AST nodes
     def eval_node(node):
+        if time.monotonic() > deadline:
+            raise ValueError("Expression takes too long to evaluate")
         if isinstance(node, ast.Constant):
-            return node.n
+            return node.value
+        elif isinstance(node, ast.Name):
+            if node.id not in variables:
+                raise ValueError(f"Unknown variable {node.id}")
+            return variables[node.id]
         elif isinstance(node, ast.BinOp):
-            op = allowed_operators.get(type(node.op))
-            if op is None:
-                raise ValueError("Invalid operator")
-            return op(eval_node(node.left), eval_node(node.right))
-        elif isinstance(node, ast.UnaryOp):
-            op = allowed_operators.get(type(node.op))
-            if op is None:
-                raise ValueError("Invalid operator")
-            return op(eval_node(node.operand))
+            left = eval_node(node.left)
+            right = eval_node(node.right)
+            if isinstance(node.op, ast.Pow):
+                _check_power(left, right)
+            return _check_magnitude(_OPERATORS[type(node.op)](left, right))
         else:
+            return _OPERATORS[type(node.op)](eval_node(node.operand))
+
+    return eval_node(_parse(expression_str))
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse(expression_str: str) -> ast.expr:
+    """Parses and validates an arithmetic expression.
+
+    Raises:
+        ValueError: The expression is not arithmetic.
+    """
+    if len(expression_str) > _MAX_EXPRESSION_CHARS:
+        raise ValueError("Expression too long")
+    try:
+        tree = ast.parse(expression_str, mode="eval").body
+    except SyntaxError as e:
+        raise ValueError(f"Invalid expression: {e.msg}") from e
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.BinOp, ast.UnaryOp)):
+            if type(node.op) not in _OPERATORS:
+                raise ValueError("Invalid operator")
+        elif isinstance(node, ast.Constant):
+            if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+                raise ValueError("Invalid constant")
+        elif not isinstance(node, (ast.Name, ast.Load, ast.operator, ast.unaryop)):
             raise ValueError("Invalid expression")
+    return tree
+
+
+def _check_power(base: float, exponent: float) -> None:
+    """Refuses a power too large to be represented, before computing it."""
+    if base == 0:
+        return
+    if exponent * _math.log10(abs(base)) > _math.log10(_MAX_MAGNITUDE):
+        raise ValueError("Result too large")
+
 
-    return eval_node(tree)
+def _check_magnitude(value: Any) -> Any:
+    if isinstance(value, complex):
+        raise ValueError("Result is not a real number")
+    if abs(value) > _MAX_MAGNITUDE:
+        raise ValueError("Result too large")
+    return value
 
 
-async def math(expression: str) -> float:
+# The evaluation is bounded, so it is cheap enough for the event loop.
+@run_in("inline")
+@memoize()
+def math(expression: str) -> float:
     """Evaluates a arithmetic expression.
 
     Args:
@@ -63,7 +130,48 @@ async def math(expression: str) -> float:
     return float(_evaluate_arithmetic_expression(expression))
 
 
-async def diff_date(a: str, b: str) -> int:
+@run_in("inline")
+@memoize()
+def math_batch(expressions: list[str]) -> list[dict[str, Any]]:
+    """Evaluates many arithmetic expressions at once, in order.
+
+    An expression can be named with an assignment, such as "r = 2.5", and
+    the following expressions can use the name, such as "3.14159 * r ** 2".
+
+    Args:
+        expressions: The arithmetic expressions to evaluate, possibly as assignments.
+
+    Returns:
+        The result of each expression, or the error that prevented it.
+    """
+    logging.info("Evaluating %d expressions.", len(expressions))
+    if len(expressions) > _MAX_BATCH_EXPRESSIONS:
+        raise ValueError(
+            f"At most {_MAX_BATCH_EXPRESSIONS} expressions can be evaluated at once."
+        )
+
+    variables: dict[str, float] = {}
+    results: list[dict[str, Any]] = []
+    for expression in expressions:
+        name: str | None = None
+        if assignment := _ASSIGNMENT_PATTERN.fullmatch(expression):
+            name, expression = assignment[1], assignment[2].strip()
+        try:
+            result = float(_evaluate_arithmetic_expression(expression, variables))
+        except (ArithmeticError, ValueError) as e:
+            results.append({"expression": expression, "error": str(e)})
+            continue
+        if name:
+            variables[name] = result
+            results.append({"name": name, "expression": expression, "result": result})
+        else:
+            results.append({"expression": expression, "result": result})
+    return results
+
+
+@run_in("inline")
+@memoize()
+def diff_date(a: str, b: str) -> int:
     """Calculates the difference between two dates.
 
     Args:
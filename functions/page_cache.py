@@ -0,0 +1,341 @@
+"""A persistent cache of fetched pages and of what was extracted from them.
+
+Pages are stored compressed with their validators and revalidated with
+conditional requests once stale, following their `Cache-Control` header.
+What is extracted from a page, such as its text, is stored by the digest of
+the page, so a hit skips parsing, even when an unchanged page had to be
+downloaded again.
+"""
+
+import asyncio
+import email.utils
+from functions.fetch import Page, get_fetcher
+import gzip
+import hashlib
+import json
+import logging
+import os
+from pydantic import BaseModel
+import tempfile
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+# The freshness given to pages with a Last-Modified header but no explicit
+# lifetime is a tenth of their age, as suggested by RFC 9111, up to this.
+_MAX_HEURISTIC_FRESHNESS_SECONDS = 24 * 60 * 60
+
+
+class PageCacheStats(BaseModel):
+    """Counters of a page cache."""
+
+    fresh_hits: int = 0
+    revalidated: int = 0
+    downloads: int = 0
+    extraction_hits: int = 0
+    extractions: int = 0
+
+
+class _Entry(BaseModel):
+    url: str
+    digest: str
+    stored_at: float
+    expires_at: float
+    etag: str | None
+    last_modified: str | None
+    status: int
+    headers: dict[str, str]
+    content_type: str
+    charset: str
+    truncated: bool
+
+
+class PageCache:
+    """Caches pages and their extractions on disk."""
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        max_bytes: int = 512 * 1024 * 1024,
+        max_age_seconds: float = 7 * 24 * 60 * 60,
+    ) -> None:
+        """Initializes the cache.
+
+        Args:
+            directory: The directory of the cache.
+            max_bytes: The maximum total size of the files of the cache.
+            max_age_seconds: How long a file is kept after it was last used.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.stats = PageCacheStats()
+        os.makedirs(directory, exist_ok=True)
+
+    async def extract(
+        self,
+        url: str,
+        variant: str,
+        extractor: Callable[[Page], Awaitable[Any]],
+        *,
+        content_types: Iterable[str] | None = None,
+    ) -> Any:
+        """Extracts something from a page, fetching the page only if needed.
+
+        Args:
+            url: The URL of the page.
+            variant: The name of what is extracted, e.g. "text".
+            extractor: Extracts a JSON-serializable value from the page.
+            content_types: The accepted content types of the page.
+
+        Returns:
+            The extracted value.
+        """
+        entry = await asyncio.to_thread(self._read_entry, url)
+        if entry is not None and entry.expires_at > time.time():
+            self.stats.fresh_hits += 1
+        else:
+            entry, page = await self._fetch(url, entry, content_types)
+            if entry is None:
+                # The page must not be stored.
+                self.stats.extractions += 1
+                return await extractor(page)
+
+        extraction = await asyncio.to_thread(
+            self._read_json, self._path(entry.digest, f"{variant}.json.gz")
+        )
+        if extraction is not None:
+            self.stats.extraction_hits += 1
+            return extraction
+
+        text = await asyncio.to_thread(
+            self._read_text, self._path(entry.digest, "body.gz")
+        )
+        if text is None:
+            # The body was evicted. Download the page again.
+            entry, page = await self._fetch(url, None, content_types)
+            if entry is None:
+                self.stats.extractions += 1
+                return await extractor(page)
+        else:
+            page = Page(
+                url=entry.url,
+                status=entry.status,
+                headers=entry.headers,
+                content_type=entry.content_type,
+                charset=entry.charset,
+                text=text,
+                truncated=entry.truncated,
+            )
+
+        self.stats.extractions += 1
+        extraction = await extractor(page)
+        path = self._path(entry.digest, f"{variant}.json.gz")
+        # The extraction is already in hand, so a failed write only costs a
+        # later miss.
+        try:
+            await asyncio.to_thread(self._write, path, json.dumps(extraction))
+        except OSError as e:
+            logging.warning("Failed to write the page cache file %s: %r.", path, e)
+        return extraction
+
+    async def _fetch(
+        self, url: str, entry: _Entry | None, content_types: Iterable[str] | None
+    ) -> tuple[_Entry | None, Page]:
+        """Revalidates or downloads a page.
+
+        Returns:
+            The new entry, or None if the page must not be stored, and the page.
+            The page is empty if it was revalidated.
+        """
+        headers = {}
+        if entry and entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry and entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        page = await get_fetcher().fetch(
+            url, content_types=content_types, headers=headers
+        )
+
+        if page.status == 304 and entry is not None:
+            self.stats.revalidated += 1
+            freshness = _freshness_seconds({**entry.headers, **page.headers})
+            entry = entry.model_copy(
+                update={"expires_at": time.time() + (freshness or 0)}
+            )
+            await asyncio.to_thread(self._write_entry, entry)
+            return entry, page
+
+        self.stats.downloads += 1
+        freshness = _freshness_seconds(page.headers)
+        if freshness is None:
+            return None, page
+
+        digest = hashlib.sha256(page.text.encode("utf-8")).hexdigest()
+        entry = _Entry(
+            url=url,
+            digest=digest,
+            stored_at=time.time(),
+            expires_at=time.time() + freshness,
+            etag=page.headers.get("etag"),
+            last_modified=page.headers.get("last-modified"),
+            status=page.status,
+            headers=page.headers,
+            content_type=page.content_type,
+            charset=page.charset,
+            truncated=page.truncated,
+        )
+        await asyncio.to_thread(self._write_page, entry, page.text)
+        return entry, page
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def _entry_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self._path(key, "page.json.gz")
+
+    def _read_entry(self, url: str) -> _Entry | None:
+        entry = self._read_json(self._entry_path(url))
+        return _Entry.model_validate(entry) if entry is not None else None
+
+    def _read_json(self, path: str) -> Any:
+        text = self._read_text(path)
+        if text is None:
+            return None
+        try:
+            return json.loads(text)
+        except ValueError:
+            logging.warning("Corrupted page cache file %s.", path)
+            _remove_quietly(path)
+            return None
+
+    def _read_text(self, path: str) -> str | None:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                text = f.read()
+            # Mark the file as recently used, for eviction.
+            os.utime(path)
+            return text
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError):
+            logging.warning("Corrupted page cache file %s.", path)
+            _remove_quietly(path)
+            return None
+
+    def _write_entry(self, entry: _Entry) -> None:
+        self._write(self._entry_path(entry.url), entry.model_dump_json())
+
+    def _write_page(self, entry: _Entry, text: str) -> None:
+        self._write(self._path(entry.digest, "body.gz"), text)
+        self._write_entry(entry)
+
+    def _write(self, path: str, text: str) -> None:
+        """Writes a file of the cache, then evicts files over the limits."""
+        # A temporary file of its own, as the same page can be written by
+        # several threads at once.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(
+                raw, "wt", encoding="utf-8"
+            ) as f:
+                f.write(text)
+            os.replace(temp_path, path)
+        except BaseException:
+            _remove_quietly(temp_path)
+            raise
+        self._evict()
+
+    def _evict(self) -> None:
+        """Removes files unused for too long, then the least recently used ones.
+
+        Files are removed until the cache is under its size limit.
+        """
+        files = []
+        total_bytes = 0
+        now = time.time()
+        for file in os.scandir(self.directory):
+            if not file.name.endswith(".gz"):
+                continue
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.max_age_seconds:
+                _remove_quietly(file.path)
+                continue
+            files.append((stat.st_mtime, stat.st_size, file.path))
+            total_bytes += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total_bytes <= self.max_bytes:
+                break
+            _remove_quietly(path)
+            total_bytes -= size
+        logging.debug("Page cache holds %d bytes.", total_bytes)
+
+
+def _freshness_seconds(headers: dict[str, str]) -> float | None:
+    """Returns how long a response stays fresh, or None if it must not be stored."""
+    directives = {}
+    for directive in headers.get("cache-control", "").lower().split(","):
+        name, _, value = directive.strip().partition("=")
+        directives[name] = value.strip('"')
+    if "no-store" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    age = _to_float(headers.get("age")) or 0
+    if (max_age := _to_float(directives.get("max-age"))) is not None:
+        return max(0, max_age - age)
+
+    date = _to_timestamp(headers.get("date")) or time.time()
+    if (expires := _to_timestamp(headers.get("expires"))) is not None:
+        return max(0, expires - date - age)
+    if (last_modified := _to_timestamp(headers.get("last-modified"))) is not None:
+        return min(
+            max(0, (date - last_modified) / 10), _MAX_HEURISTIC_FRESHNESS_SECONDS
+        )
+    return 0
+
+
+def _to_float(value: str | None) -> float | None:
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _to_timestamp(value: str | None) -> float | None:
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() if value else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_PAGE_CACHE: PageCache | None = None
+
+
+def configure(directory: str | None, **kwargs) -> None:
+    """Sets the page cache of `functions.web`.
+
+    Args:
+        directory: The directory of the cache. None to disable the cache.
+        **kwargs: The other arguments to `PageCache`.
+    """
+    global _PAGE_CACHE
+    _PAGE_CACHE = PageCache(directory, **kwargs) if directory else None
+
+
+def get_page_cache() -> PageCache | None:
+    """Returns the page cache, if one is configured."""
+    return _PAGE_CACHE
@@ -0,0 +1,66 @@
+"""Local ranking of passages against a query."""
+
+import collections
+import math
+import re
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class Bm25Index:
+    """An in-memory inverted index scoring documents with BM25."""
+
+    def __init__(
+        self, documents: list[str], *, k1: float = 1.5, b: float = 0.75
+    ) -> None:
+        """Indexes the documents.
+
+        Args:
+            documents: The documents to rank.
+            k1: How quickly the score saturates with repeated terms.
+            b: How much the score is normalized by the length of the document.
+        """
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, list[tuple[int, int]]] = collections.defaultdict(list)
+        self._lengths: list[int] = []
+        for i, document in enumerate(documents):
+            terms = tokenize(document)
+            self._lengths.append(len(terms))
+            for term, count in collections.Counter(terms).items():
+                self._postings[term].append((i, count))
+        self._average_length = (
+            sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        )
+
+    def rank(self, query: str, *, top_k: int | None = None) -> list[tuple[int, float]]:
+        """Ranks the documents matching any term of the query.
+
+        Args:
+            query: The query.
+            top_k: The maximum number of documents to return. None for all matches.
+
+        Returns:
+            The indices of the documents and their scores, best first.
+        """
+        scores: dict[int, float] = collections.defaultdict(float)
+        documents = len(self._lengths)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (documents - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for i, count in postings:
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[i] / self._average_length
+                )
+                scores[i] += idf * count * (self.k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k] if top_k is not None else ranked
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits a text into lowercase word terms."""
+    return _TOKEN_PATTERN.findall(text.casefold())
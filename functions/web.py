@@ -1,7 +1,32 @@
-from bs4 import BeautifulSoup, Comment, NavigableString
-from googlesearch import search
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from functions.fetch import Page, get_fetcher
+from functions.html_text import (
+    Passage,
+    chunk_passages_async,
+    extract_text_async,
+)
+from functions.page_cache import get_page_cache
+from functions.ranking import Bm25Index
+from goog.tokens import estimate_text_tokens
 import logging
-import urllib.request
+import time
+from typing import Any, Awaitable, Callable
+
+
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="web_search")
+_SEARCH_CACHE_TTL_SECONDS = 60 * 60
+_SEARCH_CACHE_MAX_ENTRIES = 512
+_NUM_RESULTS_BUCKETS = (5, 10, 20, 50)
+_MAX_SCRAPED_CHARS = 200_000
+_PASSAGE_MAX_WORDS = 120
+_PASSAGE_TOKEN_BUDGET = 2_000
+
+# Normalized query -> (time searched, number of results requested, results).
+_search_cache: collections.OrderedDict[
+    str, tuple[float, int, list[tuple[str, str, str]]]
+] = collections.OrderedDict()
 
 
 async def web_search(query: str, num_results: int) -> str:
@@ -18,20 +43,65 @@ async def web_search(query: str, num_results: int) -> str:
     """
     logging.info(f"Searching the web for '{query}'.")
     try:
-        results = search(query, num_results=num_results, advanced=True)
+        results = await _cached_search(query, num_results)
 
         return "\n\n".join(
             [f"Search result for '{query}':"]
-            + [
-                f"{result.url}\n{result.title}\n{result.description}"
-                for result in results
-            ]
+            + [f"{url}\n{title}\n{description}" for url, title, description in results]
         )
     except Exception as e:
         raise RuntimeError(f"Failed to search the web for '{query}': {e}.") from e
 
 
-async def web_scrape(url: str) -> str:
+async def _cached_search(query: str, num_results: int) -> list[tuple[str, str, str]]:
+    """Searches on a worker thread, serving repeated queries from the cache.
+
+    A cached search with at least as many results serves any smaller request.
+    """
+    key = _normalize_query(query)
+    entry = _search_cache.get(key)
+    if entry is not None:
+        searched_at, requested, results = entry
+        if time.time() - searched_at > _SEARCH_CACHE_TTL_SECONDS:
+            del _search_cache[key]
+        # Fewer results than requested means there are no more to find.
+        elif requested >= num_results or len(results) < requested:
+            _search_cache.move_to_end(key)
+            return results[:num_results]
+
+    requested = _bucket_num_results(num_results)
+    results = await asyncio.get_running_loop().run_in_executor(
+        _SEARCH_EXECUTOR, _search, query, requested
+    )
+    _search_cache[key] = (time.time(), requested, results)
+    _search_cache.move_to_end(key)
+    while len(_search_cache) > _SEARCH_CACHE_MAX_ENTRIES:
+        _search_cache.popitem(last=False)
+    return results[:num_results]
+
+
+def _search(query: str, num_results: int) -> list[tuple[str, str, str]]:
+    # Deferred, as it pulls BeautifulSoup and requests in.
+    from googlesearch import search
+
+    return [
+        (result.url, result.title, result.description)
+        for result in search(query, num_results=num_results, advanced=True)
+    ]
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+def _bucket_num_results(num_results: int) -> int:
+    for bucket in _NUM_RESULTS_BUCKETS:
+        if num_results <= bucket:
+            return bucket
+    return num_results
+
+
+async def web_scrape(url: str, query: str = "") -> str:
     """Visit the given URL and return the content.
 
     The content will contain only text and links.
@@ -39,51 +109,77 @@ async def web_scrape(url: str) -> str:
 
     Args:
       url: The URL to visit.
+      query: What you are looking for on the page. If given, only the passages
+        most relevant to it are returned, instead of the whole page.
 
     Returns:
       A string containing the content of the page.
     """
     logging.info(f"Scraping the web for '{url}'.")
-    with urllib.request.urlopen(url) as response:
-        content_type = response.headers.get("Content-Type")
-
-        if "text/html" in content_type:
-            html_content = response.read().decode("utf-8")
-            soup = BeautifulSoup(html_content, "html.parser")
-            title_text = _extract_title(soup)
-            text_and_links = _extract_text_and_links(soup.body)
-            return f"URL: {url}\nTitle: {title_text}\n{text_and_links}"
-        else:
-            raise NotImplementedError(f"Content type {content_type} not supported")
-
-
-def _extract_title(soup):
-    title_tag = soup.find("title")
-    return title_tag.text if title_tag else "No title found"
-
-
-def _extract_text_and_links(element):
-    parts = []
-    for content in element:
-        if isinstance(content, NavigableString):
-            # Direct string, just add it
-            parts.append(str(content))
-        elif content.name == "a":
-            href = content.get("href", "")
-            # Check if the link is a JavaScript call or an anchor link
-            if href.startswith("http://") or href.startswith("https://"):
-                # It's a valid external or different page link, format it in markdown
-                parts.append(f"[{content.get_text()}]({href})")
-            else:
-                # Skip others like JavaScript calls and anchor links, add only the text
-                parts.append(content.get_text())
-        elif content.name in ["script", "style", "iframe", "noscript"]:
-            # Skip all elements that are usually not necessary for text extraction
-            continue
-        elif isinstance(content, Comment):
-            # Skip HTML comments
+    if not query:
+        extracted = await _extract(url, "text", _extract_page_text)
+        return f"URL: {url}\nTitle: {extracted['title']}\n{extracted['text']}"
+
+    extracted = await _extract(
+        url, f"passages-{_PASSAGE_MAX_WORDS}", _extract_page_passages
+    )
+    title = extracted["title"]
+    passages = [Passage.model_validate(passage) for passage in extracted["passages"]]
+    ranked = Bm25Index([passage.text for passage in passages]).rank(query)
+    selected = []
+    tokens = 0
+    for i, _ in ranked:
+        passage_tokens = estimate_text_tokens(passages[i].text)
+        if tokens + passage_tokens > _PASSAGE_TOKEN_BUDGET:
             continue
-        else:
-            # It's another tag, recurse
-            parts.append(_extract_text_and_links(content))
-    return "".join(parts)
+        selected.append(i)
+        tokens += passage_tokens
+    logging.info(
+        f"Kept {len(selected)} of {len(passages)} passages of '{url}' for '{query}'."
+    )
+    if not selected:
+        return f"URL: {url}\nTitle: {title}\nNo passage of the page matches '{query}'."
+
+    # Keep the order of the page, so that the passages read naturally.
+    return "\n\n".join(
+        [f"URL: {url}\nTitle: {title}\nPassages most relevant to '{query}':"]
+        + [
+            (
+                f"[{url}#{passages[i].anchor}]\n{passages[i].text}"
+                if passages[i].anchor
+                else passages[i].text
+            )
+            for i in sorted(selected)
+        ]
+    )
+
+
+async def _extract(
+    url: str, variant: str, extractor: Callable[[Page], Awaitable[Any]]
+) -> Any:
+    """Extracts something from a page, through the page cache if there is one."""
+    page_cache = get_page_cache()
+    if page_cache:
+        return await page_cache.extract(
+            url, variant, extractor, content_types=["text/html"]
+        )
+    return await extractor(await get_fetcher().fetch(url, content_types=["text/html"]))
+
+
+async def _extract_page_text(page: Page) -> dict[str, Any]:
+    if page.truncated:
+        logging.warning(f"Truncated the content of '{page.url}'.")
+    extracted = await extract_text_async(page.text, max_chars=_MAX_SCRAPED_CHARS)
+    if extracted.truncated:
+        logging.warning(f"Truncated the text of '{page.url}'.")
+    return {"title": extracted.title, "text": extracted.text}
+
+
+async def _extract_page_passages(page: Page) -> dict[str, Any]:
+    if page.truncated:
+        logging.warning(f"Truncated the content of '{page.url}'.")
+    chunked = await chunk_passages_async(page.text, max_words=_PASSAGE_MAX_WORDS)
+    return {
+        "title": chunked.title,
+        "passages": [passage.model_dump() for passage in chunked.passages],
+    }
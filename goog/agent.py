@@ -1,48 +1,652 @@
+import asyncio
+import contextlib
+import dataclasses
+from goog import tracing
+from goog.cache import ResponseCache
+from goog.compaction import CompactionPolicy
 from goog.decorators import retry_on_server_error
-from goog.function_calling import ChatSession, FunctionCalling
+from goog.events import Event, FinalResult, TurnEnd
+from goog.function_calling import ChatSession, FunctionCalling, generate_content
+from goog.model_spec import ModelSpec
+from goog.rate_limit import get_rate_limiter
+from goog.tokens import TokenPolicy
+from goog.tool_policy import ToolPolicy
+from google.ai import generativelanguage as glm
 import google.generativeai as genai
+import inspect
+import json
 import logging
-from pydantic import BaseModel, ValidationError
-from typing import Any, Awaitable, Callable, Iterable, Type, TypeVar
+from pydantic import BaseModel, Field, ValidationError
+import re
+import time
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Generic,
+    Iterable,
+    Type,
+    TypeVar,
+    cast,
+)
 
 T = TypeVar("T")
 
+_JSON_BLOCK_PATTERN = re.compile(r"```(?:json)?\s*(\{.*?\})\s*```", re.DOTALL)
+
 
 _DEBUG = False
+_CACHE: ResponseCache | None = None
 
 
-def configure(*, debug: bool = False) -> None:
+def configure(*, debug: bool = False, cache: ResponseCache | None = None) -> None:
     """Configures the agent module.
 
     Args:
         debug: Whether to enable debug mode.
+        cache: The default response cache for all agents. None to disable caching.
     """
-    global _DEBUG
+    global _DEBUG, _CACHE
     _DEBUG = debug
+    _CACHE = cache
+
+
+class CascadeStats(BaseModel):
+    """Which model of a cascade resolved the calls of an agent."""
+
+    calls: int = 0
+    # The number of calls resolved by each model, by name.
+    resolved: dict[str, int] = Field(default_factory=dict)
+    escalations: int = 0
+
+    @property
+    def resolution_rates(self) -> dict[str, float]:
+        """The fraction of the calls resolved by each model."""
+        return {
+            model_name: count / self.calls if self.calls else 0.0
+            for model_name, count in self.resolved.items()
+        }
+
+
+_CASCADE_STATS: dict[str, CascadeStats] = {}
+
+
+def cascade_stats() -> dict[str, CascadeStats]:
+    """Returns the cascade stats of the agents, by agent name.
+
+    The calls of all the agents of the same name, e.g. of an agent defined
+    once and called by every request, are counted together.
+    """
+    return _CASCADE_STATS
+
+
+class AgentSpec(Generic[T]):
+    """A reusable agent definition.
+
+    Everything that does not depend on the request is prepared once: the
+    system instruction, the output schema, the tool declarations and the model
+    handles. Calling the spec only does the per-request work. A spec holds
+    no state of its calls, so it can be shared by concurrent requests, even
+    on different event loops.
+
+    With a cascade, the cheaper models are tried first. The chat moves on to
+    the next model, keeping the tool results so far, when the reply cannot be
+    parsed, when the candidate is stopped, or when `accept` rejects the
+    output. Only the last model gets feedback to correct its reply.
+    """
+
+    def __init__(
+        self,
+        output_type: Type[T],
+        *,
+        name: str | None = None,
+        instruction: str,
+        tools: Iterable[Callable[..., Any]] | None = None,
+        generation_config: genai.GenerationConfig | dict[str, Any] | None = None,
+        model_name: str = "gemini-1.5-pro-latest",
+        cache: ResponseCache | None = None,
+        compaction: CompactionPolicy | None = None,
+        json_final_turn: bool = False,
+        tool_policy: ToolPolicy | None = None,
+        cascade_model_names: Iterable[str] | None = None,
+        accept: Callable[[T], bool | Awaitable[bool]] | None = None,
+        token_policy: TokenPolicy | None = None,
+    ) -> None:
+        """Prepares the agent.
+
+        Args:
+            output_type: The type of output to generate. It must be either a Pydantic model or `str`.
+            name: The name of the agent in traces. Defaults to the name of the output type.
+            instruction: The instruction to use for generating the output.
+            tools: The tools to use for generating the output, async or sync.
+            generation_config: The generation configuration to use for generating the output.
+            model_name: The name of the model to use for generating the output.
+            cache: The response cache to use. Defaults to the one set by `configure`.
+            compaction: The policy to keep the conversation under a token budget. None to never compact.
+            json_final_turn: Whether the chat should state the final response as JSON itself, instead of
+                having it extracted by another model call. Without tools, the chat replies in JSON mode.
+            tool_policy: The limits and timeouts of the tool calls. None for no limits.
+            cascade_model_names: The cheaper models to try before `model_name`, cheapest first.
+            accept: Whether the output of a model of the cascade is good enough, sync or async.
+                The output of `model_name` is always accepted.
+            token_policy: The token limit of each request. Defaults to `TokenPolicy()`.
+        """
+        tools = list(tools) if tools else None
+        self.output_type = output_type
+        self.name = name or output_type.__name__
+        self.model_name = model_name
+        self.model_names = [*(cascade_model_names or []), model_name]
+        self.cache = cache
+        self.compaction = compaction
+        self.json_final_turn = json_final_turn
+        self.accept = accept
+        self.token_policy = token_policy or TokenPolicy()
+        self.system_instruction = _system_instruction(
+            output_type, instruction, tools, json_final_turn=json_final_turn
+        )
+
+        if json_final_turn and not tools and issubclass(output_type, BaseModel):
+            # Function calling does not work with JSON mode, so only a chat
+            # without tools can be constrained to the output schema.
+            config: genai.GenerationConfig = (
+                genai.GenerationConfig(**generation_config)
+                if isinstance(generation_config, dict)
+                else generation_config or genai.GenerationConfig()
+            )
+            generation_config = dataclasses.replace(
+                config,
+                response_mime_type="application/json",
+                response_schema=output_type,
+            )
+
+        self.function_calling = FunctionCalling(
+            functions=tools, policy=tool_policy or ToolPolicy()
+        )
+        # Derive the function declarations from the callables only once.
+        model = ModelSpec(
+            model_name=model_name,
+            system_instruction=self.system_instruction,
+            tools=self.function_calling.functions,
+            generation_config=generation_config,
+        )
+        self._models = {name: model.with_model_name(name) for name in self.model_names}
+        self._parse_models = (
+            {name: _new_parse_model(name, output_type) for name in self.model_names}
+            if issubclass(output_type, BaseModel)
+            else {}
+        )
+        self.model = self._models[model_name]
+        self.parse_model = self._parse_models.get(model_name)
+
+    async def __call__(self, data: genai.types.ContentType | None = None) -> T:
+        """Generates an output.
+
+        Args:
+            data: The data to use for generating the output.
+
+        Returns:
+            The generated output.
+        """
+        with tracing.span(self.name, "agent") as span:
+            async with contextlib.aclosing(
+                self._run(data, span, stream=False)
+            ) as events:
+                async for event in events:
+                    if isinstance(event, FinalResult):
+                        return event.output
+        raise AssertionError("The chat ended without a final result.")
+
+    def stream(
+        self, data: genai.types.ContentType | None = None
+    ) -> AsyncIterator[Event]:
+        """Generates an output, streaming the events as they happen.
+
+        Unlike calling the spec, server errors are not retried, since the text
+        already streamed cannot be taken back. For the same reason, the text
+        of a model the cascade moves on from stays streamed.
+
+        Args:
+            data: The data to use for generating the output.
+
+        Returns:
+            The text deltas and tool calls of the chat, then a `FinalResult` with the generated output.
+        """
+        return tracing.span_stream(
+            self.name,
+            "agent",
+            lambda span: self._run(data, span, stream=True),
+            stream=True,
+        )
+
+    async def _run(
+        self,
+        data: genai.types.ContentType | None,
+        span: tracing.Span | None,
+        *,
+        stream: bool,
+    ) -> AsyncGenerator[Event, None]:
+        """Runs the chat through the cascade until an output is accepted.
+
+        Args:
+            data: The data to use for generating the output.
+            span: The span of the agent, if traced.
+            stream: Whether to stream the events of the chat. Otherwise the
+                replies are awaited whole, retrying server errors.
+
+        Yields:
+            The events of the chat if streamed, then a `FinalResult` with the generated output.
+        """
+        self._cascade_stats().calls += 1
+        tier = 0
+        chat = self._new_chat(tier)
+        message: genai.types.ContentType | None = data or "Begin."
+        feedback_rounds = 0
+        while True:
+            try:
+                if stream:
+                    text = ""
+                    async for event in (
+                        chat.reply_stream()
+                        if message is None
+                        else chat.send_message_stream(message)
+                    ):
+                        if isinstance(event, TurnEnd):
+                            text = event.text
+                        yield event
+                elif message is None:
+                    text = (await _reply(chat)).text
+                else:
+                    text = (await _send_message(chat, message)).text
+            except genai.types.StopCandidateException:
+                if not self._can_escalate(tier):
+                    raise
+                logging.exception(f"Stopped candidate of {self.model_names[tier]}.")
+                chat = self._escalate(chat, tier, span)
+                tier, message = tier + 1, None
+                continue
+            _log_chat(chat, self.system_instruction)
+
+            if self.output_type is str:
+                output = cast(T, text)
+            else:
+                try:
+                    output = await self._to_output(text, chat.cache, tier)
+                except ValidationError as ex:
+                    logging.exception(
+                        f"Attempt #{feedback_rounds}. Failed to parse: {text}"
+                    )
+                    if self._can_escalate(tier):
+                        chat = self._escalate(chat, tier, span)
+                        tier, message = tier + 1, None
+                        continue
+                    if feedback_rounds > 3:
+                        raise RuntimeError(text) from ex
+                    message = _format_feedback(ex, self.output_type)  # type: ignore
+                    feedback_rounds += 1
+                    if span:
+                        span.set(feedback_rounds=feedback_rounds)
+                    continue
+
+            if self._can_escalate(tier) and not await self._accepts(output):
+                chat = self._escalate(chat, tier, span)
+                tier, message = tier + 1, None
+                continue
+            self._resolved(tier)
+            yield FinalResult(output=output)
+            return
+
+    def _new_chat(self, tier: int = 0) -> ChatSession:
+        model_name = self.model_names[tier]
+        return ChatSession(
+            model=self._models[model_name],
+            tools=self.function_calling,
+            cache=self.cache or _CACHE,
+            rate_limiter=get_rate_limiter(model_name),
+            compaction=self.compaction,
+            token_policy=self.token_policy,
+        )
+
+    def _can_escalate(self, tier: int) -> bool:
+        return tier + 1 < len(self.model_names)
+
+    def _escalate(
+        self, chat: ChatSession, tier: int, span: tracing.Span | None
+    ) -> ChatSession:
+        """Continues the chat with the next model, without the rejected reply."""
+        if chat.conversation and chat.conversation[-1].role == "model":
+            chat.conversation.pop()
+        model_name = self.model_names[tier + 1]
+        logging.info(f"Escalating from {self.model_names[tier]} to {model_name}.")
+        self._cascade_stats().escalations += 1
+        if span:
+            span.set(model_name=model_name)
+        # The conversation is shared, so the tool results so far are kept.
+        return chat.model_copy(
+            update={
+                "model": self._models[model_name],
+                "rate_limiter": get_rate_limiter(model_name),
+            }
+        )
+
+    async def _accepts(self, output: T) -> bool:
+        if self.accept is None:
+            return True
+        accepted = self.accept(output)
+        if inspect.isawaitable(accepted):
+            accepted = await accepted
+        return bool(accepted)
+
+    def _resolved(self, tier: int) -> None:
+        resolved = self._cascade_stats().resolved
+        model_name = self.model_names[tier]
+        resolved[model_name] = resolved.get(model_name, 0) + 1
+
+    def _cascade_stats(self) -> CascadeStats:
+        return _CASCADE_STATS.setdefault(self.name, CascadeStats())
+
+    async def _to_output(self, text: str, cache: ResponseCache | None, tier: int) -> T:
+        """Converts the final response of the chat to the output type.
+
+        Raises:
+            ValidationError: The final response does not fit the output type.
+        """
+        assert issubclass(self.output_type, BaseModel)
+
+        if self.json_final_turn:
+            json_text = _extract_json(text)
+            if json_text is not None:
+                return self.output_type.model_validate_json(json_text)  # type: ignore
+            logging.warning("No JSON object in the final response. Extracting it.")
+
+        model_name = self.model_names[tier]
+        return await _parse(
+            text,
+            model=self._parse_models[model_name],
+            model_name=model_name,
+            output_type=self.output_type,
+            agent_name=self.name,
+            cache=cache,
+        )
 
 
 async def agent(
     output_type: Type[T],
     *,
+    name: str | None = None,
     instruction: str,
     data: genai.types.ContentType | None = None,
-    tools: Iterable[Callable[..., Awaitable[Any]]] | None = None,
-    generation_config: genai.GenerationConfig | None = None,
+    tools: Iterable[Callable[..., Any]] | None = None,
+    generation_config: genai.GenerationConfig | dict[str, Any] | None = None,
     model_name: str = "gemini-1.5-pro-latest",
+    cache: ResponseCache | None = None,
+    compaction: CompactionPolicy | None = None,
+    json_final_turn: bool = False,
+    tool_policy: ToolPolicy | None = None,
+    cascade_model_names: Iterable[str] | None = None,
+    accept: Callable[[T], bool | Awaitable[bool]] | None = None,
+    token_policy: TokenPolicy | None = None,
 ) -> T:
     """Generates an output using a generative model.
 
+    Agents called repeatedly should be declared once with `AgentSpec` instead.
+    The arguments other than `data` are those of `AgentSpec`.
+
     Args:
-        output_type: The type of output to generate. It must be either a Pydantic model or `str`.
-        instruction: The instruction to use for generating the output.
         data: The data to use for generating the output.
-        tools: The tools to use for generating the output.
-        generation_config: The generation configuration to use for generating the output.
-        model_name: The name of the model to use for generating the output.
 
     Returns:
         The generated output.
     """
+    spec = AgentSpec(
+        output_type,
+        name=name,
+        instruction=instruction,
+        tools=tools,
+        generation_config=generation_config,
+        model_name=model_name,
+        cache=cache,
+        compaction=compaction,
+        json_final_turn=json_final_turn,
+        tool_policy=tool_policy,
+        cascade_model_names=cascade_model_names,
+        accept=accept,
+        token_policy=token_policy,
+    )
+    return await spec(data)
+
+
+async def agent_stream(
+    output_type: Type[T],
+    *,
+    name: str | None = None,
+    instruction: str,
+    data: genai.types.ContentType | None = None,
+    tools: Iterable[Callable[..., Any]] | None = None,
+    generation_config: genai.GenerationConfig | dict[str, Any] | None = None,
+    model_name: str = "gemini-1.5-pro-latest",
+    cache: ResponseCache | None = None,
+    compaction: CompactionPolicy | None = None,
+    json_final_turn: bool = False,
+    tool_policy: ToolPolicy | None = None,
+    cascade_model_names: Iterable[str] | None = None,
+    accept: Callable[[T], bool | Awaitable[bool]] | None = None,
+    token_policy: TokenPolicy | None = None,
+) -> AsyncIterator[Event]:
+    """Generates an output like `agent`, streaming the events as they happen.
+
+    Unlike `agent`, server errors are not retried, since the text already
+    streamed cannot be taken back. The arguments other than `data` are those
+    of `AgentSpec`.
+
+    Args:
+        data: The data to use for generating the output.
+
+    Yields:
+        The text deltas and tool calls of the chat, then a `FinalResult` with the generated output.
+    """
+    spec = AgentSpec(
+        output_type,
+        name=name,
+        instruction=instruction,
+        tools=tools,
+        generation_config=generation_config,
+        model_name=model_name,
+        cache=cache,
+        compaction=compaction,
+        json_final_turn=json_final_turn,
+        tool_policy=tool_policy,
+        cascade_model_names=cascade_model_names,
+        accept=accept,
+        token_policy=token_policy,
+    )
+    async for event in spec.stream(data):
+        yield event
+
+
+class BatchStats(BaseModel):
+    """Progress of a batch of requests."""
+
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    retries: int = 0
+    started: float = Field(default_factory=time.perf_counter)
+
+    @property
+    def in_flight(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+    @property
+    def elapsed_seconds(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def requests_per_second(self) -> float:
+        return (self.completed + self.failed) / max(self.elapsed_seconds, 1e-9)
+
+
+class BatchResult(BaseModel, Generic[T], arbitrary_types_allowed=True):
+    """The outcome of one request of a batch."""
+
+    index: int
+    input: Any
+    output: T | None = None
+    error: Exception | None = None
+
+
+async def map_agent(
+    function: Callable[[Any], Awaitable[T]],
+    inputs: Iterable[Any] | AsyncIterable[Any],
+    *,
+    concurrency: int = 8,
+    ordered: bool = False,
+    max_attempts: int = 1,
+    stats: BatchStats | None = None,
+) -> AsyncIterator[BatchResult[T]]:
+    """Runs an agent on many inputs with a bounded number of requests in flight.
+
+    Inputs are pulled lazily, only when there is room in the window, so a long
+    or endless input iterator is never materialized. A failed request does not
+    stop the batch: its error is reported in its result.
+
+    Args:
+        function: The agent to run, typically an `AgentSpec`.
+        inputs: The inputs to run the agent on.
+        concurrency: The maximum number of requests in flight.
+        ordered: Whether to yield the results in the order of the inputs instead of as they complete.
+            The results completed behind a slower earlier request are held until it completes,
+            without taking up room in the window.
+        max_attempts: The number of times to run a request that raises an exception.
+        stats: The progress to update, to be watched by the caller.
+
+    Yields:
+        The result of each input.
+    """
+    if stats is None:
+        stats = BatchStats()
+    iterator = _aiter(inputs)
+    exhausted = False
+    pending: set[asyncio.Task[BatchResult[T]]] = set()
+    waiting: dict[int, BatchResult[T]] = {}
+    next_index = 0
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                try:
+                    item = await anext(iterator)
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(
+                    asyncio.ensure_future(
+                        _run_batch_item(
+                            function, stats.submitted, item, max_attempts, stats
+                        )
+                    )
+                )
+                stats.submitted += 1
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for result in sorted(
+                (task.result() for task in done), key=lambda result: result.index
+            ):
+                if result.error is None:
+                    stats.completed += 1
+                else:
+                    stats.failed += 1
+                if not ordered:
+                    yield result
+                    continue
+                waiting[result.index] = result
+                while next_index in waiting:
+                    yield waiting.pop(next_index)
+                    next_index += 1
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def agent_many(
+    output_type: Type[T],
+    *,
+    name: str | None = None,
+    instruction: str,
+    inputs: Iterable[Any] | AsyncIterable[Any],
+    tools: Iterable[Callable[..., Any]] | None = None,
+    generation_config: genai.GenerationConfig | dict[str, Any] | None = None,
+    model_name: str = "gemini-1.5-pro-latest",
+    cache: ResponseCache | None = None,
+    compaction: CompactionPolicy | None = None,
+    json_final_turn: bool = False,
+    tool_policy: ToolPolicy | None = None,
+    cascade_model_names: Iterable[str] | None = None,
+    accept: Callable[[T], bool | Awaitable[bool]] | None = None,
+    token_policy: TokenPolicy | None = None,
+    concurrency: int = 8,
+    ordered: bool = False,
+    max_attempts: int = 1,
+    stats: BatchStats | None = None,
+) -> AsyncIterator[BatchResult[T]]:
+    """Generates an output like `agent` for each input, as `map_agent` does.
+
+    The arguments `concurrency`, `ordered`, `max_attempts` and `stats` are
+    those of `map_agent`, and the others but `inputs` those of `AgentSpec`.
+
+    Args:
+        inputs: The data to generate an output for each.
+
+    Yields:
+        The result of each input.
+    """
+    spec = AgentSpec(
+        output_type,
+        name=name,
+        instruction=instruction,
+        tools=tools,
+        generation_config=generation_config,
+        model_name=model_name,
+        cache=cache,
+        compaction=compaction,
+        json_final_turn=json_final_turn,
+        tool_policy=tool_policy,
+        cascade_model_names=cascade_model_names,
+        accept=accept,
+        token_policy=token_policy,
+    )
+    async for result in map_agent(
+        spec,
+        inputs,
+        concurrency=concurrency,
+        ordered=ordered,
+        max_attempts=max_attempts,
+        stats=stats,
+    ):
+        yield result
+
+
+def _system_instruction(
+    output_type: Type[T],
+    instruction: str,
+    tools: Iterable[Callable[..., Any]] | None,
+    *,
+    json_final_turn: bool,
+) -> str:
+    if json_final_turn and not tools and issubclass(output_type, BaseModel):
+        # The reply is constrained to JSON, so there is no room for thoughts.
+        return instruction + (
+            "\n\nRespond with the final response as a JSON object.\n"
+            "The final response should include the following information:\n"
+            + _format_model_description(output_type)
+        )
+
     system_instruction = instruction + (
         "\n\nExplain your thoughts step by step. "
         "If you made an error, go right ahead to fix the problem and try again. "
@@ -53,54 +657,57 @@ async def agent(
             "Your final response should include the following information:\n"
             + _format_model_description(output_type)
         )
+        if json_final_turn:
+            system_instruction += (
+                "\n\nEnd your final response with the final response as a JSON object "
+                "in a ```json code block. "
+                f"Use this JSON schema: {output_type.model_json_schema()}.\n"
+            )
     if tools:
         system_instruction += (
             "\n\nIf you are calling functions, be careful to escape the quotes"
             " inside strings properly."
         )
+    return system_instruction
 
-    function_calling = FunctionCalling(functions=list(tools) if tools else None)
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        generation_config=generation_config,
-        system_instruction=system_instruction,
-        tools=function_calling.functions,
+
+def _log_chat(chat: ChatSession, system_instruction: str) -> None:
+    if not _DEBUG:
+        return
+    logging.info(
+        "#### Chat starts ##############################################################"
+    )
+    logging.info(f"Instruction: {system_instruction}")
+    for history_message in chat.history:
+        logging.info(f"Message: {history_message}")
+    logging.info(
+        "#### Chat ends ##############################################################"
     )
-    chat = ChatSession(model=model, tools=function_calling)
 
-    message = data or "Begin."
-    i = 0
-    while True:
-        response = await _send_message(chat, message)
-        if _DEBUG:
-            logging.info(
-                "#### Chat starts ##############################################################"
-            )
-            logging.info(f"Instruction: {system_instruction}")
-            for history_message in chat.history:
-                logging.info(f"Message: {history_message}")
-            logging.info(
-                "#### Chat ends ##############################################################"
-            )
 
-        if output_type is str:
-            return response.text
-        assert issubclass(output_type, BaseModel)
+def _extract_json(text: str) -> str | None:
+    """Finds the last JSON object in a text, preferring fenced code blocks."""
+    blocks = _JSON_BLOCK_PATTERN.findall(text)
+    if blocks:
+        return blocks[-1]
 
+    decoder = json.JSONDecoder()
+    last_object = None
+    start = text.find("{")
+    while start != -1:
         try:
-            return await _parse(response.text, model_name=model_name, output_type=output_type)  # type: ignore
-        except ValidationError as ex:
-            logging.exception(f"Attempt #{i}. Failed to parse: {response.text}")
-            if i > 3:
-                raise RuntimeError(response.text) from ex
-            message = _format_feedback(ex, output_type)
-            i += 1
-
+            value, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            start = text.find("{", start + 1)
+            continue
+        if isinstance(value, dict):
+            last_object = text[start:end]
+        start = text.find("{", end)
+    return last_object
 
-async def _parse(answer: str, *, model_name: str, output_type: Type[T]) -> T:
-    assert issubclass(output_type, BaseModel)
 
-    model = genai.GenerativeModel(
+def _new_parse_model(model_name: str, output_type: Type[BaseModel]) -> ModelSpec:
+    return ModelSpec(
         model_name=model_name,
         generation_config=genai.GenerationConfig(
             temperature=0,
@@ -112,11 +719,31 @@ async def _parse(answer: str, *, model_name: str, output_type: Type[T]) -> T:
             f"Use this JSON schema: {output_type.model_json_schema()}.\n\n"
         ),
     )
-    response = await model.generate_content_async(answer)
-    if _DEBUG:
-        logging.info(f"Parsing: {response.text}")
 
-    return output_type.model_validate_json(response.text)  # type: ignore
+
+async def _parse(
+    answer: str,
+    *,
+    model: ModelSpec,
+    model_name: str,
+    output_type: Type[T],
+    agent_name: str,
+    cache: ResponseCache | None = None,
+) -> T:
+    assert issubclass(output_type, BaseModel)
+
+    with tracing.span(agent_name, "parse", answer_chars=len(answer)):
+        contents = [glm.Content(parts=[glm.Part(text=answer)], role="user")]
+        response = await generate_content(
+            model,
+            contents,
+            cache=cache,
+            rate_limiter=get_rate_limiter(model_name),
+        )
+        if _DEBUG:
+            logging.info(f"Parsing: {response.text}")
+
+        return output_type.model_validate_json(response.text)  # type: ignore
 
 
 def _format_model_description(cls: Type[BaseModel]) -> str:
@@ -171,3 +798,36 @@ async def _send_message(
     chat: ChatSession, message: genai.types.ContentType
 ) -> genai.types.GenerateContentResponse:
     return await chat.send_message(message)
+
+
+@retry_on_server_error
+async def _reply(chat: ChatSession) -> genai.types.GenerateContentResponse:
+    return await chat.reply()
+
+
+async def _aiter(items: Iterable[Any] | AsyncIterable[Any]) -> AsyncIterator[Any]:
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _run_batch_item(
+    function: Callable[[Any], Awaitable[T]],
+    index: int,
+    item: Any,
+    max_attempts: int,
+    stats: BatchStats,
+) -> BatchResult[T]:
+    attempt = 1
+    while True:
+        try:
+            return BatchResult(index=index, input=item, output=await function(item))
+        except Exception as e:
+            if attempt >= max_attempts:
+                logging.exception(f"Request #{index} failed after {attempt} attempts.")
+                return BatchResult(index=index, input=item, error=e)
+            attempt += 1
+            stats.retries += 1
@@ -0,0 +1,223 @@
+"""A content-addressed cache for model responses."""
+
+import asyncio
+import collections
+from google.ai import generativelanguage as glm
+from goog.model_spec import ModelSpec
+import google.generativeai as genai
+import hashlib
+import json
+import logging
+import os
+from pydantic import BaseModel
+import tempfile
+import time
+from typing import Iterable
+
+
+class CacheStats(BaseModel):
+    """Counters of a response cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    bypasses: int = 0
+
+    @property
+    def hits(self) -> int:
+        return self.memory_hits + self.disk_hits
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ResponseCache:
+    """Caches model responses by the content of the request.
+
+    The key covers everything sent to the model: the model name, the system
+    instruction, the generation config, the tool declarations and the
+    conversation. Entries live in an in-memory LRU tier and, when a directory is
+    given, in an on-disk tier that survives restarts.
+
+    Requests without an explicit zero temperature are not cached, since their
+    responses are meant to vary, unless `allow_nonzero_temperature` is set.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: int = 256,
+        directory: str | None = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        ttl_seconds: float | None = 7 * 24 * 60 * 60,
+        allow_nonzero_temperature: bool = False,
+    ) -> None:
+        """Initializes the cache.
+
+        Args:
+            max_entries: The maximum number of entries in the in-memory tier.
+            directory: The directory of the on-disk tier. None to keep the cache in memory only.
+            max_disk_bytes: The maximum total size of the on-disk tier.
+            ttl_seconds: How long an entry stays valid. None to never expire.
+            allow_nonzero_temperature: Whether to cache requests sampled with a non-zero temperature.
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.allow_nonzero_temperature = allow_nonzero_temperature
+        self.stats = CacheStats()
+        self._memory: collections.OrderedDict[str, tuple[float, str]] = (
+            collections.OrderedDict()
+        )
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, model: ModelSpec, contents: Iterable[glm.Content]) -> str | None:
+        """Computes the cache key of a request.
+
+        Args:
+            model: The model that will serve the request.
+            contents: The conversation to send.
+
+        Returns:
+            The cache key, or None if the request must not be cached.
+        """
+        if (
+            not self.allow_nonzero_temperature
+            and model.generation_config.get("temperature") != 0
+        ):
+            self.stats.bypasses += 1
+            return None
+
+        serialized = glm.GenerateContentRequest.to_json(
+            model.request(contents), sort_keys=True, indent=None
+        )
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> genai.types.AsyncGenerateContentResponse | None:
+        """Looks up a cached response.
+
+        Args:
+            key: The cache key from `key`.
+
+        Returns:
+            The cached response, or None on a miss.
+        """
+        entry = self._memory.get(key)
+        if entry is not None and not self._expired(entry[0]):
+            self._memory.move_to_end(key)
+            self.stats.memory_hits += 1
+            return _deserialize(entry[1])
+        self._memory.pop(key, None)
+
+        if self.directory:
+            entry = await asyncio.to_thread(self._read_disk, key)
+            if entry is not None:
+                self._remember(key, entry)
+                self.stats.disk_hits += 1
+                return _deserialize(entry[1])
+
+        self.stats.misses += 1
+        return None
+
+    async def put(
+        self, key: str, response: genai.types.AsyncGenerateContentResponse
+    ) -> None:
+        """Stores a response.
+
+        Args:
+            key: The cache key from `key`.
+            response: The response to store.
+        """
+        entry = (time.time(), json.dumps(response.to_dict()))
+        self._remember(key, entry)
+        if self.directory:
+            # The response is already in hand, so a failed write only costs a
+            # later miss.
+            try:
+                await asyncio.to_thread(self._write_disk, key, entry[1])
+            except OSError as e:
+                logging.warning(
+                    "Failed to write the response cache entry %s: %r.", key, e
+                )
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created > self.ttl_seconds
+
+    def _remember(self, key: str, entry: tuple[float, str]) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        assert self.directory
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key: str) -> tuple[float, str] | None:
+        path = self._path(key)
+        try:
+            created = os.path.getmtime(path)
+            if self._expired(created):
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return created, f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key: str, serialized: str) -> None:
+        assert self.directory
+        # A temporary file of its own, as the same key can be written by
+        # several threads at once.
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(serialized)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            _remove_quietly(temp_path)
+            raise
+        self._evict_disk()
+
+    def _evict_disk(self) -> None:
+        """Removes expired entries, then the oldest ones until under the size limit."""
+        assert self.directory
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if self._expired(stat.st_mtime):
+                _remove_quietly(entry.path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_disk_bytes:
+                break
+            _remove_quietly(path)
+            total_bytes -= size
+        logging.debug("Response cache on disk holds %d bytes.", total_bytes)
+
+
+def _deserialize(serialized: str) -> genai.types.AsyncGenerateContentResponse:
+    return genai.types.AsyncGenerateContentResponse.from_response(
+        glm.GenerateContentResponse(json.loads(serialized))
+    )
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
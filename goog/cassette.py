@@ -0,0 +1,243 @@
+"""Recording and replaying of model and tool traffic.
+
+A cassette captures every model call and every tool call made while a root
+request runs, so that the run can be reproduced offline:
+
+    with cassette.recording("run.jsonl.gz"):
+        await next_search_recommender("Singapore")
+
+    with cassette.replaying("run.jsonl.gz") as replay:
+        await next_search_recommender("Singapore")
+    print(replay.stats)
+
+Tools that call models themselves, such as agents used as tools, are run
+again on replay, so that their own model calls are replayed too. Other tools
+are served from the cassette.
+"""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+from goog.model_spec import ModelSpec
+from google.ai import generativelanguage as glm
+import google.generativeai as genai
+import gzip
+import hashlib
+import json
+from pydantic import BaseModel
+import time
+from typing import Any, Iterator, Literal
+
+
+class CassetteMissError(LookupError):
+    """Raised on replay when a call was not recorded."""
+
+
+class CassetteStats(BaseModel):
+    """Counters of a cassette."""
+
+    model_calls: int = 0
+    tool_calls: int = 0
+    # The replayed tool calls that ran again because they call models.
+    tools_run: int = 0
+
+
+class Cassette:
+    """The model and tool calls of a run."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        mode: Literal["record", "replay"],
+        recorded_latency: bool = False,
+    ) -> None:
+        """Initializes the cassette, loading it when replaying.
+
+        Args:
+            path: The gzip-compressed JSON lines file of the cassette.
+            mode: Whether to record the calls or to replay them.
+            recorded_latency: Whether replayed calls take as long as they did when recorded.
+        """
+        self.path = path
+        self.mode = mode
+        self.recorded_latency = recorded_latency
+        self.stats = CassetteStats()
+        self._entries: list[dict[str, Any]] = []
+        self._queues: dict[tuple[str, str], collections.deque[dict[str, Any]]] = (
+            collections.defaultdict(collections.deque)
+        )
+        if mode == "replay":
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._queues[entry["kind"], entry["key"]].append(entry)
+
+    @property
+    def unused_entries(self) -> int:
+        """The number of recorded calls that were not replayed."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def replay_model(
+        self, model: ModelSpec, contents: list[glm.Content]
+    ) -> genai.types.AsyncGenerateContentResponse:
+        """Serves the recorded response of a model call.
+
+        Raises:
+            CassetteMissError: The call was not recorded.
+        """
+        entry = await self._replay("model", _model_key(model, contents))
+        return genai.types.AsyncGenerateContentResponse.from_response(
+            glm.GenerateContentResponse(entry["response"])
+        )
+
+    def record_model(
+        self,
+        model: ModelSpec,
+        contents: list[glm.Content],
+        response: genai.types.AsyncGenerateContentResponse,
+        seconds: float,
+    ) -> None:
+        """Records a model call."""
+        self.stats.model_calls += 1
+        # The tools running this call are the ones to run again on replay.
+        for entry in _tool_entries.get():
+            entry["calls_model"] = True
+        self._entries.append(
+            {
+                "kind": "model",
+                "key": _model_key(model, contents),
+                "model": model.model_name,
+                "seconds": seconds,
+                "response": response.to_dict(),
+            }
+        )
+
+    async def replay_tool(
+        self, name: str, args: dict[str, Any]
+    ) -> glm.FunctionResponse | None:
+        """Serves the recorded response of a tool call.
+
+        Returns:
+            The recorded response, or None if the tool calls models and must run again.
+
+        Raises:
+            CassetteMissError: The call was not recorded.
+        """
+        entry = await self._replay("tool", _tool_key(name, args))
+        if entry["calls_model"]:
+            self.stats.tools_run += 1
+            return None
+        return glm.FunctionResponse(name=name, response=entry["response"])
+
+    @contextlib.contextmanager
+    def recording_tool(
+        self, name: str, args: dict[str, Any]
+    ) -> Iterator[dict[str, Any]]:
+        """Records a tool call run within the context.
+
+        Yields:
+            The entry, whose response is to be set by the caller.
+        """
+        entry = {
+            "kind": "tool",
+            "key": _tool_key(name, args),
+            "name": name,
+            "seconds": 0.0,
+            "calls_model": False,
+            "response": None,
+        }
+        token = _tool_entries.set(_tool_entries.get() + (entry,))
+        start = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            _tool_entries.reset(token)
+            entry["seconds"] = time.perf_counter() - start
+            self.stats.tool_calls += 1
+            self._entries.append(entry)
+
+    def save(self) -> None:
+        """Writes the recorded calls."""
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            for entry in self._entries:
+                f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    async def _replay(self, kind: str, key: str) -> dict[str, Any]:
+        queue = self._queues.get((kind, key))
+        if not queue:
+            raise CassetteMissError(f"No recorded {kind} call with key {key}.")
+        # Identical calls are served in the order they were recorded.
+        entry = queue.popleft()
+        if kind == "model":
+            self.stats.model_calls += 1
+        else:
+            self.stats.tool_calls += 1
+        if self.recorded_latency and not entry.get("calls_model"):
+            await asyncio.sleep(entry["seconds"])
+        return entry
+
+
+_current: contextvars.ContextVar[Cassette | None] = contextvars.ContextVar(
+    "current_cassette", default=None
+)
+_tool_entries: contextvars.ContextVar[tuple[dict[str, Any], ...]] = (
+    contextvars.ContextVar("cassette_tool_entries", default=())
+)
+
+
+def current() -> Cassette | None:
+    """Returns the cassette of the current run, if any."""
+    return _current.get()
+
+
+@contextlib.contextmanager
+def recording(path: str) -> Iterator[Cassette]:
+    """Records the calls made within the context into a cassette.
+
+    The cassette is written even if the run fails.
+
+    Args:
+        path: The file to write the cassette to.
+
+    Yields:
+        The cassette.
+    """
+    cassette = Cassette(path, mode="record")
+    token = _current.set(cassette)
+    try:
+        yield cassette
+    finally:
+        _current.reset(token)
+        cassette.save()
+
+
+@contextlib.contextmanager
+def replaying(path: str, *, recorded_latency: bool = False) -> Iterator[Cassette]:
+    """Replays the calls made within the context from a cassette.
+
+    Args:
+        path: The file to read the cassette from.
+        recorded_latency: Whether replayed calls take as long as they did when recorded.
+
+    Yields:
+        The cassette.
+    """
+    cassette = Cassette(path, mode="replay", recorded_latency=recorded_latency)
+    token = _current.set(cassette)
+    try:
+        yield cassette
+    finally:
+        _current.reset(token)
+
+
+def _model_key(model: ModelSpec, contents: list[glm.Content]) -> str:
+    serialized = glm.GenerateContentRequest.to_json(
+        model.request(contents), sort_keys=True, indent=None
+    )
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+def _tool_key(name: str, args: dict[str, Any]) -> str:
+    return json.dumps([name, args], sort_keys=True, default=str)
@@ -0,0 +1,123 @@
+"""Compaction of long conversations to a token budget."""
+
+from google.ai import generativelanguage as glm
+from goog.tokens import estimate_tokens, truncate_function_response
+import json
+from pydantic import BaseModel
+
+_NOTE_PREFIX = "Earlier steps were omitted to save space. Functions called: "
+
+
+class CompactionMetrics(BaseModel):
+    """What a compaction did to the conversation before a model call."""
+
+    turn: int
+    tokens_before: int
+    tokens_after: int
+    truncated_responses: int = 0
+    collapsed_contents: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class CompactionPolicy(BaseModel, frozen=True):
+    """Keeps a conversation under a token budget.
+
+    The first message, which carries the request, and the latest contents,
+    which carry the latest tool results, are never touched. When the
+    conversation is over budget, older function responses are truncated
+    first, oldest first. If that is not enough, the oldest tool-calling turns
+    are collapsed into a note listing the calls that were made.
+    """
+
+    max_tokens: int = 32_000
+    keep_recent_contents: int = 2
+    max_function_response_chars: int = 1_000
+
+    def compact(
+        self, contents: list[glm.Content], *, turn: int = 0
+    ) -> tuple[list[glm.Content], CompactionMetrics]:
+        """Compacts a conversation.
+
+        Args:
+            contents: The conversation. It is not modified.
+            turn: The index of the model call this conversation is for.
+
+        Returns:
+            The compacted conversation and what the compaction did.
+        """
+        tokens = estimate_tokens(contents)
+        metrics = CompactionMetrics(
+            turn=turn, tokens_before=tokens, tokens_after=tokens
+        )
+        if tokens <= self.max_tokens:
+            return contents, metrics
+
+        compacted = list(contents)
+        protected_from = max(1, len(compacted) - self.keep_recent_contents)
+        for i in range(1, protected_from):
+            if tokens <= self.max_tokens:
+                break
+            truncated = self._truncate_function_responses(compacted[i])
+            if truncated is not None:
+                tokens += estimate_tokens([truncated]) - estimate_tokens([compacted[i]])
+                compacted[i] = truncated
+                metrics.truncated_responses += 1
+
+        if tokens > self.max_tokens:
+            compacted, collapsed = self._collapse(compacted, protected_from, tokens)
+            metrics.collapsed_contents = collapsed
+            tokens = estimate_tokens(compacted)
+
+        metrics.tokens_after = tokens
+        return compacted, metrics
+
+    def _truncate_function_responses(self, content: glm.Content) -> glm.Content | None:
+        """Returns a copy with long function responses truncated, or None if none are long."""
+        parts = []
+        truncated_any = False
+        for part in content.parts:
+            if "function_response" in part and (
+                response := truncate_function_response(
+                    part.function_response, self.max_function_response_chars
+                )
+            ):
+                part = glm.Part(function_response=response)
+                truncated_any = True
+            parts.append(part)
+        return glm.Content(parts=parts, role=content.role) if truncated_any else None
+
+    def _collapse(
+        self, contents: list[glm.Content], protected_from: int, tokens: int
+    ) -> tuple[list[glm.Content], int]:
+        """Collapses the oldest turns into a note, keeping the roles alternating."""
+        # Only whole model-then-user pairs are collapsed, so a function call is
+        # never separated from its response.
+        end = 1
+        while end + 1 < protected_from and tokens > self.max_tokens:
+            tokens -= estimate_tokens(contents[end : end + 2])
+            end += 2
+        if end == 1:
+            return contents, 0
+
+        calls = []
+        for content in contents[1:end]:
+            for part in content.parts:
+                if "function_call" in part:
+                    args = glm.FunctionCall.to_dict(part.function_call).get("args", {})
+                    calls.append(
+                        f"{part.function_call.name}({json.dumps(args, ensure_ascii=False)})"
+                    )
+                elif "text" in part and part.text.startswith(_NOTE_PREFIX):
+                    # Carry over the calls of an earlier note.
+                    calls.append(part.text[len(_NOTE_PREFIX) : -1])
+        note = [
+            glm.Content(
+                parts=[glm.Part(text=f"{_NOTE_PREFIX}{', '.join(calls) or 'none'}.")],
+                role="model",
+            ),
+            glm.Content(parts=[glm.Part(text="Continue.")], role="user"),
+        ]
+        return contents[:1] + note + contents[end:], end - 1
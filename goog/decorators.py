@@ -1,15 +1,19 @@
+import asyncio
 import functools
+from goog import tracing
 from google.api_core.exceptions import (
     DeadlineExceeded,
     InternalServerError,
     ResourceExhausted,
 )
 import logging
-import time
+import math
+import random
 from typing import (
     Any,
     Awaitable,
     Callable,
+    Literal,
     ParamSpec,
     TypeVar,
 )
@@ -18,9 +22,17 @@ from typing import (
 P = ParamSpec("P")
 R = TypeVar("R")
 F = Callable[P, Awaitable[R]]
+C = TypeVar("C", bound=Callable[..., Any])
+
+Executor = Literal["inline", "thread", "process"]
 
 
 _MAX_INTERNAL_SERVER_ERRORS = 5
+_MAX_WAIT_SECONDS = 1024
+
+NEVER_DEDUPE_ATTRIBUTE = "__never_dedupe__"
+MEMOIZE_TTL_SECONDS_ATTRIBUTE = "__memoize_ttl_seconds__"
+EXECUTOR_ATTRIBUTE = "__executor__"
 
 
 def retry_on_server_error(func: F) -> F:
@@ -28,9 +40,13 @@ def retry_on_server_error(func: F) -> F:
     async def wrapper(*args: Any, **kwargs: Any) -> Any:
         wait_time = 1
         try_count = 1
+        attempt = 1
         while True:
             try:
-                return await func(*args, **kwargs)
+                if attempt == 1:
+                    return await func(*args, **kwargs)
+                with tracing.span(func.__name__, "retry", attempt=attempt):
+                    return await func(*args, **kwargs)
             except (DeadlineExceeded, InternalServerError) as e:
                 if try_count >= _MAX_INTERNAL_SERVER_ERRORS:
                     raise
@@ -39,8 +55,50 @@ def retry_on_server_error(func: F) -> F:
                 try_count += 1
             except ResourceExhausted as e:
                 logging.exception(e)
-                time.sleep(wait_time)
-                if wait_time < 1024:
+                # Full jitter keeps concurrent callers from retrying in lockstep.
+                await asyncio.sleep(random.uniform(0, wait_time))
+                if wait_time < _MAX_WAIT_SECONDS:
                     wait_time *= 2
+            attempt += 1
 
     return wrapper
+
+
+def never_dedupe(func: C) -> C:
+    """Marks a tool with side effects, so that identical calls always run."""
+    setattr(func, NEVER_DEDUPE_ATTRIBUTE, True)
+    return func
+
+
+def memoize(ttl_seconds: float = math.inf) -> Callable[[C], C]:
+    """Marks a tool as safe to repeat, so that its results are reused.
+
+    Args:
+        ttl_seconds: How long a result stays valid.
+    """
+
+    def decorator(func: C) -> C:
+        setattr(func, MEMOIZE_TTL_SECONDS_ATTRIBUTE, ttl_seconds)
+        return func
+
+    return decorator
+
+
+def run_in(executor: Executor) -> Callable[[C], C]:
+    """Marks where a tool runs, overriding the default of its kind.
+
+    By default, async tools run inline on the event loop and sync tools on a
+    thread pool. CPU-bound tools should run on a process pool, so that they do
+    not hold the interpreter lock; they must then be defined at the top level
+    of a module, and take and return picklable values.
+
+    Args:
+        executor: "inline" to run on the event loop, "thread" on a thread pool
+            or "process" on a process pool.
+    """
+
+    def decorator(func: C) -> C:
+        setattr(func, EXECUTOR_ATTRIBUTE, executor)
+        return func
+
+    return decorator
@@ -0,0 +1,39 @@
+"""Events emitted while streaming a response."""
+
+from pydantic import BaseModel
+from typing import Any
+
+
+class TextDelta(BaseModel):
+    """A piece of text generated by the model."""
+
+    text: str
+
+
+class ToolCallStart(BaseModel):
+    """The model called a tool."""
+
+    name: str
+    args: dict[str, Any]
+
+
+class ToolCallEnd(BaseModel):
+    """A tool returned."""
+
+    name: str
+    response: dict[str, Any]
+
+
+class TurnEnd(BaseModel):
+    """The model finished its turn without calling more tools."""
+
+    text: str
+
+
+class FinalResult(BaseModel):
+    """The final output of an agent."""
+
+    output: Any
+
+
+Event = TextDelta | ToolCallStart | ToolCallEnd | TurnEnd | FinalResult
@@ -1,18 +1,62 @@
 import asyncio
+from goog import cassette, tracing
+from goog.cache import ResponseCache
+from goog.compaction import CompactionMetrics, CompactionPolicy
+from goog.events import TextDelta, ToolCallEnd, ToolCallStart, TurnEnd
+from goog.hedging import get_hedger
+from goog.lazy_tools import resolve
+from goog.model_spec import ModelSpec
+from goog.rate_limit import RateLimiter, get_rate_limiter
+from goog.single_flight import SingleFlight
+from goog.tokens import (
+    TokenMetrics,
+    TokenPolicy,
+    estimate_function_response_tokens,
+    estimate_request_tokens,
+    record_usage,
+)
+from goog.tool_policy import ToolPolicy
 from google.ai import generativelanguage as glm
 import google.generativeai as genai
+import json
 from pydantic import BaseModel, Field, field_validator
 import logging
-from typing import Any, AsyncIterator, Awaitable, Callable, Iterable
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Iterable
+
+
+# Shared by all sessions, so that nested agents also share their calls.
+_SINGLE_FLIGHT = SingleFlight()
+
+ModelBackend = Callable[
+    [ModelSpec, list[glm.Content], bool],
+    Awaitable[genai.types.AsyncGenerateContentResponse],
+]
+
+_BACKEND: ModelBackend | None = None
+
+
+def configure(*, backend: ModelBackend | None = None) -> None:
+    """Configures the function calling module.
+
+    Args:
+        backend: Generates the responses instead of Gemini, given the model,
+            the contents and whether to stream. None to call Gemini.
+    """
+    global _BACKEND
+    _BACKEND = backend
+
+
+class _ToolTimeoutError(Exception):
+    """Raised when a tool call runs past the timeout of its policy."""
 
 
 class FunctionCalling(BaseModel, frozen=True):
-    functions: (
-        list[Callable[..., Awaitable[Any]]]
-        | dict[str, Callable[..., Awaitable[Any]]]
-        | None
-    )
-    func: dict[str, Callable[..., Awaitable[Any]]] = Field(
+    # Sync functions are run on an executor, see `ToolPolicy`. Lazy tools,
+    # see `goog.lazy_tools`, are imported on their first call.
+    functions: list[Callable[..., Any]] | dict[str, Callable[..., Any]] | None
+    policy: ToolPolicy = Field(default_factory=ToolPolicy)
+    func: dict[str, Callable[..., Any]] = Field(
         default_factory=dict,
         repr=False,
         exclude=True,
@@ -40,14 +84,130 @@ class FunctionCalling(BaseModel, frozen=True):
             elif isinstance(self.functions, dict):
                 self.func = self.functions
 
-    async def call_once(self, function_call: glm.FunctionCall) -> glm.FunctionResponse:
+    async def call_once(
+        self,
+        function_call: glm.FunctionCall,
+        *,
+        session_slots: asyncio.Semaphore | None = None,
+    ) -> glm.FunctionResponse:
+        """Calls a function under the policy.
+
+        Args:
+            function_call: The function call of the model.
+            session_slots: The semaphore bounding the calls of the session, if any.
+
+        Returns:
+            The response of the function, or an error response if it failed or timed out.
+        """
+        function_name = function_call.name
+        args = glm.FunctionCall.to_dict(function_call).get("args", {})
+        with tracing.span(
+            function_name,
+            "tool",
+            args_bytes=len(json.dumps(args, ensure_ascii=False).encode()),
+        ) as span:
+            active_cassette = cassette.current()
+            if active_cassette is None:
+                response = await self._call_with_policy(
+                    function_call, args, session_slots, span
+                )
+            elif active_cassette.mode == "replay":
+                replayed = await active_cassette.replay_tool(function_name, args)
+                if replayed is not None:
+                    response = replayed
+                else:
+                    response = await self._call_with_policy(
+                        function_call, args, session_slots, span
+                    )
+            else:
+                with active_cassette.recording_tool(function_name, args) as entry:
+                    response = await self._call_with_policy(
+                        function_call, args, session_slots, span
+                    )
+                    entry["response"] = glm.FunctionResponse.to_dict(response).get(
+                        "response", {}
+                    )
+            if span:
+                span.set(response_tokens=estimate_function_response_tokens(response))
+            if span and "error" in response.response:
+                span.status = "error"
+                span.set(error=response.response["error"])
+            return response
+
+    async def _call_with_policy(
+        self,
+        function_call: glm.FunctionCall,
+        args: dict[str, Any],
+        session_slots: asyncio.Semaphore | None,
+        span: tracing.Span | None,
+    ) -> glm.FunctionResponse:
+        function_name = function_call.name
+        timeout = self.policy.timeout_for(function_name)
+        queued = time.perf_counter()
+        # Only set for the call that runs. A call joining an identical one in
+        # flight waits for it without taking a slot.
+        started = None
+
+        async def run_in_slot(
+            function: Callable[..., Any], args: dict[str, Any]
+        ) -> Any:
+            nonlocal started
+            async with self.policy.slot(function_name, session_slots):
+                started = time.perf_counter()
+                deadline = asyncio.timeout(timeout)
+                try:
+                    async with deadline:
+                        return await self.policy.run(function, args)
+                except TimeoutError:
+                    if deadline.expired():
+                        raise _ToolTimeoutError() from None
+                    raise
+
+        try:
+            response = await self._call_once(function_call, args, run_in_slot)
+        except asyncio.CancelledError:
+            self.policy.record(
+                function_name,
+                queue_seconds=(started or time.perf_counter()) - queued,
+                run_seconds=time.perf_counter() - started if started else 0.0,
+                cancelled=True,
+            )
+            raise
+
+        if "timed_out" in response.response:
+            logging.warning(
+                f"Function {function_name} timed out after {timeout} seconds."
+            )
+        ended = time.perf_counter()
+        started = started or queued
+        self.policy.record(
+            function_name,
+            queue_seconds=started - queued,
+            run_seconds=ended - started,
+            error="error" in response.response,
+            timed_out="timed_out" in response.response,
+        )
+        if span:
+            span.set(queue_seconds=started - queued)
+        return response
+
+    async def _call_once(
+        self,
+        function_call: glm.FunctionCall,
+        args: dict[str, Any],
+        run: Callable[[Callable[..., Any], dict[str, Any]], Awaitable[Any]],
+    ) -> glm.FunctionResponse:
         function_name = function_call.name
         try:
             if function_name not in self.func:
                 raise ValueError(f"Function {function_name} not found.")
 
-            function = self.func[function_name]
-            result = await function(**function_call.args)
+            # A lazy tool is imported on its first call.
+            function = await resolve(self.func[function_name])
+            # Identical calls are joined before taking a slot of the policy.
+            # Plain arguments, unlike the protos of the call, can be pickled
+            # for a process pool.
+            result = await _SINGLE_FLIGHT.call(function, args, args, run=run)
 
             if isinstance(result, list):
                 result = {"results": result}
@@ -60,6 +220,15 @@ class FunctionCalling(BaseModel, frozen=True):
                 result = {"result": result}
 
             return glm.FunctionResponse(name=function_name, response=result)
+        except _ToolTimeoutError:
+            timeout = self.policy.timeout_for(function_name)
+            return glm.FunctionResponse(
+                name=function_name,
+                response={
+                    "error": f"Timed out after {timeout} seconds.",
+                    "timed_out": True,
+                },
+            )
         except Exception as e:
             logging.exception(e)
             return glm.FunctionResponse(name=function_name, response={"error": str(e)})
@@ -89,24 +258,77 @@ class FunctionCalling(BaseModel, frozen=True):
     async def call_parallelly(
         self, model_responses: Iterable[glm.Part]
     ) -> Iterable[glm.Part]:
-        results = await asyncio.gather(
-            *[
-                self.call_once(part.function_call)
-                for part in model_responses
-                if "function_call" in part
-            ],
-        )
-        return [
-            glm.Part(function_response=response)
-            for response in results
-            if not isinstance(response, Exception)
+        """Calls the functions in parallel, returning the responses in the order of the calls."""
+        responses = {
+            i: response async for i, response in self.call_as_completed(model_responses)
+        }
+        return [glm.Part(function_response=responses[i]) for i in sorted(responses)]
+
+    async def call_as_completed(
+        self, model_responses: Iterable[glm.Part]
+    ) -> AsyncIterator[tuple[int, glm.FunctionResponse]]:
+        """Calls the functions in parallel, yielding each response as it completes.
+
+        Each response comes with the index of its function call among the parts.
+        If the policy cancels siblings on error, the calls still running when one
+        fails are cancelled and answered as skipped.
+        """
+        function_calls = [
+            part.function_call for part in model_responses if "function_call" in part
         ]
+        session_slots = self.policy.new_session_slots()
+
+        async def call(
+            i: int, function_call: glm.FunctionCall
+        ) -> tuple[int, glm.FunctionResponse]:
+            return i, await self.call_once(function_call, session_slots=session_slots)
+
+        tasks = [
+            asyncio.ensure_future(call(i, function_call))
+            for i, function_call in enumerate(function_calls)
+        ]
+        answered: set[int] = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                i, response = await next_done
+                answered.add(i)
+                yield i, response
+                if (
+                    "error" in response.response
+                    and self.policy.cancel_siblings_on_error
+                ):
+                    break
+            else:
+                return
+
+            for task in tasks:
+                task.cancel()
+            for i, task in enumerate(tasks):
+                if i in answered:
+                    continue
+                try:
+                    _, response = await task
+                except asyncio.CancelledError:
+                    response = glm.FunctionResponse(
+                        name=function_calls[i].name,
+                        response={"skipped": "A sibling function call failed."},
+                    )
+                yield i, response
+        finally:
+            for task in tasks:
+                task.cancel()
 
 
 class ChatSession(BaseModel, frozen=True, arbitrary_types_allowed=True):
-    model: genai.GenerativeModel
+    model: ModelSpec
     tools: FunctionCalling | None = Field(default=None)
     conversation: list[glm.Content] = Field(default_factory=list)
+    cache: ResponseCache | None = Field(default=None)
+    rate_limiter: RateLimiter | None = Field(default=None)
+    compaction: CompactionPolicy | None = Field(default=None)
+    compaction_metrics: list[CompactionMetrics] = Field(default_factory=list)
+    token_policy: TokenPolicy = Field(default_factory=TokenPolicy)
+    token_metrics: list[TokenMetrics] = Field(default_factory=list)
 
     @property
     def history(self) -> Iterable[glm.Content]:
@@ -119,10 +341,23 @@ class ChatSession(BaseModel, frozen=True, arbitrary_types_allowed=True):
         self.conversation.append(
             glm.Content(parts=[glm.Part(text=message)], role="user")
         )
+        return await self.reply()
+
+    async def reply(self) -> genai.types.GenerateContentResponse:
+        """Generates the reply to the conversation so far, calling tools as needed.
 
+        The conversation must end with a message or function responses, e.g.
+        to continue it with another model after its last reply was dropped.
+        """
         while True:
-            response = await self.model.generate_content_async(self.conversation)
-            _check_response(response)
+            self._compact()
+            await self._fit_tokens()
+            response = await generate_content(
+                self.model,
+                self.conversation,
+                cache=self.cache,
+                rate_limiter=self.rate_limiter,
+            )
 
             response_content = response.candidates[0].content
             self.conversation.append(
@@ -154,6 +389,283 @@ class ChatSession(BaseModel, frozen=True, arbitrary_types_allowed=True):
 
         return response
 
+    async def send_message_stream(
+        self,
+        message: genai.types.ContentType,
+    ) -> AsyncIterator[TextDelta | ToolCallStart | ToolCallEnd | TurnEnd]:
+        """Sends a message and streams the events of the reply.
+
+        The text is streamed as the model generates it. Tools are called as in
+        `send_message`, each reporting its end as soon as it returns.
+        """
+        self.conversation.append(
+            glm.Content(parts=[glm.Part(text=message)], role="user")
+        )
+        async for event in self.reply_stream():
+            yield event
+
+    async def reply_stream(
+        self,
+    ) -> AsyncIterator[TextDelta | ToolCallStart | ToolCallEnd | TurnEnd]:
+        """Generates the reply to the conversation so far like `reply`, streaming its events."""
+        while True:
+            self._compact()
+            await self._fit_tokens()
+            async for item in _generate_content(
+                self.model,
+                self.conversation,
+                cache=self.cache,
+                rate_limiter=self.rate_limiter,
+                stream=True,
+            ):
+                if isinstance(item, str):
+                    yield TextDelta(text=item)
+                else:
+                    response = item
+
+            response_content = response.candidates[0].content
+            self.conversation.append(
+                glm.Content(parts=response_content.parts, role=response_content.role)
+            )
+
+            function_calls = [
+                part.function_call
+                for part in response_content.parts
+                if "function_call" in part
+            ]
+            if not self.tools or not self.tools.has_functions or not function_calls:
+                yield TurnEnd(text=response.text)
+                return
+
+            for function_call in function_calls:
+                yield ToolCallStart(
+                    name=function_call.name,
+                    args=glm.FunctionCall.to_dict(function_call).get("args", {}),
+                )
+            function_responses: dict[int, glm.FunctionResponse] = {}
+            async for i, function_response in self.tools.call_as_completed(
+                response_content.parts
+            ):
+                function_responses[i] = function_response
+                yield ToolCallEnd(
+                    name=function_response.name,
+                    response=glm.FunctionResponse.to_dict(function_response).get(
+                        "response", {}
+                    ),
+                )
+            self.conversation.append(
+                glm.Content(
+                    parts=[
+                        glm.Part(function_response=function_responses[i])
+                        for i in sorted(function_responses)
+                    ],
+                    role="user",
+                )
+            )
+
+    async def _fit_tokens(self) -> None:
+        fitted, metrics = await self.token_policy.fit(self.model, self.conversation)
+        self.conversation[:] = fitted
+        self.token_metrics.append(metrics)
+        if metrics.truncated_responses:
+            logging.warning(
+                "Truncated %d function responses to fit %d tokens in %d.",
+                metrics.truncated_responses,
+                metrics.estimated_tokens,
+                self.token_policy.max_request_tokens,
+            )
+
+    def _compact(self) -> None:
+        if not self.compaction:
+            return
+        compacted, metrics = self.compaction.compact(
+            self.conversation, turn=len(self.compaction_metrics)
+        )
+        self.conversation[:] = compacted
+        self.compaction_metrics.append(metrics)
+        if metrics.tokens_saved:
+            logging.info(
+                "Compacted the conversation from %d to %d tokens.",
+                metrics.tokens_before,
+                metrics.tokens_after,
+            )
+
+
+async def generate_content(
+    model: ModelSpec,
+    contents: list[glm.Content],
+    *,
+    cache: ResponseCache | None = None,
+    rate_limiter: RateLimiter | None = None,
+) -> genai.types.AsyncGenerateContentResponse:
+    """Generates a response, going through the cache and the rate limiter.
+
+    Args:
+        model: The model to call.
+        contents: The conversation to send.
+        cache: The response cache to consult first.
+        rate_limiter: The rate limiter to acquire from before calling the model.
+
+    Returns:
+        The checked response of the model.
+    """
+    async for item in _generate_content(
+        model, contents, cache=cache, rate_limiter=rate_limiter, stream=False
+    ):
+        response = item
+    assert isinstance(response, genai.types.AsyncGenerateContentResponse)
+    return response
+
+
+def _generate_content(
+    model: ModelSpec,
+    contents: list[glm.Content],
+    *,
+    cache: ResponseCache | None,
+    rate_limiter: RateLimiter | None,
+    stream: bool,
+) -> AsyncIterator[str | genai.types.AsyncGenerateContentResponse]:
+    """Yields the text deltas of a response as they arrive, then the whole response."""
+    return tracing.span_stream(
+        model.model_name,
+        "model",
+        lambda span: _generate_traced_content(
+            model,
+            contents,
+            cache=cache,
+            rate_limiter=rate_limiter,
+            stream=stream,
+            span=span,
+        ),
+        stream=stream,
+    )
+
+
+async def _generate_traced_content(
+    model: ModelSpec,
+    contents: list[glm.Content],
+    *,
+    cache: ResponseCache | None,
+    rate_limiter: RateLimiter | None,
+    stream: bool,
+    span: tracing.Span | None,
+) -> AsyncGenerator[str | genai.types.AsyncGenerateContentResponse, None]:
+    response = None
+    active_cassette = cassette.current()
+    start = time.perf_counter()
+    key = None
+    if active_cassette and active_cassette.mode == "replay":
+        response = await active_cassette.replay_model(model, contents)
+        if span:
+            span.set(replayed=True)
+    else:
+        key = cache.key(model, contents) if cache else None
+        if cache and key:
+            response = await cache.get(key)
+            if span:
+                span.set(cached=response is not None)
+    if response is not None:
+        if stream and (text := _text_of(response.candidates[0].content)):
+            yield text
+    else:
+        estimated_tokens = estimate_request_tokens(
+            contents, system_instruction=model.system_instruction, tools=model.tools
+        )
+        if rate_limiter:
+            waited = await rate_limiter.acquire(estimated_tokens)
+            if span:
+                span.set(rate_limit_wait_seconds=waited)
+
+        # Streamed text cannot be taken back, so only whole responses are hedged.
+        hedger = None if stream else get_hedger(model.model_name)
+        # The usage is charged to the model that answered, which is the
+        # fallback model when its hedge won.
+        answered_by = model
+        if hedger:
+            (answered_by, generated), hedge_won = await hedger.call(
+                model,
+                lambda target, is_hedge: _generate_checked(
+                    target, contents, estimated_tokens, is_hedge
+                ),
+            )
+            if hedge_won and rate_limiter:
+                # The cancelled original call was charged its estimate; it
+                # read the same prompt as the hedge, but answered nothing.
+                rate_limiter.record_usage(
+                    estimated_tokens, generated.usage_metadata.prompt_token_count
+                )
+            if answered_by.model_name != model.model_name:
+                rate_limiter = get_rate_limiter(
+                    answered_by.model_name.removeprefix("models/")
+                )
+            if span:
+                span.set(hedge_won=hedge_won, answered_by=answered_by.model_name)
+        else:
+            generated = await _call_model(model, contents, stream)
+        if stream:
+            async for chunk in generated:
+                if chunk.candidates and (text := _text_of(chunk.candidates[0].content)):
+                    yield text
+        if rate_limiter:
+            rate_limiter.record_usage(
+                estimated_tokens, generated.usage_metadata.total_token_count
+            )
+        record_usage(
+            answered_by.model_name,
+            estimated_input_tokens=estimated_tokens,
+            input_tokens=generated.usage_metadata.prompt_token_count,
+            output_tokens=generated.usage_metadata.candidates_token_count,
+        )
+        if span:
+            span.set(
+                estimated_tokens=estimated_tokens,
+                prompt_tokens=generated.usage_metadata.prompt_token_count,
+                output_tokens=generated.usage_metadata.candidates_token_count,
+            )
+        _check_response(generated)
+
+        if cache and key:
+            await cache.put(key, generated)
+        response = generated
+    if active_cassette and active_cassette.mode == "record":
+        active_cassette.record_model(
+            model, contents, response, time.perf_counter() - start
+        )
+    yield response
+
+
+async def _call_model(
+    model: ModelSpec, contents: list[glm.Content], stream: bool
+) -> genai.types.AsyncGenerateContentResponse:
+    if _BACKEND:
+        return await _BACKEND(model, contents, stream)
+    return await model.model.generate_content_async(contents, stream=stream)
+
+
+async def _generate_checked(
+    model: ModelSpec,
+    contents: list[glm.Content],
+    estimated_tokens: int,
+    is_hedge: bool,
+) -> tuple[ModelSpec, genai.types.AsyncGenerateContentResponse]:
+    """Generates a whole response, raising if it is not valid.
+
+    Returns:
+        The model called, and its response.
+    """
+    # The original call already went through the rate limiter.
+    if is_hedge and (
+        rate_limiter := get_rate_limiter(model.model_name.removeprefix("models/"))
+    ):
+        await rate_limiter.acquire(estimated_tokens)
+    response = await _call_model(model, contents, False)
+    _check_response(response)
+    return model, response
+
+
+def _text_of(content: glm.Content) -> str:
+    return "".join(part.text for part in content.parts if "text" in part)
+
 
 def _check_response(response: genai.types.AsyncGenerateContentResponse) -> None:
     if response.prompt_feedback.block_reason:
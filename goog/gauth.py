@@ -1,57 +1,276 @@
 import asyncio
 from concurrent.futures import Executor
+import contextlib
+import datetime
+import os
 import os.path
+import sys
+import tempfile
+import threading
+from typing import Iterator
 
 from google.auth.credentials import Credentials
 from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials as ServiceCredentials
 from google.oauth2.credentials import Credentials as OAuthCredentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 import logging
 
+# On Windows, the token file is not locked across processes.
+if sys.platform != "win32":
+    import fcntl
 
-def _get_oauth_credentials(scopes: list[str]) -> Credentials:
-    creds = None
+_TOKEN_FILE = "token.json"
+_CLIENT_SECRETS_FILE = "credentials.json"
+_SERVICE_ACCOUNT_FILE = "service_account_key.json"
+# How long before its expiry a token is refreshed in the background.
+_REFRESH_MARGIN_SECONDS = 5 * 60
+
+
+def _read_oauth_token(scopes: list[str]) -> OAuthCredentials | None:
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists("token.json"):
-        creds = OAuthCredentials.from_authorized_user_file("token.json", scopes)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
+    if not os.path.exists(_TOKEN_FILE):
+        return None
+    return OAuthCredentials.from_authorized_user_file(_TOKEN_FILE, scopes)
+
+
+def _write_token(creds: OAuthCredentials) -> None:
+    """Saves the credentials for the next run, atomically.
+
+    Another process reading the token file sees either the old token or the
+    new one, never a partial write.
+    """
+    directory = os.path.dirname(os.path.abspath(_TOKEN_FILE))
+    fd, path = tempfile.mkstemp(dir=directory, prefix=".token.", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as token:
+            token.write(creds.to_json())
+        os.replace(path, _TOKEN_FILE)
+    except BaseException:
+        os.unlink(path)
+        raise
+
+
+@contextlib.contextmanager
+def _token_file_lock() -> Iterator[None]:
+    """Holds an exclusive lock on the token file across processes."""
+    if sys.platform == "win32":
+        yield
+        return
+    with open(f"{_TOKEN_FILE}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _expires_within(creds: Credentials, seconds: float) -> bool:
+    if creds.expiry is None:
+        return False
+    # The expiry of the credentials is a naive datetime in UTC.
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry - datetime.timedelta(seconds=seconds) <= now
+
+
+def _get_oauth_credentials(scopes: list[str]) -> Credentials:
+    with _token_file_lock():
+        creds = _read_oauth_token(scopes)
+        if creds and creds.valid:
+            return creds
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file("credentials.json", scopes)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open("token.json", "w") as token:
-            token.write(creds.to_json())
-    return creds
+            _write_token(creds)
+            return creds
+
+    # If there are no (valid) credentials available, let the user log in.
+    # The login waits on the user, so the other processes are not kept
+    # waiting on the lock meanwhile.
+    logged_in = _log_in(scopes)
+    with _token_file_lock():
+        # Another process may have logged in meanwhile.
+        stored = _read_oauth_token(scopes)
+        if stored is not None and stored.valid:
+            return stored
+        _write_token(logged_in)
+    return logged_in
+
+
+def _log_in(scopes: list[str]) -> OAuthCredentials:
+    """Runs the OAuth flow in the browser of the user."""
+    # Deferred, as only the first login needs it.
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
+    flow = InstalledAppFlow.from_client_secrets_file(_CLIENT_SECRETS_FILE, scopes)
+    return flow.run_local_server(port=0)
 
 
 def _get_service_credentials(scopes: list[str]) -> ServiceCredentials:
     return ServiceCredentials.from_service_account_file(
-        "service_account_key.json",
+        _SERVICE_ACCOUNT_FILE,
         scopes=scopes,
     )
 
 
+def _load_credentials(scopes: list[str]) -> Credentials | None:
+    if os.path.exists(_CLIENT_SECRETS_FILE):
+        logging.info("Found Oauth2 account file.")
+        return _get_oauth_credentials(scopes)
+
+    if os.path.exists(_SERVICE_ACCOUNT_FILE):
+        logging.info("Found service account file.")
+        return _get_service_credentials(scopes)
+
+    return None
+
+
+class CredentialManager:
+    """Keeps the credentials of some scopes loaded and fresh.
+
+    The credentials are loaded once and cached. When a token is about to
+    expire, it is refreshed in the background on an executor while the
+    callers keep using the current one; only an expired token makes callers
+    wait. Concurrent callers share a single refresh.
+
+    Several processes can share the token file: a refresh holds a lock on
+    the file and first rereads it, adopting the token if another process
+    has already refreshed it.
+    """
+
+    def __init__(
+        self,
+        scopes: list[str],
+        *,
+        refresh_margin_seconds: float = _REFRESH_MARGIN_SECONDS,
+        executor: Executor | None = None,
+    ) -> None:
+        """Initializes the manager.
+
+        Args:
+            scopes: A list of permission scopes.
+            refresh_margin_seconds: How long before its expiry a token is refreshed.
+            executor: The executor to load and refresh the credentials on.
+                None for the default executor of the event loop.
+        """
+        self.scopes = list(scopes)
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.refreshes = 0
+        self._executor = executor
+        self._creds: Credentials | None = None
+        self._loaded = False
+        # Serializes loading and refreshing between the executor and sync callers.
+        self._lock = threading.Lock()
+        self._refresh_task: asyncio.Future[None] | None = None
+
+    async def get(self) -> Credentials | None:
+        """Returns the credentials, refreshing them if needed.
+
+        Returns:
+            The credentials if found, otherwise, None.
+        """
+        if not self._loaded or (self._creds is not None and not self._creds.valid):
+            # Nothing usable yet, so wait for the shared refresh.
+            await asyncio.shield(self._start_refresh())
+        elif self._creds is not None and _expires_within(
+            self._creds, self.refresh_margin_seconds
+        ):
+            self._start_refresh()
+        return self._creds
+
+    def get_sync(self) -> Credentials | None:
+        """Returns the credentials, refreshing them on the calling thread if needed.
+
+        Returns:
+            The credentials if found, otherwise, None.
+        """
+        self._update()
+        return self._creds
+
+    def _start_refresh(self) -> asyncio.Future[None]:
+        if self._refresh_task is None or self._refresh_task.done():
+            loop = asyncio.get_running_loop()
+            self._refresh_task = loop.run_in_executor(self._executor, self._update)
+            self._refresh_task.add_done_callback(_log_refresh_error)
+        return self._refresh_task
+
+    def _update(self) -> None:
+        """Loads the credentials, or refreshes them if they are about to expire."""
+        with self._lock:
+            if not self._loaded:
+                self._creds = _load_credentials(self.scopes)
+                self._loaded = True
+            creds = self._creds
+            if creds is None or (
+                creds.valid and not _expires_within(creds, self.refresh_margin_seconds)
+            ):
+                return
+            if not isinstance(creds, OAuthCredentials):
+                creds.refresh(Request())
+                self.refreshes += 1
+                return
+            with _token_file_lock():
+                # Another process may have refreshed the token already.
+                stored = _read_oauth_token(self.scopes)
+                if (
+                    stored is not None
+                    and stored.valid
+                    and not _expires_within(stored, self.refresh_margin_seconds)
+                ):
+                    logging.info("Using the token refreshed by another process.")
+                    self._creds = stored
+                    return
+                logging.info("Refreshing the Oauth2 token.")
+                creds.refresh(Request())
+                _write_token(creds)
+                self.refreshes += 1
+
+
+def _log_refresh_error(task: asyncio.Future[None]) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning("Failed to refresh the credentials: %r.", task.exception())
+
+
+_MANAGERS: dict[tuple[str, ...], CredentialManager] = {}
+
+
+def get_credential_manager(scopes: list[str]) -> CredentialManager:
+    """Returns the shared credential manager of some scopes.
+
+    Args:
+        scopes: a list of permission scopes.
+
+    Returns:
+        The manager, created on first use.
+    """
+    key = tuple(sorted(scopes))
+    if key not in _MANAGERS:
+        _MANAGERS[key] = CredentialManager(scopes)
+    return _MANAGERS[key]
+
+
 def get_credentials(scopes: list[str]) -> Credentials | None:
     """Get credentials from service account or oauth.
-    
+
+    The credentials are cached, see `get_credential_manager` to get them
+    without blocking the event loop.
+
     Args:
         scopes: a list of permission scopes.
-        
+
     Returns:
         the credentials if found, otherwise, None
     """
-    if os.path.exists("credentials.json"):
-        logging.info("Found Oauth2 account file.")
-        return _get_oauth_credentials(scopes)
+    return get_credential_manager(scopes).get_sync()
 
-    if os.path.exists("service_account_key.json"):
-        logging.info("Found service account file.")
-        return _get_service_credentials(scopes)
 
-    return None
+async def get_credentials_async(scopes: list[str]) -> Credentials | None:
+    """Get credentials from service account or oauth, without blocking.
+
+    Args:
+        scopes: a list of permission scopes.
+
+    Returns:
+        the credentials if found, otherwise, None
+    """
+    return await get_credential_manager(scopes).get()
@@ -0,0 +1,174 @@
+"""Hedging of slow model calls to cut tail latency."""
+
+import asyncio
+import collections
+from goog.model_spec import ModelSpec
+import logging
+from pydantic import BaseModel
+import statistics
+import time
+from typing import Awaitable, Callable, TypeVar
+
+R = TypeVar("R")
+
+
+class HedgerStats(BaseModel):
+    """Counters of a hedger."""
+
+    requests: int = 0
+    hedged: int = 0
+    # Hedged requests answered first by the hedge, or by the original call.
+    hedge_wins: int = 0
+    hedge_losses: int = 0
+    # Requests slow enough to hedge, but not hedged to stay under the budget.
+    over_budget: int = 0
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+
+class Hedger:
+    """Sends a duplicate of a model call that is slower than usual.
+
+    Once a call has run longer than a percentile of the recent latencies of
+    the model, a duplicate is sent, possibly to a faster fallback model. The
+    first valid response wins and the other call is cancelled. Hedges are
+    limited to a fraction of the requests, so that a slow backend does not
+    get twice the load.
+    """
+
+    def __init__(
+        self,
+        *,
+        percentile: float = 95,
+        budget: float = 0.05,
+        fallback_model_name: str | None = None,
+        min_samples: int = 20,
+        window: int = 1_000,
+    ) -> None:
+        """Initializes the hedger.
+
+        Args:
+            percentile: The percentile of the latencies after which to hedge.
+            budget: The maximum fraction of the requests to hedge.
+            fallback_model_name: The model to send the hedge to, e.g.
+                "gemini-1.5-flash-latest". None to send it to the same model.
+            min_samples: The number of latencies to observe before hedging.
+            window: The number of recent latencies to compute the percentile from.
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.fallback_model_name = fallback_model_name
+        self.min_samples = min_samples
+        self.stats = HedgerStats()
+        self._latencies: collections.deque[float] = collections.deque(maxlen=window)
+
+    @property
+    def delay_seconds(self) -> float | None:
+        """How long a call runs before it is hedged, or None while still observing."""
+        if not self._latencies or len(self._latencies) < self.min_samples:
+            return None
+        if len(self._latencies) == 1:
+            return self._latencies[0]
+        cuts = statistics.quantiles(self._latencies, n=100, method="inclusive")
+        return cuts[min(98, max(0, round(self.percentile) - 1))]
+
+    async def call(
+        self,
+        model: ModelSpec,
+        generate: Callable[[ModelSpec, bool], Awaitable[R]],
+    ) -> tuple[R, bool]:
+        """Calls a model, hedging the call if it is slow.
+
+        Args:
+            model: The model to call.
+            generate: Calls the given model, given whether it is the hedge.
+                It raises if the response is not valid.
+
+        Returns:
+            The first valid response, and whether it came from the hedge.
+        """
+        self.stats.requests += 1
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(generate(model, False))
+        tasks = {primary}
+        error: BaseException | None = None
+        try:
+            delay = self.delay_seconds
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if done:
+                    pass
+                elif self.stats.hedged + 1 > self.budget * self.stats.requests:
+                    self.stats.over_budget += 1
+                else:
+                    self.stats.hedged += 1
+                    logging.info(
+                        "Hedging a call to %s after %.2f seconds.",
+                        model.model_name,
+                        delay,
+                    )
+                    hedge_model = self._hedge_model(model)
+                    tasks.add(asyncio.ensure_future(generate(hedge_model, True)))
+            hedging = len(tasks) > 1
+
+            while True:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Prefer the original call when both are done.
+                for task in sorted(done, key=lambda task: task is not primary):
+                    error = task.exception()
+                    if error is not None:
+                        if hedging:
+                            logging.warning("A hedged call failed: %r.", error)
+                        continue
+                    # A lower bound of the latency of the model when the hedge won.
+                    self._latencies.append(time.perf_counter() - start)
+                    if hedging and task is primary:
+                        self.stats.hedge_losses += 1
+                    elif hedging:
+                        self.stats.hedge_wins += 1
+                    return task.result(), task is not primary
+                if not tasks:
+                    # Every call failed; the last error is raised.
+                    assert error is not None
+                    raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _hedge_model(self, model: ModelSpec) -> ModelSpec:
+        if self.fallback_model_name is None:
+            return model
+        # The same instruction, tools and configuration, on another model.
+        return model.with_model_name(self.fallback_model_name)
+
+
+_HEDGERS: dict[str, Hedger] = {}
+
+
+def configure_hedging(model_name: str, **kwargs) -> Hedger:
+    """Hedges the slow calls to a model.
+
+    Args:
+        model_name: The name of the model, e.g. "gemini-1.5-pro-latest".
+        **kwargs: The arguments to `Hedger`.
+
+    Returns:
+        The hedger of the model.
+    """
+    hedger = Hedger(**kwargs)
+    _HEDGERS[model_name] = hedger
+    return hedger
+
+
+def get_hedger(model_name: str) -> Hedger | None:
+    """Returns the hedger of a model, or None if its calls are not hedged."""
+    return _HEDGERS.get(model_name.removeprefix("models/"))
+
+
+def hedger_stats() -> dict[str, HedgerStats]:
+    """Returns the stats of every configured hedger by model name."""
+    return {model_name: hedger.stats for model_name, hedger in _HEDGERS.items()}
@@ -0,0 +1,206 @@
+"""Tools declared from their source, with their modules imported on first call."""
+
+import ast
+import asyncio
+import builtins
+import functools
+import importlib
+import importlib.util
+import inspect
+import logging
+import threading
+import typing
+from typing import Any, Callable
+
+# The names an annotation may use to be evaluated without importing its module.
+_ANNOTATION_NAMESPACE = {
+    **vars(builtins),
+    **{name: getattr(typing, name) for name in typing.__all__},
+}
+
+
+class LazyTool:
+    """A tool whose module is only imported when the tool is first called.
+
+    Its name, docstring and signature are read from the source of its module
+    without running it, so that agents can declare it to the model at no
+    import cost. Whatever the tool is decorated with, it is declared as it is
+    written. When its signature cannot be read from the source alone, e.g. an
+    annotation with a type of its module, the module is imported right away.
+
+    `FunctionCalling` calls the loaded function, so that its executor and
+    memoization marks apply; see `load_async`.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Declares the tool.
+
+        Args:
+            path: The path of the tool as "module:function", e.g.
+                "functions.web:web_search".
+        """
+        module_name, _, name = path.partition(":")
+        if not module_name or not name:
+            raise ValueError(f"Invalid tool path {path}, expected module:function.")
+        self.path = path
+        self.module_name = module_name
+        self.__name__ = self.__qualname__ = name
+        self.__module__ = module_name
+        self._function: Callable[..., Any] | None = None
+        self._lock = threading.Lock()
+        try:
+            self.__doc__, self.__signature__ = _read_declaration(module_name, name)
+        except (LookupError, OSError, SyntaxError, ValueError) as e:
+            logging.warning("Importing %s to declare it: %s", path, e)
+            function = self.load()
+            self.__doc__ = function.__doc__
+            self.__signature__ = inspect.signature(function)
+
+    @property
+    def loaded(self) -> bool:
+        return self._function is not None
+
+    def load(self) -> Callable[..., Any]:
+        """Imports the module of the tool, once, and returns the function."""
+        with self._lock:
+            if self._function is None:
+                module = importlib.import_module(self.module_name)
+                self._function = getattr(module, self.__name__)
+        return self._function
+
+    async def load_async(self) -> Callable[..., Any]:
+        """Like `load`, but imports the module on a thread, off the event loop."""
+        if self._function is not None:
+            return self._function
+        return await asyncio.to_thread(self.load)
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"LazyTool({self.path!r})"
+
+
+_TOOLS: dict[str, LazyTool] = {}
+
+
+def lazy_tool(path: str) -> LazyTool:
+    """Returns the lazy tool of a path, shared by every agent using it.
+
+    Args:
+        path: The path of the tool as "module:function", e.g.
+            "functions.web:web_search".
+    """
+    tool = _TOOLS.get(path)
+    if tool is None:
+        tool = _TOOLS[path] = LazyTool(path)
+    return tool
+
+
+def lazy_tools() -> dict[str, LazyTool]:
+    """Returns the lazy tools declared so far by path."""
+    return _TOOLS
+
+
+async def resolve(function: Callable[..., Any]) -> Callable[..., Any]:
+    """Returns the function behind a tool, importing it if it is lazy."""
+    if isinstance(function, LazyTool):
+        return await function.load_async()
+    return function
+
+
+def _read_declaration(
+    module_name: str, name: str
+) -> tuple[str | None, inspect.Signature]:
+    """Reads the docstring and the signature of a function from the source of its module.
+
+    Raises:
+        LookupError: The source or the function is not found.
+        ValueError: An annotation or a default value needs the module to be run.
+    """
+    node = _parse_module(module_name).get(name)
+    if node is None:
+        raise LookupError(f"No function {name} in {module_name}.")
+
+    arguments = node.args
+    positional = [*arguments.posonlyargs, *arguments.args]
+    # The defaults are those of the last positional arguments.
+    defaults = [None] * (len(positional) - len(arguments.defaults)) + list(
+        arguments.defaults
+    )
+    parameters = [
+        _parameter(
+            argument,
+            (
+                inspect.Parameter.POSITIONAL_ONLY
+                if i < len(arguments.posonlyargs)
+                else inspect.Parameter.POSITIONAL_OR_KEYWORD
+            ),
+            default,
+        )
+        for i, (argument, default) in enumerate(zip(positional, defaults))
+    ]
+    if arguments.vararg:
+        parameters.append(
+            _parameter(arguments.vararg, inspect.Parameter.VAR_POSITIONAL, None)
+        )
+    parameters += [
+        _parameter(argument, inspect.Parameter.KEYWORD_ONLY, default)
+        for argument, default in zip(arguments.kwonlyargs, arguments.kw_defaults)
+    ]
+    if arguments.kwarg:
+        parameters.append(
+            _parameter(arguments.kwarg, inspect.Parameter.VAR_KEYWORD, None)
+        )
+    return_annotation = (
+        _evaluate_annotation(node.returns) if node.returns else inspect.Signature.empty
+    )
+    return (
+        ast.get_docstring(node, clean=False),
+        inspect.Signature(parameters, return_annotation=return_annotation),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_module(
+    module_name: str,
+) -> dict[str, ast.FunctionDef | ast.AsyncFunctionDef]:
+    """Returns the top-level functions of a module by name, without running it."""
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or spec.origin is None or not spec.has_location:
+        raise LookupError(f"No source for {module_name}.")
+    with open(spec.origin, encoding="utf-8") as source:
+        tree = ast.parse(source.read(), filename=spec.origin)
+    return {
+        node.name: node
+        for node in tree.body
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    }
+
+
+def _parameter(
+    argument: ast.arg, kind: inspect._ParameterKind, default: ast.expr | None
+) -> inspect.Parameter:
+    return inspect.Parameter(
+        argument.arg,
+        kind,
+        default=(
+            inspect.Parameter.empty if default is None else ast.literal_eval(default)
+        ),
+        annotation=(
+            _evaluate_annotation(argument.annotation)
+            if argument.annotation
+            else inspect.Parameter.empty
+        ),
+    )
+
+
+def _evaluate_annotation(annotation: ast.expr) -> Any:
+    if isinstance(annotation, ast.Constant) and isinstance(annotation.value, str):
+        # A string annotation.
+        annotation = ast.parse(annotation.value, mode="eval").body
+    source = ast.unparse(annotation)
+    try:
+        return eval(source, dict(_ANNOTATION_NAMESPACE))
+    except Exception as e:
+        raise ValueError(f"Cannot evaluate the annotation {source}.") from e
@@ -0,0 +1,76 @@
+"""The settings of a model, besides the conversation sent to it."""
+
+import functools
+from google.ai import generativelanguage as glm
+import google.generativeai as genai
+from google.generativeai.types import content_types, generation_types
+from pydantic import BaseModel, Field, field_validator
+from typing import Any, Iterable
+
+
+class ModelSpec(BaseModel, frozen=True, arbitrary_types_allowed=True):
+    """What is sent to a model along with the conversation.
+
+    `genai.GenerativeModel` keeps its settings private, so they are kept here
+    instead, where the response cache, the cassettes, the token estimates and
+    the hedges can read them. The model itself is built from them on first use.
+    """
+
+    # With the "models/" prefix, as in `genai.GenerativeModel.model_name`.
+    model_name: str
+    system_instruction: str | None = None
+    # The function declarations. Anything genai accepts as tools, e.g. the
+    # functions themselves, is declared once on validation.
+    tools: list[glm.Tool] | None = None
+    generation_config: dict[str, Any] = Field(default_factory=dict)
+
+    @field_validator("model_name")
+    @classmethod
+    def qualify_model_name(cls, model_name: str) -> str:
+        return model_name if "/" in model_name else f"models/{model_name}"
+
+    @field_validator("tools", mode="before")
+    @classmethod
+    def declare_tools(cls, tools: Any) -> list[glm.Tool] | None:
+        if not tools:
+            return None
+        return content_types.to_function_library(tools).to_proto()
+
+    @field_validator("generation_config", mode="before")
+    @classmethod
+    def normalize_generation_config(cls, generation_config: Any) -> dict[str, Any]:
+        return generation_types.to_generation_config_dict(generation_config)
+
+    @functools.cached_property
+    def model(self) -> genai.GenerativeModel:
+        """The model to call."""
+        return genai.GenerativeModel(
+            model_name=self.model_name,
+            generation_config=self.generation_config,
+            system_instruction=self.system_instruction,
+            tools=self.tools,
+        )
+
+    def with_model_name(self, model_name: str) -> "ModelSpec":
+        """Returns the same settings for another model."""
+        # Not `model_copy`, which would keep the model built for this one.
+        return ModelSpec(
+            model_name=model_name,
+            system_instruction=self.system_instruction,
+            tools=self.tools,
+            generation_config=self.generation_config,
+        )
+
+    def request(self, contents: Iterable[glm.Content]) -> glm.GenerateContentRequest:
+        """Returns the request sending a conversation to the model."""
+        return glm.GenerateContentRequest(
+            model=self.model_name,
+            contents=list(contents),
+            generation_config=self.generation_config,
+            tools=self.tools or [],
+            system_instruction=(
+                content_types.to_content(self.system_instruction)
+                if self.system_instruction
+                else None
+            ),
+        )
@@ -0,0 +1,171 @@
+"""Process-wide rate limiting of model calls."""
+
+import asyncio
+from pydantic import BaseModel
+import time
+import weakref
+
+
+class RateLimiterStats(BaseModel):
+    """Live counters of a rate limiter."""
+
+    acquired: int = 0
+    waiting: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    @property
+    def average_wait_seconds(self) -> float:
+        return self.total_wait_seconds / self.acquired if self.acquired else 0.0
+
+
+class RateLimiter:
+    """A token bucket limiting requests and tokens per minute.
+
+    Callers queue in FIFO order, so a large request cannot be starved by a
+    stream of small ones.
+    """
+
+    def __init__(
+        self,
+        *,
+        requests_per_minute: float,
+        tokens_per_minute: float | None = None,
+    ) -> None:
+        """Initializes the limiter with full buckets.
+
+        Args:
+            requests_per_minute: The number of requests allowed per minute.
+            tokens_per_minute: The number of tokens allowed per minute. None for no token limit.
+
+        Raises:
+            ValueError: A limit is not positive.
+        """
+        if requests_per_minute <= 0:
+            raise ValueError(
+                f"requests_per_minute must be positive, got {requests_per_minute}."
+            )
+        if tokens_per_minute is not None and tokens_per_minute <= 0:
+            raise ValueError(
+                f"tokens_per_minute must be positive, got {tokens_per_minute}."
+            )
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.stats = RateLimiterStats()
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        # The limiter is shared by the process, but a lock belongs to the
+        # event loop it is first used on.
+        self._locks: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, asyncio.Lock
+        ] = weakref.WeakKeyDictionary()
+
+    async def acquire(self, tokens: int = 0) -> float:
+        """Waits until the request fits in the buckets, then takes its share.
+
+        Args:
+            tokens: The estimated number of tokens of the request.
+
+        Returns:
+            The number of seconds spent waiting.
+        """
+        if self.tokens_per_minute is not None:
+            # A request larger than the whole bucket would wait forever.
+            tokens = min(tokens, int(self.tokens_per_minute))
+
+        start = time.monotonic()
+        self.stats.waiting += 1
+        try:
+            lock = self._locks.setdefault(asyncio.get_running_loop(), asyncio.Lock())
+            async with lock:
+                while (wait_seconds := self._wait_seconds(tokens)) > 0:
+                    await asyncio.sleep(wait_seconds)
+                self._requests -= 1
+                if self.tokens_per_minute is not None:
+                    self._tokens -= tokens
+        finally:
+            self.stats.waiting -= 1
+
+        waited = time.monotonic() - start
+        self.stats.acquired += 1
+        self.stats.total_wait_seconds += waited
+        self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+        return waited
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Corrects the token bucket once the actual usage is known.
+
+        Args:
+            estimated_tokens: The tokens taken by `acquire`.
+            actual_tokens: The tokens reported by the model.
+        """
+        if self.tokens_per_minute is None:
+            return
+        self._refill()
+        self._tokens -= actual_tokens - estimated_tokens
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._updated) / 60
+        self._updated = now
+        self._requests = min(
+            self.requests_per_minute,
+            self._requests + elapsed_minutes * self.requests_per_minute,
+        )
+        if self.tokens_per_minute is not None:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed_minutes * self.tokens_per_minute,
+            )
+
+    def _wait_seconds(self, tokens: int) -> float:
+        self._refill()
+        wait_minutes = 0.0
+        if self._requests < 1:
+            wait_minutes = (1 - self._requests) / self.requests_per_minute
+        if self.tokens_per_minute is not None and self._tokens < tokens:
+            wait_minutes = max(
+                wait_minutes, (tokens - self._tokens) / self.tokens_per_minute
+            )
+        return wait_minutes * 60
+
+
+_LIMITERS: dict[str, RateLimiter] = {}
+
+
+def configure_rate_limit(
+    model_name: str,
+    *,
+    requests_per_minute: float,
+    tokens_per_minute: float | None = None,
+) -> RateLimiter:
+    """Sets the rate limit shared by all calls to a model.
+
+    Args:
+        model_name: The name of the model, e.g. "gemini-1.5-flash-latest".
+        requests_per_minute: The number of requests allowed per minute.
+        tokens_per_minute: The number of tokens allowed per minute. None for no token limit.
+
+    Returns:
+        The limiter of the model.
+
+    Raises:
+        ValueError: A limit is not positive.
+    """
+    limiter = RateLimiter(
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+    )
+    _LIMITERS[model_name] = limiter
+    return limiter
+
+
+def get_rate_limiter(model_name: str) -> RateLimiter | None:
+    """Returns the limiter of a model, or None if the model is not limited."""
+    return _LIMITERS.get(model_name)
+
+
+def rate_limiter_stats() -> dict[str, RateLimiterStats]:
+    """Returns the live stats of every configured limiter by model name."""
+    return {model_name: limiter.stats for model_name, limiter in _LIMITERS.items()}
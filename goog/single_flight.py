@@ -0,0 +1,143 @@
+"""Deduplication of identical concurrent tool calls."""
+
+import asyncio
+import collections
+from goog.decorators import MEMOIZE_TTL_SECONDS_ATTRIBUTE, NEVER_DEDUPE_ATTRIBUTE
+import json
+from pydantic import BaseModel
+import time
+from typing import Any, Awaitable, Callable
+import weakref
+
+# The qualified name of a function and its canonicalized arguments.
+_Key = tuple[str, str]
+
+
+class SingleFlightStats(BaseModel):
+    """Counters of a single-flight group."""
+
+    calls: int = 0
+    shared: int = 0
+    memo_hits: int = 0
+
+
+class _Flight:
+    """A call in flight and the number of callers awaiting it."""
+
+    def __init__(self, task: asyncio.Task) -> None:
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Lets identical concurrent calls share one execution.
+
+    A call is identified by the module and qualified name of the function and
+    by its canonicalized arguments, so that a function garbage collected and
+    replaced by another at the same address is not mistaken for it. While a
+    call is in flight, identical calls on the same event loop wait for its
+    result instead of running again. The call is cancelled once all the callers
+    awaiting it are cancelled. Functions marked with
+    `goog.decorators.memoize` also keep their results for later calls, and
+    functions marked with `goog.decorators.never_dedupe` always run.
+    """
+
+    def __init__(self, *, max_memo_entries: int = 1024) -> None:
+        """Initializes the group.
+
+        Args:
+            max_memo_entries: The maximum number of memoized results.
+        """
+        self.max_memo_entries = max_memo_entries
+        self.stats = SingleFlightStats()
+        # Tasks belong to the loop that created them.
+        self._in_flight: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, dict[_Key, _Flight]
+        ] = weakref.WeakKeyDictionary()
+        self._memo: collections.OrderedDict[_Key, tuple[float, Any]] = (
+            collections.OrderedDict()
+        )
+
+    async def call(
+        self,
+        function: Callable[..., Awaitable[Any]],
+        args: dict[str, Any],
+        canonical_args: Any,
+        *,
+        run: (
+            Callable[[Callable[..., Any], dict[str, Any]], Awaitable[Any]] | None
+        ) = None,
+    ) -> Any:
+        """Calls the function, or joins an identical call in flight.
+
+        Args:
+            function: The function to call.
+            args: The keyword arguments to call the function with.
+            canonical_args: A JSON-serializable form of the arguments to identify the call.
+            run: Runs the function with the arguments, e.g. on an executor once a
+                slot is free. It only runs for the first of identical calls.
+                None to await the call of the function.
+
+        Returns:
+            The result of the function.
+        """
+        self.stats.calls += 1
+        if run is None:
+            run = _await_call
+        if getattr(function, NEVER_DEDUPE_ATTRIBUTE, False):
+            return await run(function, args)
+
+        key = (
+            f"{function.__module__}.{function.__qualname__}",
+            json.dumps(canonical_args, sort_keys=True, default=str),
+        )
+        ttl_seconds = getattr(function, MEMOIZE_TTL_SECONDS_ATTRIBUTE, None)
+        if ttl_seconds is not None and key in self._memo:
+            expires, result = self._memo[key]
+            if expires > time.monotonic():
+                self._memo.move_to_end(key)
+                self.stats.memo_hits += 1
+                return result
+            del self._memo[key]
+
+        in_flight = self._in_flight.setdefault(asyncio.get_running_loop(), {})
+        flight = in_flight.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.ensure_future(run(function, args)))
+            in_flight[key] = flight
+            flight.task.add_done_callback(lambda _: _forget(in_flight, key, flight))
+        else:
+            self.stats.shared += 1
+
+        flight.waiters += 1
+        try:
+            # A cancelled caller must not cancel the call others still await.
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # No one else awaits the call: stop it, and wait until it
+                # stopped, so that its slot is free once the caller is.
+                _forget(in_flight, key, flight)
+                flight.task.cancel()
+                await asyncio.wait([flight.task])
+            raise
+        finally:
+            flight.waiters -= 1
+        if ttl_seconds is not None:
+            self._memo[key] = (time.monotonic() + ttl_seconds, result)
+            self._memo.move_to_end(key)
+            while len(self._memo) > self.max_memo_entries:
+                self._memo.popitem(last=False)
+        return result
+
+
+def _forget(in_flight: dict[_Key, _Flight], key: _Key, flight: _Flight) -> None:
+    # A later call with the same key may be in flight already.
+    if in_flight.get(key) is flight:
+        del in_flight[key]
+
+
+async def _await_call(
+    function: Callable[..., Awaitable[Any]], args: dict[str, Any]
+) -> Any:
+    return await function(**args)
@@ -0,0 +1,279 @@
+"""Token accounting for model requests."""
+
+from google.ai import generativelanguage as glm
+from goog.model_spec import ModelSpec
+import google.generativeai as genai
+import json
+from pydantic import BaseModel
+from typing import Iterable
+
+# Gemini 1.5 Flash takes about a million tokens, and Pro twice as many.
+_DEFAULT_MAX_REQUEST_TOKENS = 1_000_000
+# The tokens of a truncated function response besides its text.
+_TRUNCATION_OVERHEAD_TOKENS = 16
+_MAX_FIT_ROUNDS = 3
+# A rough average over English text and JSON.
+_BYTES_PER_TOKEN = 4
+
+
+class RequestTooLargeError(ValueError):
+    """A request is over the token limit even with its function responses truncated."""
+
+
+class TokenMetrics(BaseModel):
+    """What fitting a request to the token limit did."""
+
+    estimated_tokens: int
+    # The count of the count-tokens endpoint, if it was asked.
+    exact_tokens: int | None = None
+    tokens_after: int
+    truncated_responses: int = 0
+
+
+class TokenUsage(BaseModel):
+    """The tokens used by the calls to a model."""
+
+    calls: int = 0
+    estimated_input_tokens: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+
+    @property
+    def estimate_ratio(self) -> float:
+        """How the estimated input tokens compare to the actual ones."""
+        return (
+            self.estimated_input_tokens / self.input_tokens
+            if self.input_tokens
+            else 0.0
+        )
+
+
+def estimate_tokens(contents: Iterable[glm.Content]) -> int:
+    """Roughly estimates the number of tokens of a conversation."""
+    return (
+        sum(glm.Content.pb(content).ByteSize() for content in contents)
+        // _BYTES_PER_TOKEN
+    )
+
+
+def estimate_text_tokens(text: str) -> int:
+    """Roughly estimates the number of tokens of a text."""
+    return len(text.encode("utf-8")) // _BYTES_PER_TOKEN
+
+
+def estimate_request_tokens(
+    contents: Iterable[glm.Content],
+    *,
+    system_instruction: str | None = None,
+    tools: Iterable[glm.Tool] | None = None,
+) -> int:
+    """Roughly estimates the number of tokens of a request.
+
+    Unlike `estimate_tokens`, the system instruction and the tool
+    declarations sent along with the conversation are counted too.
+
+    Args:
+        contents: The conversation.
+        system_instruction: The system instruction of the model.
+        tools: The tool declarations of the model.
+    """
+    model_bytes = 0
+    if system_instruction:
+        model_bytes += len(system_instruction.encode("utf-8"))
+    if tools:
+        model_bytes += sum(glm.Tool.pb(tool).ByteSize() for tool in tools)
+    return model_bytes // _BYTES_PER_TOKEN + estimate_tokens(contents)
+
+
+async def count_tokens(
+    model: genai.GenerativeModel, contents: Iterable[glm.Content]
+) -> int:
+    """Counts the tokens of a request exactly, with the count-tokens endpoint of the model."""
+    response = await model.count_tokens_async(list(contents))
+    return response.total_tokens
+
+
+def estimate_function_response_tokens(response: glm.FunctionResponse) -> int:
+    """Roughly estimates the number of tokens of a function response."""
+    return glm.FunctionResponse.pb(response).ByteSize() // _BYTES_PER_TOKEN
+
+
+class TokenPolicy(BaseModel, frozen=True):
+    """Keeps every request under a hard token limit.
+
+    This is the last check before a request is sent, after any compaction.
+    When the request is over the limit, the longest function responses are
+    truncated to an equal share, so that the result depends only on the
+    sizes of the responses, not on their order.
+    """
+
+    max_request_tokens: int = _DEFAULT_MAX_REQUEST_TOKENS
+    # The maximum size of any function response. None for no limit.
+    max_function_response_tokens: int | None = None
+    # Whether to ask the count-tokens endpoint when the estimate is close to
+    # the limit, within `exact_margin` of it.
+    exact: bool = False
+    exact_margin: float = 0.2
+
+    async def fit(
+        self, model: ModelSpec, contents: list[glm.Content]
+    ) -> tuple[list[glm.Content], TokenMetrics]:
+        """Fits a request to the token limit.
+
+        Args:
+            model: The model the request is for.
+            contents: The conversation. It is not modified.
+
+        Returns:
+            The fitted conversation and what fitting it did.
+
+        Raises:
+            RequestTooLargeError: Truncating the function responses is not enough.
+        """
+        fitted = list(contents)
+        truncated = 0
+        if self.max_function_response_tokens is not None:
+            truncated += _truncate_function_responses(
+                fitted, self.max_function_response_tokens
+            )
+
+        estimated = estimate_request_tokens(
+            fitted, system_instruction=model.system_instruction, tools=model.tools
+        )
+        metrics = TokenMetrics(estimated_tokens=estimated, tokens_after=estimated)
+        tokens = estimated
+        close_to_limit = (1 - self.exact_margin) * self.max_request_tokens
+        if self.exact and estimated >= close_to_limit:
+            tokens = metrics.exact_tokens = await count_tokens(model.model, fitted)
+
+        # The estimate of a truncated response can be off for non-ASCII text,
+        # so the responses are truncated again if needed.
+        for _ in range(_MAX_FIT_ROUNDS):
+            if tokens <= self.max_request_tokens:
+                break
+            sizes = [
+                estimate_function_response_tokens(part.function_response)
+                for content in fitted
+                for part in content.parts
+                if "function_response" in part
+            ]
+            share = _fair_share(sizes, tokens - self.max_request_tokens)
+            if share is None:
+                break
+            truncated += _truncate_function_responses(fitted, share)
+            tokens = estimate_request_tokens(
+                fitted, system_instruction=model.system_instruction, tools=model.tools
+            )
+        if tokens > self.max_request_tokens:
+            raise RequestTooLargeError(
+                f"The request has {tokens} tokens, over the limit of "
+                f"{self.max_request_tokens} even with truncated function responses."
+            )
+
+        metrics.tokens_after = tokens
+        metrics.truncated_responses = truncated
+        return fitted, metrics
+
+
+def _fair_share(sizes: list[int], excess: int) -> int | None:
+    """Returns the largest size to truncate responses to, to remove the excess.
+
+    Returns:
+        The size, or None if truncating every response is not enough.
+    """
+
+    def removed(cap: int) -> int:
+        return sum(max(0, size - cap) for size in sizes)
+
+    low, high = _TRUNCATION_OVERHEAD_TOKENS, max(sizes, default=0)
+    if removed(low) < excess:
+        return None
+    while low < high:
+        middle = (low + high + 1) // 2
+        if removed(middle) >= excess:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def truncate_function_response(
+    response: glm.FunctionResponse, max_chars: int
+) -> glm.FunctionResponse | None:
+    """Truncates the serialized result of a function response.
+
+    A response truncated before is truncated further, keeping the size of
+    its original result.
+
+    Args:
+        response: The function response.
+        max_chars: The maximum number of characters of the result.
+
+    Returns:
+        The truncated response, or None if the result is not over the size.
+    """
+    result = glm.FunctionResponse.to_dict(response).get("response", {})
+    text = result.get("truncated_result") or json.dumps(result, ensure_ascii=False)
+    if len(text) <= max_chars:
+        return None
+    return glm.FunctionResponse(
+        name=response.name,
+        response={
+            "truncated_result": text[:max_chars],
+            "original_chars": result.get("original_chars", len(text)),
+        },
+    )
+
+
+def _truncate_function_responses(contents: list[glm.Content], max_tokens: int) -> int:
+    """Truncates the function responses over a size, in place.
+
+    Returns:
+        The number of truncated responses.
+    """
+    max_chars = max(0, max_tokens - _TRUNCATION_OVERHEAD_TOKENS) * _BYTES_PER_TOKEN
+    truncated = 0
+    for i, content in enumerate(contents):
+        parts = []
+        truncated_any = False
+        for part in content.parts:
+            if (
+                "function_response" in part
+                and estimate_function_response_tokens(part.function_response)
+                > max_tokens
+                and (
+                    response := truncate_function_response(
+                        part.function_response, max_chars
+                    )
+                )
+            ):
+                part = glm.Part(function_response=response)
+                truncated_any = True
+                truncated += 1
+            parts.append(part)
+        if truncated_any:
+            contents[i] = glm.Content(parts=parts, role=content.role)
+    return truncated
+
+
+_USAGE: dict[str, TokenUsage] = {}
+
+
+def record_usage(
+    model_name: str,
+    *,
+    estimated_input_tokens: int,
+    input_tokens: int,
+    output_tokens: int,
+) -> None:
+    """Records the tokens used by a call to a model."""
+    usage = _USAGE.setdefault(model_name.removeprefix("models/"), TokenUsage())
+    usage.calls += 1
+    usage.estimated_input_tokens += estimated_input_tokens
+    usage.input_tokens += input_tokens
+    usage.output_tokens += output_tokens
+
+
+def token_usage() -> dict[str, TokenUsage]:
+    """Returns the tokens used by the calls to each model, by model name."""
+    return _USAGE
@@ -0,0 +1,205 @@
+"""Limits, timeouts, executors and metrics of tool calls."""
+
+import asyncio
+import atexit
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+import contextlib
+import contextvars
+import functools
+from goog.decorators import EXECUTOR_ATTRIBUTE
+import inspect
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Any, AsyncIterator, Callable
+import weakref
+
+# Shared by the policies without their own process pool.
+_PROCESS_POOL: ProcessPoolExecutor | None = None
+# The slots of the functions with a concurrency limit, by function name and
+# limit. Semaphores belong to the loop they are first used on.
+_SEMAPHORES: weakref.WeakKeyDictionary[
+    asyncio.AbstractEventLoop, dict[tuple[str, int], asyncio.Semaphore]
+] = weakref.WeakKeyDictionary()
+
+
+class ToolMetrics(BaseModel):
+    """Counters of the calls of one tool."""
+
+    calls: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    cancelled: int = 0
+    total_queue_seconds: float = 0.0
+    max_queue_seconds: float = 0.0
+    total_run_seconds: float = 0.0
+    max_run_seconds: float = 0.0
+
+    @property
+    def average_queue_seconds(self) -> float:
+        return self.total_queue_seconds / self.calls if self.calls else 0.0
+
+    @property
+    def average_run_seconds(self) -> float:
+        return self.total_run_seconds / self.calls if self.calls else 0.0
+
+
+class ToolPolicy(BaseModel, frozen=True):
+    """How the tool calls of the sessions sharing it are executed.
+
+    The limits of each function are kept by the process, so that they are
+    shared by all the sessions of any policy giving the function the same
+    limit, even a policy built for each call of an agent. `max_in_flight`
+    applies to each session on its own. A call first waits for room in its session, then for
+    room for its function. The time spent waiting is reported as queueing
+    time, apart from the running time.
+
+    Async tools run on the event loop and sync tools on a thread pool, unless
+    marked otherwise with `goog.decorators.run_in`.
+    """
+
+    # The maximum number of concurrent calls of each function, by name.
+    max_concurrency: dict[str, int] = Field(default_factory=dict)
+    # The maximum number of concurrent calls of a session. None for no limit.
+    max_in_flight: int | None = None
+    # How long a call may run before it is answered with a timeout error.
+    timeout_seconds: float | None = None
+    # The timeouts of some functions, by name, overriding `timeout_seconds`.
+    timeouts: dict[str, float] = Field(default_factory=dict)
+    # Whether to cancel the other calls of a turn once one fails.
+    cancel_siblings_on_error: bool = False
+    # The sizes of the pools of the policy. None to share the default pools.
+    thread_workers: int | None = None
+    process_workers: int | None = None
+    metrics: dict[str, ToolMetrics] = Field(
+        default_factory=dict, repr=False, exclude=True
+    )
+    _pools: dict[str, Executor] = PrivateAttr(default_factory=dict)
+
+    def timeout_for(self, function_name: str) -> float | None:
+        """Returns the timeout of a function, or None if it has none."""
+        return self.timeouts.get(function_name, self.timeout_seconds)
+
+    def metrics_for(self, function_name: str) -> ToolMetrics:
+        """Returns the metrics of a function, creating them on first use."""
+        return self.metrics.setdefault(function_name, ToolMetrics())
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, function_name: str, session_slots: asyncio.Semaphore | None = None
+    ) -> AsyncIterator[None]:
+        """Waits for room to call a function, holding it within the context.
+
+        Args:
+            function_name: The name of the function to call.
+            session_slots: The semaphore of the session, if it has a limit.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            if session_slots is not None:
+                await stack.enter_async_context(session_slots)
+            if function_name in self.max_concurrency:
+                limit = self.max_concurrency[function_name]
+                semaphores = _SEMAPHORES.setdefault(asyncio.get_running_loop(), {})
+                semaphore = semaphores.get((function_name, limit))
+                if semaphore is None:
+                    semaphore = asyncio.Semaphore(limit)
+                    semaphores[function_name, limit] = semaphore
+                await stack.enter_async_context(semaphore)
+            yield
+
+    async def run(self, function: Callable[..., Any], args: dict[str, Any]) -> Any:
+        """Runs a tool on its executor.
+
+        Args:
+            function: The tool, sync or async.
+            args: The keyword arguments to call the tool with.
+
+        Returns:
+            The result of the tool.
+        """
+        is_async = inspect.iscoroutinefunction(function)
+        executor = getattr(
+            function, EXECUTOR_ATTRIBUTE, "inline" if is_async else "thread"
+        )
+        if executor == "inline":
+            return await function(**args) if is_async else function(**args)
+
+        loop = asyncio.get_running_loop()
+        if is_async:
+            # The tool gets an event loop of its own on the worker.
+            call = functools.partial(_run_coroutine_function, function, args)
+        else:
+            call = functools.partial(function, **args)
+        if executor == "thread":
+            # Keep the trace and the cassette of the caller.
+            return await loop.run_in_executor(
+                self._thread_pool(), contextvars.copy_context().run, call
+            )
+        return await loop.run_in_executor(self._process_pool(), call)
+
+    def new_session_slots(self) -> asyncio.Semaphore | None:
+        """Returns the semaphore bounding the calls of a session, if it has a limit."""
+        if self.max_in_flight is None:
+            return None
+        return asyncio.Semaphore(self.max_in_flight)
+
+    def record(
+        self,
+        function_name: str,
+        *,
+        queue_seconds: float,
+        run_seconds: float,
+        error: bool = False,
+        timed_out: bool = False,
+        cancelled: bool = False,
+    ) -> None:
+        """Records a call of a function."""
+        metrics = self.metrics_for(function_name)
+        metrics.calls += 1
+        metrics.errors += error
+        metrics.timeouts += timed_out
+        metrics.cancelled += cancelled
+        metrics.total_queue_seconds += queue_seconds
+        metrics.max_queue_seconds = max(metrics.max_queue_seconds, queue_seconds)
+        metrics.total_run_seconds += run_seconds
+        metrics.max_run_seconds = max(metrics.max_run_seconds, run_seconds)
+
+    def _thread_pool(self) -> Executor | None:
+        if self.thread_workers is None:
+            # The default executor of the event loop.
+            return None
+        if "thread" not in self._pools:
+            self._pools["thread"] = ThreadPoolExecutor(
+                max_workers=self.thread_workers, thread_name_prefix="tool"
+            )
+        return self._pools["thread"]
+
+    def _process_pool(self) -> Executor:
+        if self.process_workers is None:
+            return shared_process_pool()
+        if "process" not in self._pools:
+            self._pools["process"] = _shut_down_at_exit(
+                ProcessPoolExecutor(max_workers=self.process_workers)
+            )
+        return self._pools["process"]
+
+
+def shared_process_pool() -> ProcessPoolExecutor:
+    """Returns the process pool shared by the CPU-bound work of the process.
+
+    It runs the tools marked with `goog.decorators.run_in("process")` of the
+    policies without a pool of their own, and any other work that would
+    block the event loop, so that the process keeps a single set of workers.
+    """
+    global _PROCESS_POOL
+    if _PROCESS_POOL is None:
+        _PROCESS_POOL = _shut_down_at_exit(ProcessPoolExecutor())
+    return _PROCESS_POOL
+
+
+def _shut_down_at_exit(pool: ProcessPoolExecutor) -> ProcessPoolExecutor:
+    # Cancel the queued work, rather than running it to completion at exit.
+    atexit.register(pool.shutdown, cancel_futures=True)
+    return pool
+
+
+def _run_coroutine_function(function: Callable[..., Any], args: dict[str, Any]) -> Any:
+    return asyncio.run(function(**args))
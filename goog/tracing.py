@@ -0,0 +1,235 @@
+"""Hierarchical tracing of agents, model calls and tool calls.
+
+Spans follow the nesting of agents through context variables, so a tool
+called by an agent called by another agent ends up under the right parent,
+even when calls run concurrently.
+
+    with tracing.trace() as tracer:
+        await boss(work)
+    tracer.export_chrome_trace("boss.trace.json")
+"""
+
+import contextlib
+import contextvars
+import itertools
+import json
+from pydantic import BaseModel, Field
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class Span(BaseModel):
+    """A timed operation."""
+
+    span_id: int
+    parent_id: int | None
+    name: str
+    kind: str
+    start_us: int
+    duration_us: int = 0
+    status: str = "ok"
+    attributes: dict[str, Any] = Field(default_factory=dict)
+
+    def set(self, **attributes: Any) -> None:
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+
+class Tracer:
+    """Collects the spans of one trace."""
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+        self._ids = itertools.count(1)
+
+    def export_jsonl(self, path: str) -> None:
+        """Writes the spans as JSON lines."""
+        with open(path, "w", encoding="utf-8") as f:
+            for span in self.spans:
+                f.write(span.model_dump_json() + "\n")
+
+    def export_chrome_trace(self, path: str) -> None:
+        """Writes the spans in the Chrome trace format, which Perfetto also opens."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """Returns the spans in the Chrome trace format.
+
+        Concurrent spans are put on separate lanes, so that each lane only
+        nests a span inside its ancestors.
+        """
+        spans = sorted(self.spans, key=lambda span: (span.start_us, span.span_id))
+        parents = {span.span_id: span.parent_id for span in spans}
+        lanes: list[list[Span]] = []
+        lane_of: dict[int, int] = {}
+        for span in spans:
+            candidates = [lane_of[span.parent_id]] if span.parent_id in lane_of else []
+            candidates += [i for i in range(len(lanes)) if i not in candidates]
+            for i in candidates:
+                open_spans = lanes[i]
+                while open_spans and _end_us(open_spans[-1]) <= span.start_us:
+                    open_spans.pop()
+                if not open_spans or _is_ancestor(
+                    open_spans[-1].span_id, span, parents
+                ):
+                    break
+            else:
+                lanes.append([])
+                i = len(lanes) - 1
+            lanes[i].append(span)
+            lane_of[span.span_id] = i
+
+        return {
+            "traceEvents": [
+                {
+                    "name": span.name,
+                    "cat": span.kind,
+                    "ph": "X",
+                    "ts": span.start_us,
+                    "dur": span.duration_us,
+                    "pid": 1,
+                    "tid": lane_of[span.span_id],
+                    "args": {"status": span.status, **span.attributes},
+                }
+                for span in spans
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+    def _new_span(self, name: str, kind: str, attributes: dict[str, Any]) -> Span:
+        parent = _current_span.get()
+        span = Span(
+            span_id=next(self._ids),
+            parent_id=parent.span_id if parent else None,
+            name=name,
+            kind=kind,
+            start_us=time.time_ns() // 1000,
+            attributes=attributes,
+        )
+        self.spans.append(span)
+        return span
+
+
+_current_tracer: contextvars.ContextVar[Tracer | None] = contextvars.ContextVar(
+    "current_tracer", default=None
+)
+_current_span: contextvars.ContextVar[Span | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+@contextlib.contextmanager
+def trace() -> Iterator[Tracer]:
+    """Traces everything run within the context.
+
+    Yields:
+        The tracer collecting the spans.
+    """
+    tracer = Tracer()
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str, **attributes: Any) -> Iterator[Span | None]:
+    """Times the operation run within the context as a child of the current span.
+
+    It does nothing outside of `trace`.
+
+    Args:
+        name: The name of the operation.
+        kind: The kind of operation, e.g. "agent", "model" or "tool".
+        **attributes: The attributes of the span.
+
+    Yields:
+        The span, or None if nothing is being traced.
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield None
+        return
+
+    span = tracer._new_span(name, kind, attributes)
+    token = _current_span.set(span)
+    start = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "error"
+        span.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        span.duration_us = int((time.perf_counter() - start) * 1e6)
+        _current_span.reset(token)
+
+
+async def span_stream(
+    name: str,
+    kind: str,
+    open_items: Callable[[Span | None], AsyncGenerator[T, None]],
+    **attributes: Any,
+) -> AsyncIterator[T]:
+    """Times a stream as a child of the current span.
+
+    Unlike `span`, the span is the current one only while the stream
+    produces its next item, never across a yield to the consumer, who may
+    resume or close the stream from another context.
+
+    Args:
+        name: The name of the operation.
+        kind: The kind of operation, e.g. "agent", "model" or "tool".
+        open_items: Opens the stream, given its span, or None if nothing is being traced.
+        **attributes: The attributes of the span.
+
+    Yields:
+        The items of the stream.
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        async with contextlib.aclosing(open_items(None)) as items:
+            async for item in items:
+                yield item
+        return
+
+    span = tracer._new_span(name, kind, attributes)
+    start = time.perf_counter()
+    items = open_items(span)
+    try:
+        while True:
+            token = _current_span.set(span)
+            try:
+                item = await anext(items)
+            except StopAsyncIteration:
+                break
+            finally:
+                _current_span.reset(token)
+            yield item
+    except GeneratorExit:
+        # The consumer stopped early.
+        raise
+    except BaseException as e:
+        span.status = "error"
+        span.set(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        span.duration_us = int((time.perf_counter() - start) * 1e6)
+        await items.aclose()
+
+
+def _end_us(span: Span) -> int:
+    return span.start_us + span.duration_us
+
+
+def _is_ancestor(span_id: int, span: Span, parents: dict[int, int | None]) -> bool:
+    parent_id = span.parent_id
+    while parent_id is not None:
+        if parent_id == span_id:
+            return True
+        parent_id = parents.get(parent_id)
+    return False
@@ -1,12 +1,19 @@
-from agents.math_professor import math_professor
-from agents.webber import web_scraper, web_searcher
 import asyncio
 from datetime import datetime
 from devtools import debug
-from goog.agent import agent
+from goog.agent import AgentSpec
+from goog.decorators import never_dedupe
+from goog.lazy_tools import lazy_tool
 from pydantic import BaseModel, Field
 
 
+_ALICE = AgentSpec(
+    str,
+    name="alice",
+    instruction="You are an expert with flattering languages. Please flatter me.",
+)
+
+
 async def alice(request: str) -> str:
     """Alice is an expert in flattery languages.
 
@@ -17,13 +24,10 @@ async def alice(request: str) -> str:
         The response from Alice.
     """
     print(f"Flattering the message: {request}.")
-    return await agent(
-        str,
-        instruction="You are an expert with flattering languages. Please flatter me.",
-        data=request,
-    )
+    return await _ALICE(request)
 
 
+@never_dedupe
 async def send_mail(recipient: str, sender: str, subject: str, body: str) -> bool:
     """Sends an email.
 
@@ -42,6 +46,14 @@ async def send_mail(recipient: str, sender: str, subject: str, body: str) -> boo
     return True
 
 
+_CAROL = AgentSpec(
+    str,
+    name="carol",
+    instruction="You are an expert with email. Please send an email on behalf of John to Bob.",
+    tools=[send_mail],
+)
+
+
 async def carol(request: str) -> str:
     """Carol is an emailer.
 
@@ -53,12 +65,7 @@ async def carol(request: str) -> str:
     Returns:
         The response from Carol.
     """
-    return await agent(
-        str,
-        instruction="You are an expert with email. Please send an email on behalf of John to Bob.",
-        data=request,
-        tools=[send_mail],
-    )
+    return await _CAROL(request)
 
 
 async def current_datetime() -> str:
@@ -71,19 +78,10 @@ async def current_datetime() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
-async def dave(request: str) -> str:
-    """Dave knows the current date and time. He also knows all dates for holidays and events.
-
-    Args:
-        request: The request to Dave.
-
-    Returns:
-        The response from Dave.
-    """
-    print(f"Getting the date for the request: {request}.")
-    return await agent(
-        str,
-        instruction="""You have the clock to tell the current date and time.
+_DAVE = AgentSpec(
+    str,
+    name="dave",
+    instruction="""You have the clock to tell the current date and time.
 
 Easter Dates:
 Easter dates vary each year as it is based on the lunar calendar. Here are the dates for Easter Sunday:
@@ -105,9 +103,21 @@ Christmas is always on December 25th every year.
 2024: December 25
 2025: December 25
 """,
-        data=request,
-        tools=[current_datetime],
-    )
+    tools=[current_datetime],
+)
+
+
+async def dave(request: str) -> str:
+    """Dave knows the current date and time. He also knows all dates for holidays and events.
+
+    Args:
+        request: The request to Dave.
+
+    Returns:
+        The response from Dave.
+    """
+    print(f"Getting the date for the request: {request}.")
+    return await _DAVE(request)
 
 
 class Date(BaseModel):
@@ -138,20 +148,26 @@ class Payment(BaseModel):
     )
 
 
+_BOSS = AgentSpec(
+    Payment,
+    name="boss",
+    instruction="You are the boss. Please assign tasks to your workers.",
+    tools=[
+        alice,
+        carol,
+        dave,
+        lazy_tool("agents.math_professor:math_professor"),
+        lazy_tool("agents.webber:web_scraper"),
+        lazy_tool("agents.webber:web_searcher"),
+    ],
+    json_final_turn=True,
+    # Pro only takes over when flash cannot state the payment properly.
+    cascade_model_names=["gemini-1.5-flash-latest"],
+)
+
+
 async def boss(work: str) -> Payment:
-    return await agent(
-        Payment,
-        instruction="You are the boss. Please assign tasks to your workers.",
-        data=work,
-        tools=[
-            alice,
-            carol,
-            dave,
-            math_professor,
-            web_scraper,
-            web_searcher,
-        ],
-    )
+    return await _BOSS(work)
 
 
 async def main() -> None:
@@ -1,7 +1,8 @@
-from agents.next_search_recommender import next_search_recommender
+from agents.next_search_recommender import next_search_recommender_stream
 import asyncio
 from devtools import debug
 from goog import agent
+from goog.events import FinalResult, TextDelta, ToolCallEnd, ToolCallStart
 import logging
 
 
@@ -20,13 +21,22 @@ async def main() -> None:
 
     USER_STYLE = "\u001b[32m\u001b[1m"
     MODEL_STYLE = "\u001b[31m\u001b[1m"
+    TOOL_STYLE = "\u001b[2m"
     RESET_STYLE = "\u001b[0m"
 
     while True:
         user_query = input(f"\n{USER_STYLE}You{RESET_STYLE}: ")
-        suggestions = await next_search_recommender(user_query)
         print(f"\n{MODEL_STYLE}Model{RESET_STYLE}:")
-        debug(suggestions)
+        async for event in next_search_recommender_stream(user_query):
+            if isinstance(event, TextDelta):
+                print(event.text, end="", flush=True)
+            elif isinstance(event, ToolCallStart):
+                print(f"\n{TOOL_STYLE}> Calling {event.name}...{RESET_STYLE}")
+            elif isinstance(event, ToolCallEnd):
+                print(f"{TOOL_STYLE}< {event.name} returned.{RESET_STYLE}")
+            elif isinstance(event, FinalResult):
+                print()
+                debug(event.output)
 
 
 if __name__ == "__main__":
@@ -1,11 +1,14 @@
 import asyncio
+from goog.decorators import never_dedupe
 from goog.function_calling import ChatSession, FunctionCalling
+from goog.model_spec import ModelSpec
 import google.generativeai as genai
 import json
 from pydantic import BaseModel, Field
 from typing import Any
 
 
+@never_dedupe
 async def send_message(recipient: str, text: str) -> Any:
     """Sends a message to the recipient.
 
@@ -29,7 +32,7 @@ async def send_message(recipient: str, text: str) -> Any:
 
 async def function_calling() -> None:
     tools = FunctionCalling(functions=[send_message])
-    model = genai.GenerativeModel(
+    model = ModelSpec(
         model_name="gemini-1.5-pro-latest",
         generation_config=genai.GenerationConfig(
             temperature=0.6,
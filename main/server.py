@@ -0,0 +1,589 @@
+"""Serves next_search_recommender to many users over HTTP and WebSocket.
+
+Run with `python -m main.server`. All sessions share one event loop.
+
+    POST   /sessions                   Creates a session.
+    GET    /sessions/{id}              Returns the history of a session.
+    DELETE /sessions/{id}              Ends a session.
+    POST   /sessions/{id}/messages     Sends {"message": ..., "stream": false}.
+                                       With "stream": true, the events are
+                                       streamed as JSON lines.
+    GET    /sessions/{id}/ws           Upgrades to a WebSocket. Each text
+                                       message is a request, answered by its
+                                       events.
+    GET    /stats                      Returns the counters of the server.
+
+A session handles one request at a time. When too many requests are in
+flight, new ones are turned away with 503 instead of queuing up.
+"""
+
+from agents.next_search_recommender import next_search_recommender_stream
+import asyncio
+import base64
+import contextlib
+from functions import page_cache
+from goog.events import Event, FinalResult
+import hashlib
+import json
+import logging
+from pydantic import BaseModel
+import time
+from typing import Any, AsyncGenerator, AsyncIterator, Callable
+import uuid
+
+_HOST = "127.0.0.1"
+_PORT = 8080
+_MAX_HEADER_BYTES = 16 * 1024
+_MAX_BODY_BYTES = 64 * 1024
+_WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+_REASONS = {
+    101: "Switching Protocols",
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    501: "Not Implemented",
+    503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+Handler = Callable[[str], AsyncIterator[Event]]
+
+
+class ServerStats(BaseModel):
+    """Counters of a server."""
+
+    sessions: int = 0
+    in_flight: int = 0
+    completed: int = 0
+    failed: int = 0
+    rejected: int = 0
+    timed_out: int = 0
+
+
+class _HttpError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class _WebSocketError(Exception):
+    """A violation of the WebSocket protocol, closing the connection with its code."""
+
+    def __init__(self, code: int, message: str) -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class _Request(BaseModel):
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+
+
+class _Session:
+    def __init__(self, session_id: str) -> None:
+        self.session_id = session_id
+        self.history: list[dict[str, Any]] = []
+        self.busy = False
+        self.last_active = time.monotonic()
+
+
+class Server:
+    """An HTTP and WebSocket front-end to a streaming agent."""
+
+    def __init__(
+        self,
+        handler: Handler = next_search_recommender_stream,
+        *,
+        max_in_flight: int = 32,
+        request_timeout_seconds: float = 300,
+        session_idle_seconds: float = 30 * 60,
+    ) -> None:
+        """Initializes the server.
+
+        Args:
+            handler: Streams the events of a request, ending with a `FinalResult`.
+            max_in_flight: The maximum number of requests running at once, across all sessions.
+            request_timeout_seconds: How long a request may run.
+            session_idle_seconds: How long an idle session is kept.
+        """
+        self.handler = handler
+        self.max_in_flight = max_in_flight
+        self.request_timeout_seconds = request_timeout_seconds
+        self.session_idle_seconds = session_idle_seconds
+        self.stats = ServerStats()
+        self._sessions: dict[str, _Session] = {}
+        self._reaper: asyncio.Task | None = None
+
+    async def serve(self, host: str = _HOST, port: int = _PORT) -> None:
+        """Serves until cancelled."""
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.close()
+
+    async def start(self, host: str = _HOST, port: int = 0) -> asyncio.Server:
+        """Starts serving in the background.
+
+        Returns:
+            The listening server, whose sockets tell the port.
+        """
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_idle_sessions())
+        logging.info("Serving on %s.", server.sockets[0].getsockname())
+        return server
+
+    async def close(self) -> None:
+        """Stops reaping idle sessions, once the server started by `start` is closed."""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._reaper
+            self._reaper = None
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except _HttpError as e:
+                    await _write_json(writer, e.status, {"error": str(e)}, close=True)
+                    return
+                if request is None:
+                    return
+                keep_alive = request.headers.get("connection", "").lower() != "close"
+                try:
+                    if request.headers.get("upgrade", "").lower() == "websocket":
+                        await self._handle_websocket(request, reader, writer)
+                        return
+                    await self._route(request, writer, keep_alive)
+                except _HttpError as e:
+                    await _write_json(
+                        writer, e.status, {"error": str(e)}, close=not keep_alive
+                    )
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _route(
+        self, request: _Request, writer: asyncio.StreamWriter, keep_alive: bool
+    ) -> None:
+        parts = request.path.split("?", 1)[0].strip("/").split("/")
+        close = not keep_alive
+        match request.method, parts:
+            case "GET", ["stats"]:
+                await _write_json(writer, 200, self.stats.model_dump(), close=close)
+            case "POST", ["sessions"]:
+                session = _Session(uuid.uuid4().hex)
+                self._sessions[session.session_id] = session
+                self.stats.sessions = len(self._sessions)
+                await _write_json(
+                    writer, 201, {"session_id": session.session_id}, close=close
+                )
+            case "GET", ["sessions", session_id]:
+                session = self._session(session_id)
+                await _write_json(
+                    writer, 200, {"history": session.history}, close=close
+                )
+            case "DELETE", ["sessions", session_id]:
+                self._session(session_id)
+                del self._sessions[session_id]
+                self.stats.sessions = len(self._sessions)
+                await _write_head(writer, 204, {}, close=close)
+            case "POST", ["sessions", session_id, "messages"]:
+                session = self._session(session_id)
+                try:
+                    body = json.loads(request.body)
+                    message = body["message"]
+                except (ValueError, KeyError, TypeError):
+                    raise _HttpError(400, 'Expected {"message": ...}.')
+                if body.get("stream"):
+                    await self._stream_reply(session, message, writer, close)
+                else:
+                    await self._reply(session, message, writer, close)
+            case _:
+                raise _HttpError(404, f"No route for {request.method} {request.path}.")
+
+    async def _reply(
+        self, session: _Session, message: str, writer: asyncio.StreamWriter, close: bool
+    ) -> None:
+        output = None
+        async with contextlib.aclosing(self._run(session, message)) as events:
+            async for event in events:
+                if isinstance(event, FinalResult):
+                    output = event.model_dump(mode="json")["output"]
+        await _write_json(writer, 200, {"output": output}, close=close)
+
+    async def _stream_reply(
+        self, session: _Session, message: str, writer: asyncio.StreamWriter, close: bool
+    ) -> None:
+        async with contextlib.aclosing(self._run(session, message)) as events:
+            # Admission errors surface before the head is written.
+            try:
+                first = await anext(events)
+            except StopAsyncIteration:
+                first = None
+            await _write_head(
+                writer,
+                200,
+                {
+                    "Content-Type": "application/x-ndjson",
+                    "Transfer-Encoding": "chunked",
+                },
+                close=close,
+            )
+            try:
+                if first is not None:
+                    await _write_chunk(writer, _event_line(first))
+                async for event in events:
+                    await _write_chunk(writer, _event_line(event))
+            except _HttpError as e:
+                await _write_chunk(writer, _error_line(e))
+        await _write_chunk(writer, b"")
+
+    async def _handle_websocket(
+        self,
+        request: _Request,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        parts = request.path.split("?", 1)[0].strip("/").split("/")
+        key = request.headers.get("sec-websocket-key")
+        if len(parts) != 3 or parts[0] != "sessions" or parts[2] != "ws" or not key:
+            raise _HttpError(404, f"No WebSocket at {request.path}.")
+        session = self._session(parts[1])
+        accept = base64.b64encode(
+            hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest()
+        ).decode()
+        await _write_head(
+            writer,
+            101,
+            {
+                "Upgrade": "websocket",
+                "Connection": "Upgrade",
+                "Sec-WebSocket-Accept": accept,
+            },
+        )
+        # Requests run in tasks, so that control frames are still answered
+        # while they stream their events.
+        requests: set[asyncio.Task] = set()
+        try:
+            while True:
+                opcode, payload = await _read_message(reader, writer)
+                if opcode == 0x8:
+                    await _write_frame(writer, 0x8, payload[:2])
+                    return
+                if opcode != 0x1:
+                    continue
+                task = asyncio.create_task(
+                    self._websocket_request(session, payload.decode(), writer)
+                )
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+        except _WebSocketError as e:
+            await _write_frame(
+                writer, 0x8, e.code.to_bytes(2, "big") + str(e).encode()[:123]
+            )
+        finally:
+            for task in requests:
+                task.cancel()
+            await asyncio.gather(*requests, return_exceptions=True)
+
+    async def _websocket_request(
+        self, session: _Session, message: str, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            async with contextlib.aclosing(self._run(session, message)) as events:
+                async for event in events:
+                    await _write_frame(writer, 0x1, _event_line(event).rstrip())
+        except _HttpError as e:
+            await _write_frame(writer, 0x1, _error_line(e).rstrip())
+        except ConnectionError:
+            pass
+
+    async def _run(
+        self, session: _Session, message: str
+    ) -> AsyncGenerator[Event, None]:
+        """Runs a request of a session, with admission control and a timeout."""
+        if self.stats.in_flight >= self.max_in_flight:
+            self.stats.rejected += 1
+            raise _HttpError(503, "Too many requests in flight. Try again later.")
+        if session.busy:
+            raise _HttpError(409, "The session is busy with another request.")
+
+        session.busy = True
+        self.stats.in_flight += 1
+        # The timeout is entered for each step of the handler rather than
+        # across the yields, which would leave it on the consumer's task.
+        deadline = asyncio.get_running_loop().time() + self.request_timeout_seconds
+        try:
+            async with _closing(self.handler(message)) as events:
+                while True:
+                    try:
+                        async with asyncio.timeout_at(deadline):
+                            event = await anext(events)
+                    except StopAsyncIteration:
+                        break
+                    if isinstance(event, FinalResult):
+                        session.history.append(
+                            {
+                                "message": message,
+                                "output": event.model_dump(mode="json")["output"],
+                            }
+                        )
+                    yield event
+            self.stats.completed += 1
+        except TimeoutError:
+            self.stats.timed_out += 1
+            raise _HttpError(504, "The request timed out.")
+        except Exception as e:
+            logging.exception(e)
+            self.stats.failed += 1
+            raise _HttpError(500, str(e))
+        finally:
+            self.stats.in_flight -= 1
+            session.busy = False
+            session.last_active = time.monotonic()
+
+    def _session(self, session_id: str) -> _Session:
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise _HttpError(404, f"No session {session_id}.")
+        session.last_active = time.monotonic()
+        return session
+
+    async def _reap_idle_sessions(self) -> None:
+        while True:
+            await asyncio.sleep(min(60, self.session_idle_seconds))
+            deadline = time.monotonic() - self.session_idle_seconds
+            for session_id, session in list(self._sessions.items()):
+                if not session.busy and session.last_active < deadline:
+                    del self._sessions[session_id]
+            self.stats.sessions = len(self._sessions)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> _Request | None:
+    """Reads a request, or returns None if the client closed the connection."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise
+    except asyncio.LimitOverrunError:
+        raise _HttpError(413, "The request head is too large.")
+    if len(head) > _MAX_HEADER_BYTES:
+        raise _HttpError(413, "The request head is too large.")
+
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, path, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise _HttpError(400, "Malformed request line.")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    transfer_encoding = headers.get("transfer-encoding", "").lower()
+    if transfer_encoding == "chunked":
+        body = await _read_chunked_body(reader)
+    elif transfer_encoding:
+        # The body cannot be delimited, so the connection is closed after the reply.
+        raise _HttpError(501, f"Unsupported Transfer-Encoding: {transfer_encoding}.")
+    else:
+        try:
+            length = int(headers.get("content-length", "0") or 0)
+        except ValueError:
+            raise _HttpError(400, "Malformed Content-Length.")
+        if length < 0:
+            raise _HttpError(400, "Malformed Content-Length.")
+        if length > _MAX_BODY_BYTES:
+            raise _HttpError(413, "The request body is too large.")
+        body = await reader.readexactly(length) if length else b""
+    return _Request(method=method, path=path, headers=headers, body=body)
+
+
+async def _read_chunked_body(reader: asyncio.StreamReader) -> bytes:
+    """Reads a body in the chunked transfer coding, skipping its trailers."""
+    body = b""
+    while True:
+        size_line = await reader.readuntil(b"\r\n")
+        try:
+            size = int(size_line.split(b";", 1)[0].strip(), 16)
+        except ValueError:
+            raise _HttpError(400, "Malformed chunk size.")
+        if size < 0:
+            raise _HttpError(400, "Malformed chunk size.")
+        if len(body) + size > _MAX_BODY_BYTES:
+            raise _HttpError(413, "The request body is too large.")
+        if size == 0:
+            while (await reader.readuntil(b"\r\n")) != b"\r\n":
+                pass
+            return body
+        body += await reader.readexactly(size)
+        if await reader.readexactly(2) != b"\r\n":
+            raise _HttpError(400, "Malformed chunk.")
+
+
+async def _write_head(
+    writer: asyncio.StreamWriter,
+    status: int,
+    headers: dict[str, str],
+    *,
+    close: bool = False,
+) -> None:
+    lines = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}"]
+    if status not in (101, 204) and "Transfer-Encoding" not in headers:
+        headers.setdefault("Content-Length", "0")
+    if close:
+        headers["Connection"] = "close"
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def _write_json(
+    writer: asyncio.StreamWriter, status: int, value: Any, *, close: bool = False
+) -> None:
+    body = json.dumps(value).encode()
+    headers = {"Content-Type": "application/json", "Content-Length": str(len(body))}
+    if status == 503:
+        headers["Retry-After"] = "1"
+    await _write_head(writer, status, headers, close=close)
+    writer.write(body)
+    await writer.drain()
+
+
+async def _write_chunk(writer: asyncio.StreamWriter, data: bytes) -> None:
+    writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+    await writer.drain()
+
+
+async def _read_message(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> tuple[int, bytes]:
+    """Reads a WebSocket message, answering the pings in between.
+
+    Control frames may come between the fragments of a message, so they
+    are handled as they arrive.
+
+    Returns:
+        The opcode and the payload of a data message, or of a close frame.
+    """
+    opcode = None
+    payload = b""
+    while True:
+        fin, frame_opcode, data = await _read_frame(reader)
+        if frame_opcode == 0x8:
+            return frame_opcode, data
+        if frame_opcode == 0x9:
+            await _write_frame(writer, 0xA, data)
+            continue
+        if frame_opcode & 0x8:
+            continue
+        if opcode is None:
+            if frame_opcode == 0x0:
+                raise _WebSocketError(1002, "A continuation frame without a message.")
+            opcode = frame_opcode
+        elif frame_opcode != 0x0:
+            raise _WebSocketError(1002, "A new message before the end of the last one.")
+        payload += data
+        if len(payload) > _MAX_BODY_BYTES:
+            raise _WebSocketError(1009, "The WebSocket message is too large.")
+        if fin:
+            return opcode, payload
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[bool, int, bytes]:
+    """Reads a WebSocket frame from the client.
+
+    Returns:
+        Whether the frame ends its message, its opcode and its unmasked payload.
+
+    Raises:
+        _WebSocketError: The frame is not masked, or is too large.
+    """
+    first, second = await reader.readexactly(2)
+    if not second & 0x80:
+        raise _WebSocketError(1002, "The frames of a client must be masked.")
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), "big")
+    if length > _MAX_BODY_BYTES:
+        raise _WebSocketError(1009, "The WebSocket message is too large.")
+    mask = await reader.readexactly(4)
+    data = bytes(
+        byte ^ mask[i % 4] for i, byte in enumerate(await reader.readexactly(length))
+    )
+    return bool(first & 0x80), first & 0x0F, data
+
+
+async def _write_frame(writer: asyncio.StreamWriter, opcode: int, data: bytes) -> None:
+    # A frame is written at once, so the frames of concurrent requests and
+    # pongs do not interleave.
+    if len(data) < 126:
+        head = bytes([0x80 | opcode, len(data)])
+    elif len(data) < 2**16:
+        head = bytes([0x80 | opcode, 126]) + len(data).to_bytes(2, "big")
+    else:
+        head = bytes([0x80 | opcode, 127]) + len(data).to_bytes(8, "big")
+    writer.write(head + data)
+    await writer.drain()
+
+
+@contextlib.asynccontextmanager
+async def _closing(events: AsyncIterator[Event]) -> AsyncIterator[AsyncIterator[Event]]:
+    """Closes the events on exit if they are an async generator."""
+    try:
+        yield events
+    finally:
+        if isinstance(events, AsyncGenerator):
+            await events.aclose()
+
+
+def _event_line(event: Event) -> bytes:
+    return (
+        json.dumps({"type": type(event).__name__, **event.model_dump(mode="json")})
+        + "\n"
+    ).encode()
+
+
+def _error_line(error: _HttpError) -> bytes:
+    return (
+        json.dumps({"type": "Error", "status": error.status, "message": str(error)})
+        + "\n"
+    ).encode()
+
+
+async def main() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    page_cache.configure(".cache/pages")
+    await Server().serve()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
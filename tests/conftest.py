@@ -0,0 +1,17 @@
+from bench.fake_gemini import FakeGemini, Responder
+from goog import function_calling
+import pytest
+from typing import Callable, Iterator
+
+
+@pytest.fixture
+def fake_gemini() -> Iterator[Callable[[dict[str, Responder]], FakeGemini]]:
+    """Installs a fake model backend for the test."""
+
+    def install(responders: dict[str, Responder]) -> FakeGemini:
+        backend = FakeGemini(responders, latency_seconds=0)
+        function_calling.configure(backend=backend)
+        return backend
+
+    yield install
+    function_calling.configure(backend=None)
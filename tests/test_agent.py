@@ -0,0 +1,332 @@
+import asyncio
+from bench.fake_gemini import (
+    FakeGemini,
+    Responder,
+    function_call,
+    json_block,
+    request_of,
+    text,
+    tool_rounds,
+)
+from goog import agent, function_calling, tracing
+from goog.agent import AgentSpec, BatchStats, map_agent
+from goog.model_spec import ModelSpec
+from goog.tool_policy import ToolPolicy
+from google.ai import generativelanguage as glm
+import google.generativeai as genai
+from pydantic import BaseModel
+import pytest
+
+
+async def lookup(query: str) -> str:
+    """Looks something up.
+
+    Args:
+        query: What to look up.
+    """
+    await asyncio.sleep(0.01)
+    return query
+
+
+def test_spans_are_named_after_the_agent(fake_gemini):
+    fake_gemini({"Greet": lambda contents: [text("Hello!")]})
+    spec = AgentSpec(str, name="greeter", instruction="Greet the user.")
+
+    async def run():
+        with tracing.trace() as tracer:
+            output = await spec("Hi.")
+            events = [event async for event in spec.stream("Hi.")]
+        return output, events, tracer.spans
+
+    output, events, spans = asyncio.run(run())
+
+    assert output == "Hello!"
+    assert events[-1].output == "Hello!"
+    assert [span.name for span in spans if span.kind == "agent"] == [
+        "greeter",
+        "greeter",
+    ]
+
+
+def test_a_spec_is_shared_by_calls_on_different_loops(fake_gemini):
+    def responder(contents):
+        if tool_rounds(contents):
+            return [text("Done.")]
+        return [function_call("lookup", query=request_of(contents))]
+
+    fake_gemini({"Look it up": responder})
+    spec = AgentSpec(
+        str,
+        name="looker",
+        instruction="Look it up.",
+        tools=[lookup],
+        tool_policy=ToolPolicy(max_concurrency={"lookup": 1}),
+    )
+    agent.cascade_stats().pop("looker", None)
+
+    async def run():
+        return await asyncio.gather(spec("a"), spec("b"))
+
+    # The slots of the tool are not bound to the loop of the first run.
+    assert asyncio.run(run()) == ["Done.", "Done."]
+    assert asyncio.run(run()) == ["Done.", "Done."]
+    assert agent.cascade_stats()["looker"].calls == 4
+    assert agent.cascade_stats()["looker"].resolved == {"gemini-1.5-pro-latest": 4}
+
+
+class Answer(BaseModel):
+    value: int
+
+
+def test_json_final_turn_takes_a_dict_generation_config(fake_gemini):
+    fake_gemini({"Answer": lambda contents: [text('{"value": 42}')]})
+
+    spec = AgentSpec(
+        Answer,
+        instruction="Answer with 42.",
+        generation_config={"temperature": 0},
+        json_final_turn=True,
+    )
+
+    assert spec.model.generation_config["temperature"] == 0
+    assert spec.model.generation_config["response_mime_type"] == "application/json"
+    assert asyncio.run(spec("Go.")) == Answer(value=42)
+
+
+_FLASH = "gemini-1.5-flash-latest"
+_PRO = "gemini-1.5-pro-latest"
+
+
+@pytest.fixture
+def cascade(monkeypatch):
+    """Installs a fake backend answering each model with its own responder.
+
+    Returns the requests sent to each model.
+    """
+    monkeypatch.setattr(agent, "_CASCADE_STATS", {})
+    requests: dict[str, list[list[glm.Content]]] = {_FLASH: [], _PRO: []}
+
+    def install(responders: dict[str, Responder]) -> dict[str, list]:
+        fakes = {
+            name: FakeGemini({"": responder}, latency_seconds=0)
+            for name, responder in responders.items()
+        }
+
+        async def backend(model: ModelSpec, contents, stream):
+            name = model.model_name.removeprefix("models/")
+            requests[name].append(list(contents))
+            return await fakes[name](model, contents, stream)
+
+        function_calling.configure(backend=backend)
+        return requests
+
+    yield install
+    function_calling.configure(backend=None)
+
+
+def _answer(value) -> Responder:
+    return lambda contents: [json_block({"value": value})]
+
+
+def _stopped(contents) -> list[glm.Part]:
+    raise genai.types.StopCandidateException(
+        glm.Candidate(finish_reason=glm.Candidate.FinishReason.SAFETY)
+    )
+
+
+def _cascade_spec(**kwargs) -> AgentSpec[Answer]:
+    return AgentSpec(
+        Answer,
+        name="answerer",
+        instruction="Answer.",
+        json_final_turn=True,
+        model_name=_PRO,
+        cascade_model_names=[_FLASH],
+        **kwargs,
+    )
+
+
+def _run_both_ways(spec: AgentSpec[Answer]) -> list[Answer]:
+    """Calls the spec, then streams it."""
+
+    async def run():
+        called = await spec("Go.")
+        events = [event async for event in spec.stream("Go.")]
+        return [called, events[-1].output]
+
+    return asyncio.run(run())
+
+
+def test_an_unparsable_reply_escalates(cascade):
+    requests = cascade({_FLASH: _answer("many"), _PRO: _answer(1)})
+
+    assert _run_both_ways(_cascade_spec()) == [Answer(value=1)] * 2
+    stats = agent.cascade_stats()["answerer"]
+    assert (stats.calls, stats.escalations, stats.resolved) == (2, 2, {_PRO: 2})
+    # The rejected reply is not shown to the next model, nor is feedback.
+    assert [content.role for content in requests[_PRO][0]] == ["user"]
+
+
+def test_a_stopped_candidate_escalates(cascade):
+    cascade({_FLASH: _stopped, _PRO: _answer(1)})
+
+    assert _run_both_ways(_cascade_spec()) == [Answer(value=1)] * 2
+    assert agent.cascade_stats()["answerer"].escalations == 2
+
+
+def test_a_stopped_candidate_of_the_last_model_is_raised(cascade):
+    cascade({_FLASH: _stopped, _PRO: _stopped})
+
+    with pytest.raises(genai.types.StopCandidateException):
+        asyncio.run(_cascade_spec()("Go."))
+
+
+def test_a_rejected_output_escalates(cascade):
+    cascade({_FLASH: _answer(1), _PRO: _answer(2)})
+
+    async def accept(answer: Answer) -> bool:
+        return answer.value > 1
+
+    assert _run_both_ways(_cascade_spec(accept=accept)) == [Answer(value=2)] * 2
+    assert agent.cascade_stats()["answerer"].resolution_rates == {_PRO: 1.0}
+
+
+def test_an_accepted_output_resolves_the_call(cascade):
+    requests = cascade({_FLASH: _answer(1), _PRO: _answer(2)})
+
+    spec = _cascade_spec(accept=lambda answer: answer.value > 0)
+
+    assert _run_both_ways(spec) == [Answer(value=1)] * 2
+    assert requests[_PRO] == []
+    stats = agent.cascade_stats()["answerer"]
+    assert (stats.escalations, stats.resolution_rates) == (0, {_FLASH: 1.0})
+
+
+def test_the_last_model_gets_feedback_on_an_unparsable_reply(cascade):
+    replies = iter([_answer("many"), _answer(3)])
+    requests = cascade({_FLASH: _answer("many"), _PRO: lambda c: next(replies)(c)})
+
+    assert asyncio.run(_cascade_spec()("Go.")) == Answer(value=3)
+    assert len(requests[_PRO]) == 2
+    assert requests[_PRO][1][-1].parts[0].text.startswith("Failed to parse")
+
+
+def _collect(results) -> list:
+    async def run():
+        return [result async for result in results]
+
+    return asyncio.run(run())
+
+
+def test_map_agent_pulls_inputs_only_when_there_is_room():
+    pulled = []
+
+    def inputs():
+        for i in range(100):
+            pulled.append(i)
+            yield i
+
+    async def double(item: int) -> int:
+        await asyncio.sleep(0.01)
+        return item * 2
+
+    async def run():
+        results = map_agent(double, inputs(), concurrency=2)
+        first = await anext(results)
+        await results.aclose()
+        return first
+
+    assert asyncio.run(run()).output in (0, 2)
+    # Only the inputs of the window were pulled.
+    assert pulled == [0, 1]
+
+
+def test_map_agent_keeps_the_order_of_the_inputs():
+    async def sleep(item: float) -> float:
+        await asyncio.sleep(item)
+        return item
+
+    inputs = [0.05, 0.01, 0.03, 0.02]
+
+    unordered = _collect(map_agent(sleep, inputs, concurrency=4))
+    ordered = _collect(map_agent(sleep, inputs, concurrency=4, ordered=True))
+
+    assert [result.output for result in unordered] == sorted(inputs)
+    assert [result.output for result in ordered] == inputs
+
+
+def test_map_agent_does_not_count_held_results_toward_the_concurrency():
+    running = []
+    peak = []
+
+    async def sleep(item: float) -> float:
+        running.append(item)
+        peak.append(len(running))
+        await asyncio.sleep(item)
+        running.remove(item)
+        return item
+
+    # The first request is slow; the others complete and are held behind it.
+    inputs = [0.2] + [0.01] * 6
+    results = _collect(map_agent(sleep, inputs, concurrency=2, ordered=True))
+
+    assert [result.output for result in results] == inputs
+    assert max(peak) == 2
+    # The fast requests ran beside the slow one, one at a time.
+    assert peak.count(2) == len(inputs) - 1
+
+
+def test_map_agent_retries_and_reports_failures():
+    attempts: dict[str, int] = {}
+
+    async def flaky(item: str) -> str:
+        attempts[item] = attempts.get(item, 0) + 1
+        if item == "broken" or attempts[item] < 2:
+            raise ValueError(item)
+        return item
+
+    stats = BatchStats()
+    results = _collect(
+        map_agent(flaky, ["a", "broken", "b"], max_attempts=3, stats=stats)
+    )
+
+    outputs = {result.input: result.output for result in results}
+    errors = {result.input: result.error for result in results}
+    assert outputs == {"a": "a", "broken": None, "b": "b"}
+    assert isinstance(errors["broken"], ValueError)
+    assert attempts == {"a": 2, "broken": 3, "b": 2}
+    assert (stats.submitted, stats.completed, stats.failed) == (3, 2, 1)
+    assert (stats.retries, stats.in_flight) == (4, 0)
+
+
+def test_map_agent_cancels_the_requests_in_flight_when_closed():
+    cancelled = []
+
+    async def wait(item: float) -> float:
+        try:
+            await asyncio.sleep(item)
+        except asyncio.CancelledError:
+            cancelled.append(item)
+            raise
+        return item
+
+    async def run():
+        results = map_agent(wait, [0.01, 10, 10], concurrency=3)
+        await anext(results)
+        await results.aclose()
+        # The requests in flight were cancelled before aclose returned.
+        return list(cancelled)
+
+    assert asyncio.run(run()) == [10, 10]
+
+
+def test_agent_many_runs_the_agent_on_each_input(fake_gemini):
+    fake_gemini({"Echo": lambda contents: [text(request_of(contents).upper())]})
+
+    results = _collect(
+        agent.agent_many(
+            str, name="echo", instruction="Echo.", inputs=["a", "b"], ordered=True
+        )
+    )
+
+    assert [result.output for result in results] == ["A", "B"]
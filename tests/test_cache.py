@@ -0,0 +1,105 @@
+import asyncio
+from google.ai import generativelanguage as glm
+from goog.cache import ResponseCache
+from goog.model_spec import ModelSpec
+import google.generativeai as genai
+import os
+
+
+def _contents(text: str) -> list[glm.Content]:
+    return [glm.Content(parts=[glm.Part(text=text)], role="user")]
+
+
+def _response(text: str) -> genai.types.AsyncGenerateContentResponse:
+    return genai.types.AsyncGenerateContentResponse.from_response(
+        glm.GenerateContentResponse(
+            candidates=[
+                glm.Candidate(
+                    content=glm.Content(parts=[glm.Part(text=text)], role="model"),
+                    finish_reason=glm.Candidate.FinishReason.STOP,
+                )
+            ]
+        )
+    )
+
+
+_MODEL = ModelSpec(
+    model_name="gemini-1.5-flash-latest",
+    system_instruction="Be brief.",
+    generation_config=genai.GenerationConfig(temperature=0),
+)
+
+
+def test_key_covers_the_request():
+    cache = ResponseCache()
+
+    key = cache.key(_MODEL, _contents("Hello."))
+
+    assert key == cache.key(_MODEL, _contents("Hello."))
+    assert key != cache.key(_MODEL, _contents("Goodbye."))
+    assert key != cache.key(
+        _MODEL.with_model_name("gemini-1.5-pro-latest"), _contents("Hello.")
+    )
+    assert key != cache.key(
+        _MODEL.model_copy(update={"system_instruction": "Be verbose."}),
+        _contents("Hello."),
+    )
+
+
+def test_key_bypasses_nonzero_temperature():
+    cache = ResponseCache()
+    model = ModelSpec(model_name="gemini-1.5-flash-latest")
+
+    assert cache.key(model, _contents("Hello.")) is None
+    assert cache.stats.bypasses == 1
+    assert (
+        ResponseCache(allow_nonzero_temperature=True).key(model, _contents("Hello."))
+        is not None
+    )
+
+
+def test_round_trip_through_memory_and_disk(tmp_path):
+    async def run():
+        cache = ResponseCache(directory=str(tmp_path))
+        key = cache.key(_MODEL, _contents("Hello."))
+        assert await cache.get(key) is None
+
+        await cache.put(key, _response("Hi."))
+        assert (await cache.get(key)).text == "Hi."
+
+        # A new cache on the same directory starts with an empty memory tier.
+        restarted = ResponseCache(directory=str(tmp_path))
+        assert (await restarted.get(key)).text == "Hi."
+        return cache.stats, restarted.stats
+
+    stats, restarted_stats = asyncio.run(run())
+
+    assert (stats.misses, stats.memory_hits) == (1, 1)
+    assert restarted_stats.disk_hits == 1
+
+
+def test_concurrent_puts_of_the_same_key(tmp_path):
+    async def run():
+        cache = ResponseCache(directory=str(tmp_path))
+        key = cache.key(_MODEL, _contents("Hello."))
+        await asyncio.gather(
+            *(cache.put(key, _response(f"Hi {i}.")) for i in range(20))
+        )
+        restarted = ResponseCache(directory=str(tmp_path))
+        return await restarted.get(key)
+
+    response = asyncio.run(run())
+
+    assert response.text.startswith("Hi ")
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_failed_disk_write_keeps_the_response(tmp_path):
+    async def run():
+        cache = ResponseCache(directory=str(tmp_path / "cache"))
+        key = cache.key(_MODEL, _contents("Hello."))
+        os.rmdir(tmp_path / "cache")
+        await cache.put(key, _response("Hi."))
+        return await cache.get(key)
+
+    assert asyncio.run(run()).text == "Hi."
@@ -0,0 +1,80 @@
+import asyncio
+from bench.fake_gemini import function_call, request_of, text, tool_rounds
+from goog import cassette
+from goog.agent import AgentSpec
+from goog.cassette import CassetteMissError
+import pytest
+
+lookups = []
+
+
+async def lookup(query: str) -> str:
+    """Looks something up.
+
+    Args:
+        query: What to look up.
+    """
+    lookups.append(query)
+    return f"Found {query}."
+
+
+def _responder(contents):
+    if tool_rounds(contents):
+        return [text("Done.")]
+    return [function_call("lookup", query=request_of(contents))]
+
+
+_SPEC = AgentSpec(str, name="looker", instruction="Look it up.", tools=[lookup])
+
+
+def test_a_recorded_run_is_replayed_without_calls(fake_gemini, tmp_path):
+    backend = fake_gemini({"Look it up": _responder})
+    path = str(tmp_path / "run.jsonl.gz")
+    lookups.clear()
+
+    with cassette.recording(path) as recorded:
+        assert asyncio.run(_SPEC("durian")) == "Done."
+    calls = backend.stats.calls
+
+    with cassette.replaying(path) as replay:
+        assert asyncio.run(_SPEC("durian")) == "Done."
+
+    assert (recorded.stats.model_calls, recorded.stats.tool_calls) == (2, 1)
+    assert (replay.stats.model_calls, replay.stats.tool_calls) == (2, 1)
+    assert replay.stats.tools_run == 0
+    assert replay.unused_entries == 0
+    # Neither the model nor the tool was called again.
+    assert backend.stats.calls == calls
+    assert lookups == ["durian"]
+
+
+def test_unreplayed_calls_are_counted(fake_gemini, tmp_path):
+    fake_gemini({"Look it up": _responder})
+    path = str(tmp_path / "run.jsonl.gz")
+
+    with cassette.recording(path):
+
+        async def run():
+            return await asyncio.gather(_SPEC("durian"), _SPEC("mango"))
+
+        asyncio.run(run())
+
+    with cassette.replaying(path) as replay:
+        asyncio.run(_SPEC("durian"))
+
+    # The model calls and the tool call of the other run.
+    assert replay.unused_entries == 3
+
+
+def test_an_unrecorded_call_is_a_miss(fake_gemini, tmp_path):
+    fake_gemini({"Look it up": _responder})
+    path = str(tmp_path / "run.jsonl.gz")
+
+    with cassette.recording(path):
+        asyncio.run(_SPEC("durian"))
+
+    with cassette.replaying(path) as replay:
+        with pytest.raises(CassetteMissError):
+            asyncio.run(_SPEC("mango"))
+
+    assert replay.unused_entries == 3
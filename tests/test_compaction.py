@@ -0,0 +1,99 @@
+from google.ai import generativelanguage as glm
+from goog.compaction import CompactionPolicy
+from goog.tokens import estimate_tokens
+
+
+def _request() -> glm.Content:
+    return glm.Content(parts=[glm.Part(text="Find the answer.")], role="user")
+
+
+def _turn(i: int, result: str) -> list[glm.Content]:
+    return [
+        glm.Content(
+            parts=[
+                glm.Part(
+                    function_call=glm.FunctionCall(
+                        name="search", args={"query": f"q{i}"}
+                    )
+                )
+            ],
+            role="model",
+        ),
+        glm.Content(
+            parts=[
+                glm.Part(
+                    function_response=glm.FunctionResponse(
+                        name="search", response={"result": result}
+                    )
+                )
+            ],
+            role="user",
+        ),
+    ]
+
+
+def _conversation(*results: str) -> list[glm.Content]:
+    contents = [_request()]
+    for i, result in enumerate(results):
+        contents += _turn(i, result)
+    return contents
+
+
+def test_short_conversation_is_left_alone():
+    contents = _conversation("a", "b")
+
+    compacted, metrics = CompactionPolicy().compact(contents)
+
+    assert compacted is contents
+    assert metrics.tokens_saved == 0
+
+
+def test_old_function_responses_are_truncated_first():
+    contents = _conversation("x" * 4_000, "y" * 4_000)
+    policy = CompactionPolicy(
+        max_tokens=estimate_tokens(contents) - 500, max_function_response_chars=100
+    )
+
+    compacted, metrics = policy.compact(contents, turn=3)
+
+    assert metrics.turn == 3
+    assert metrics.truncated_responses == 1
+    assert metrics.collapsed_contents == 0
+    response = compacted[2].parts[0].function_response.response
+    assert len(response["truncated_result"]) == 100
+    assert response["original_chars"] > 4_000
+    # The latest contents are kept whole.
+    assert compacted[3:] == contents[3:]
+    assert metrics.tokens_after == estimate_tokens(compacted)
+    # The conversation passed in is not modified.
+    assert contents == _conversation("x" * 4_000, "y" * 4_000)
+
+
+def test_oldest_turns_are_collapsed_into_a_note():
+    contents = _conversation("a" * 400, "b" * 400, "c" * 400, "d" * 400)
+    policy = CompactionPolicy(max_tokens=250, max_function_response_chars=1_000)
+
+    compacted, metrics = policy.compact(contents)
+
+    assert metrics.collapsed_contents > 0
+    assert compacted[0] == contents[0]
+    assert compacted[-2:] == contents[-2:]
+    note = compacted[1].parts[0].text
+    assert note.startswith("Earlier steps were omitted")
+    assert 'search({"query": "q0"})' in note
+    # The roles keep alternating.
+    roles = [content.role for content in compacted]
+    assert all(a != b for a, b in zip(roles, roles[1:]))
+
+
+def test_a_note_carries_over_the_calls_of_an_earlier_note():
+    policy = CompactionPolicy(max_tokens=250, max_function_response_chars=1_000)
+    compacted, _ = policy.compact(
+        _conversation("a" * 400, "b" * 400, "c" * 400, "d" * 400)
+    )
+
+    compacted, _ = policy.compact(compacted + _turn(4, "e" * 400) + _turn(5, "f" * 400))
+
+    note = compacted[1].parts[0].text
+    assert 'search({"query": "q0"})' in note
+    assert 'search({"query": "q3"})' in note
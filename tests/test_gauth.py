@@ -0,0 +1,179 @@
+import asyncio
+import datetime
+import fcntl
+from goog import gauth
+from goog.gauth import CredentialManager
+from google.oauth2.credentials import Credentials as OAuthCredentials
+import os
+import pytest
+import threading
+
+
+def _expiry(seconds: float) -> datetime.datetime:
+    # The expiry of the credentials is a naive datetime in UTC.
+    return datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None
+    ) + datetime.timedelta(seconds=seconds)
+
+
+class _FakeCredentials:
+    """Service account credentials that refresh without the network."""
+
+    def __init__(self, expires_in_seconds: float) -> None:
+        self.expiry = _expiry(expires_in_seconds)
+        # Set to let a refresh finish.
+        self.release = threading.Event()
+        self.release.set()
+
+    @property
+    def valid(self) -> bool:
+        return self.expiry > _expiry(0)
+
+    def refresh(self, request) -> None:
+        self.release.wait(10)
+        self.expiry = _expiry(3600)
+
+
+def _oauth_credentials(token: str, expiry: datetime.datetime) -> OAuthCredentials:
+    return OAuthCredentials(
+        token=token,
+        refresh_token="refresh",
+        client_id="client",
+        client_secret="secret",
+        expiry=expiry,
+    )
+
+
+@pytest.fixture
+def load_credentials(monkeypatch):
+    """Replaces loading the credentials from files, counting the loads."""
+    loads = []
+
+    def install(creds):
+        def load(scopes):
+            loads.append(scopes)
+            return creds
+
+        monkeypatch.setattr(gauth, "_load_credentials", load)
+        return loads
+
+    return install
+
+
+def test_credentials_are_loaded_once(load_credentials):
+    creds = _FakeCredentials(3600)
+    loads = load_credentials(creds)
+    manager = CredentialManager(["scope"])
+
+    async def run():
+        return await asyncio.gather(*(manager.get() for _ in range(5)))
+
+    assert asyncio.run(run()) == [creds] * 5
+    assert manager.get_sync() is creds
+    assert loads == [["scope"]]
+    assert manager.refreshes == 0
+
+
+def test_no_credentials(load_credentials):
+    load_credentials(None)
+
+    assert asyncio.run(CredentialManager(["scope"]).get()) is None
+
+
+def test_a_token_about_to_expire_is_refreshed_in_the_background(load_credentials):
+    creds = _FakeCredentials(3600)
+    load_credentials(creds)
+    manager = CredentialManager(["scope"], refresh_margin_seconds=300)
+
+    async def run():
+        await manager.get()
+        creds.expiry = _expiry(60)
+        creds.release.clear()
+        # The current token is returned at once, while the refresh runs.
+        returned = [await manager.get(), await manager.get()]
+        refreshing = manager._refresh_task
+        assert not refreshing.done()
+        creds.release.set()
+        await refreshing
+        return returned
+
+    assert asyncio.run(run()) == [creds, creds]
+    assert manager.refreshes == 1
+    assert not gauth._expires_within(creds, 300)
+
+
+def test_an_expired_token_is_refreshed_before_use(load_credentials):
+    creds = _FakeCredentials(-60)
+    load_credentials(creds)
+    manager = CredentialManager(["scope"])
+
+    creds = asyncio.run(manager.get())
+
+    assert creds.valid
+    assert manager.refreshes == 1
+
+
+def test_a_token_refreshed_by_another_process_is_adopted(
+    monkeypatch, tmp_path, load_credentials
+):
+    monkeypatch.chdir(tmp_path)
+    stale = _oauth_credentials("stale", expiry=_expiry(60))
+    load_credentials(stale)
+    gauth._write_token(_oauth_credentials("fresh", expiry=_expiry(3600)))
+    manager = CredentialManager(["scope"], refresh_margin_seconds=300)
+
+    creds = manager.get_sync()
+
+    assert creds.token == "fresh"
+    assert manager.refreshes == 0
+    # The token file was replaced whole, without a temporary file left.
+    assert sorted(os.listdir(tmp_path)) == ["token.json", "token.json.lock"]
+
+
+def _lock_is_free() -> bool:
+    with open("token.json.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        return True
+
+
+def test_the_token_file_is_not_locked_during_the_login(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    locked_during_login = []
+
+    def log_in(scopes):
+        locked_during_login.append(not _lock_is_free())
+        return _oauth_credentials("new", expiry=_expiry(3600))
+
+    monkeypatch.setattr(gauth, "_log_in", log_in)
+
+    creds = gauth._get_oauth_credentials(["scope"])
+
+    assert creds.token == "new"
+    assert locked_during_login == [False]
+    assert gauth._read_oauth_token(["scope"]).token == "new"
+
+
+def test_a_login_by_another_process_is_adopted(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    def log_in(scopes):
+        # Another process logs in while the user is in the browser.
+        gauth._write_token(_oauth_credentials("other", expiry=_expiry(3600)))
+        return _oauth_credentials("mine", expiry=_expiry(3600))
+
+    monkeypatch.setattr(gauth, "_log_in", log_in)
+
+    creds = gauth._get_oauth_credentials(["scope"])
+
+    assert creds.token == "other"
+    assert gauth._read_oauth_token(["scope"]).token == "other"
+
+
+def test_managers_are_shared_by_scopes():
+    assert gauth.get_credential_manager(["b", "a"]) is gauth.get_credential_manager(
+        ["a", "b"]
+    )
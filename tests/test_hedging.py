@@ -0,0 +1,157 @@
+import asyncio
+from google.ai import generativelanguage as glm
+from goog import function_calling, hedging, rate_limit, tokens
+from goog.function_calling import generate_content
+from goog.hedging import Hedger
+from goog.model_spec import ModelSpec
+import google.generativeai as genai
+import pytest
+
+_PRO = "gemini-1.5-pro-latest"
+_FLASH = "gemini-1.5-flash-latest"
+_TOTAL_TOKENS = 1_000
+
+
+def _response(text: str) -> genai.types.AsyncGenerateContentResponse:
+    return genai.types.AsyncGenerateContentResponse.from_response(
+        glm.GenerateContentResponse(
+            candidates=[
+                glm.Candidate(
+                    content=glm.Content(parts=[glm.Part(text=text)], role="model"),
+                    finish_reason=glm.Candidate.FinishReason.STOP,
+                )
+            ],
+            usage_metadata=glm.GenerateContentResponse.UsageMetadata(
+                prompt_token_count=_TOTAL_TOKENS - 1,
+                candidates_token_count=1,
+                total_token_count=_TOTAL_TOKENS,
+            ),
+        )
+    )
+
+
+def test_usage_is_recorded_under_the_model_that_answered(monkeypatch):
+    monkeypatch.setattr(hedging, "_HEDGERS", {})
+    monkeypatch.setattr(rate_limit, "_LIMITERS", {})
+    monkeypatch.setattr(tokens, "_USAGE", {})
+    hedger = hedging.configure_hedging(
+        _PRO, min_samples=2, budget=1.0, fallback_model_name=_FLASH
+    )
+    pro_limiter = rate_limit.configure_rate_limit(
+        _PRO, requests_per_minute=600, tokens_per_minute=6_000
+    )
+    flash_limiter = rate_limit.configure_rate_limit(
+        _FLASH, requests_per_minute=600, tokens_per_minute=6_000
+    )
+    pro_calls = []
+
+    async def backend(model: ModelSpec, contents, stream):
+        if model.model_name.endswith(_PRO):
+            pro_calls.append(model)
+            # The third call to the original model is slow.
+            await asyncio.sleep(5 if len(pro_calls) == 3 else 0.01)
+            return _response("pro")
+        return _response("flash")
+
+    model = ModelSpec(model_name=_PRO, system_instruction="Be brief.")
+    contents = [glm.Content(parts=[glm.Part(text="Hi.")], role="user")]
+
+    async def run():
+        return [
+            (await generate_content(model, contents, rate_limiter=pro_limiter)).text
+            for _ in range(3)
+        ]
+
+    function_calling.configure(backend=backend)
+    try:
+        texts = asyncio.run(run())
+    finally:
+        function_calling.configure(backend=None)
+
+    assert texts == ["pro", "pro", "flash"]
+    assert hedger.stats.hedge_wins == 1
+    assert tokens.token_usage()[_FLASH].calls == 1
+    assert tokens.token_usage()[_PRO].calls == 2
+    # The bucket of the fallback model is charged the actual usage, and the
+    # bucket of the original model the prompt of the call it lost.
+    assert flash_limiter._tokens <= 6_000 - _TOTAL_TOKENS + 100
+    assert pro_limiter._tokens <= 6_000 - 3 * _TOTAL_TOKENS + 100
+
+
+def test_the_delay_is_a_percentile_of_the_recent_latencies():
+    hedger = Hedger(percentile=50, min_samples=5, window=5)
+    for latency in [9.0, 1.0, 2.0, 3.0]:
+        hedger._latencies.append(latency)
+
+    assert hedger.delay_seconds is None
+
+    for latency in [4.0, 5.0]:
+        hedger._latencies.append(latency)
+
+    # The first latency left the window.
+    assert hedger.delay_seconds == 3.0
+    assert Hedger(percentile=100, min_samples=1).delay_seconds is None
+
+
+def _model(name: str = _PRO) -> ModelSpec:
+    return ModelSpec(model_name=name)
+
+
+def _observed(hedger: Hedger, latency: float = 0.01) -> Hedger:
+    for _ in range(hedger.min_samples):
+        hedger._latencies.append(latency)
+    return hedger
+
+
+def test_hedges_are_sent_within_the_budget():
+    # The delay stays at the fastest latency, of 0.01 seconds.
+    hedger = _observed(Hedger(percentile=1, budget=0.5, min_samples=1))
+    calls = []
+
+    async def generate(model: ModelSpec, is_hedge: bool) -> bool:
+        calls.append(is_hedge)
+        await asyncio.sleep(0.01 if is_hedge else 0.1)
+        return is_hedge
+
+    async def run():
+        return [await hedger.call(_model(), generate) for _ in range(4)]
+
+    results = asyncio.run(run())
+
+    # Every other request can be hedged.
+    assert [hedge_won for _, hedge_won in results] == [False, True, False, True]
+    assert calls.count(True) == 2
+    assert (hedger.stats.hedged, hedger.stats.over_budget) == (2, 2)
+
+
+def test_the_losing_call_is_cancelled():
+    hedger = _observed(Hedger(budget=1.0, min_samples=1, fallback_model_name=_FLASH))
+    cancelled = []
+
+    async def generate(model: ModelSpec, is_hedge: bool) -> str:
+        try:
+            await asyncio.sleep(0.01 if is_hedge else 10)
+        except asyncio.CancelledError:
+            cancelled.append(model.model_name)
+            raise
+        return model.model_name
+
+    async def run():
+        result = await hedger.call(_model(), generate)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == (f"models/{_FLASH}", True)
+    assert cancelled == [f"models/{_PRO}"]
+    assert hedger.stats.hedge_wins == 1
+
+
+def test_the_last_error_is_raised_when_every_call_fails():
+    hedger = _observed(Hedger(budget=1.0, min_samples=1))
+
+    async def generate(model: ModelSpec, is_hedge: bool) -> str:
+        await asyncio.sleep(0.02 if is_hedge else 0.05)
+        raise ValueError("hedge" if is_hedge else "original")
+
+    with pytest.raises(ValueError, match="original"):
+        asyncio.run(hedger.call(_model(), generate))
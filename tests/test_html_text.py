@@ -0,0 +1,33 @@
+from functions.html_text import chunk_passages, extract_text
+
+
+def test_passages_keep_the_title_after_a_big_head():
+    html = (
+        "<html>\n<head><style>"
+        + "a{}" * 50_000
+        + "</style><title>Big head</title></head>"
+        + "<body><h1 id='intro'>Intro</h1><p>one two three</p>"
+        + "<h2>Next</h2><p>four five</p></body></html>"
+    )
+
+    chunked = chunk_passages(html, max_words=10)
+
+    assert chunked.title == "Big head"
+    assert [(p.text, p.heading, p.anchor) for p in chunked.passages] == [
+        ("Intro one two three", "Intro", "intro"),
+        ("Next four five", "Next", "intro"),
+    ]
+
+
+def test_passages_of_a_page_without_a_title():
+    assert chunk_passages("<p>text</p>").title == "No title found"
+
+
+def test_the_title_is_taken_from_the_head_only():
+    html = (
+        "<html><head><title>Page</title></head><body>"
+        "<svg><title>Icon</title></svg><p>text</p></body></html>"
+    )
+
+    assert chunk_passages(html).title == "Page"
+    assert extract_text(html).title == "Page"
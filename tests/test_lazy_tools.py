@@ -0,0 +1,107 @@
+import asyncio
+from goog.lazy_tools import LazyTool, lazy_tool, resolve
+from goog.model_spec import ModelSpec
+from google.ai import generativelanguage as glm
+import importlib
+import pytest
+import sys
+import textwrap
+
+_TOOL_PATHS = [
+    "functions.web:web_search",
+    "functions.web:web_scrape",
+    "agents.math_professor:math_professor",
+    "agents.webber:web_researcher",
+    "agents.webber:web_scraper",
+    "agents.webber:web_searcher",
+]
+
+
+def _declarations(tool) -> list[glm.Tool]:
+    tools = ModelSpec(model_name="gemini-1.5-flash-latest", tools=[tool]).tools
+    assert tools is not None
+    return tools
+
+
+@pytest.mark.parametrize("path", _TOOL_PATHS)
+def test_lazy_declarations_match_the_eager_ones(path):
+    module_name, _, name = path.partition(":")
+
+    lazy = _declarations(LazyTool(path))
+    eager = _declarations(getattr(importlib.import_module(module_name), name))
+
+    assert lazy == eager
+
+
+@pytest.fixture
+def tool_module(monkeypatch, tmp_path):
+    """Writes a module of tools, importable but not imported."""
+
+    def write(name: str, source: str) -> str:
+        (tmp_path / f"{name}.py").write_text(textwrap.dedent(source))
+        return name
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield write
+    for name in [name for name in sys.modules if name.startswith("lazy_tools_")]:
+        del sys.modules[name]
+
+
+def test_declaring_does_not_import_the_module(tool_module):
+    module = tool_module(
+        "lazy_tools_plain",
+        '''
+        import asyncio
+
+        async def shout(text: str, times: int = 2) -> str:
+            """Shouts a text.
+
+            Args:
+                text: What to shout.
+                times: How many times.
+            """
+            return " ".join([text.upper()] * times)
+        ''',
+    )
+
+    tool = LazyTool(f"{module}:shout")
+
+    assert module not in sys.modules
+    assert not tool.loaded
+    assert _declarations(tool)[0].function_declarations[0].name == "shout"
+
+    function = asyncio.run(resolve(tool))
+
+    assert module in sys.modules
+    assert asyncio.run(function(text="hi")) == "HI HI"
+
+
+def test_a_signature_needing_the_module_imports_it(tool_module):
+    module = tool_module(
+        "lazy_tools_typed",
+        """
+        import enum
+
+        class Color(enum.Enum):
+            RED = "red"
+
+        def paint(color: Color) -> str:
+            return color.value
+        """,
+    )
+
+    tool = LazyTool(f"{module}:paint")
+
+    assert tool.loaded
+    assert tool(color=sys.modules[module].Color.RED) == "red"
+
+
+def test_lazy_tools_are_shared_by_path():
+    assert lazy_tool("functions.web:web_search") is lazy_tool(
+        "functions.web:web_search"
+    )
+
+
+def test_invalid_paths_are_rejected():
+    with pytest.raises(ValueError):
+        LazyTool("functions.web")
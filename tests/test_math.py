@@ -0,0 +1,60 @@
+from functions.math import math, math_batch
+import pytest
+import time
+
+
+def test_arithmetic():
+    assert math("2 + 3 * 4 ** 2 / -8") == -4.0
+
+
+@pytest.mark.parametrize(
+    "expression, error",
+    [
+        ("1e308 * 10", "Result too large"),
+        ("10 ** 400", "Result too large"),
+        ("(-8) ** 0.5", "Result is not a real number"),
+        ("__import__('os')", "Invalid"),
+        ("2 // 3", "Invalid operator"),
+        ("True + 1", "Invalid constant"),
+    ],
+)
+def test_out_of_bounds_and_invalid_expressions_are_refused(expression, error):
+    with pytest.raises(ValueError, match=error):
+        math(expression)
+
+
+def test_a_huge_power_is_refused_before_it_is_computed():
+    start = time.monotonic()
+
+    with pytest.raises(ValueError, match="Result too large"):
+        math("9 ** 9 ** 9")
+
+    assert time.monotonic() - start < 0.1
+
+
+def test_math_batch_uses_the_names_of_earlier_assignments():
+    assert math_batch(["r = 2", "area=3 * r ** 2", "area / r"]) == [
+        {"name": "r", "expression": "2", "result": 2.0},
+        {"name": "area", "expression": "3 * r ** 2", "result": 12.0},
+        {"expression": "area / r", "result": 6.0},
+    ]
+
+
+def test_math_batch_reports_errors_and_goes_on():
+    results = math_batch(["x == 1", "1 / 0", "y + 1", "2 = 3", "1 + 1"])
+
+    assert [result.get("error") for result in results] == [
+        "Invalid expression",
+        "division by zero",
+        "Unknown variable y",
+        "Invalid expression: invalid syntax",
+        None,
+    ]
+    # An equality is not taken for an assignment.
+    assert results[0]["expression"] == "x == 1"
+    assert results[4]["result"] == 2.0
+
+
+def test_math_batch_is_bounded():
+    with pytest.raises(ValueError, match="At most"):
+        math_batch(["1"] * 101)
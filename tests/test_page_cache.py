@@ -0,0 +1,145 @@
+import asyncio
+from functions import page_cache
+from functions.fetch import Page
+from functions.page_cache import PageCache
+import os
+
+
+class _FakeFetcher:
+    def __init__(self, headers: dict[str, str], text: str = "<p>Hello.</p>") -> None:
+        self.headers = headers
+        self.text = text
+        self.requests: list[dict[str, str]] = []
+
+    async def fetch(self, url, *, content_types=None, headers=None) -> Page:
+        self.requests.append(dict(headers or {}))
+        validated = headers and headers.get("If-None-Match") == self.headers.get("etag")
+        return Page(
+            url=url,
+            status=304 if validated else 200,
+            headers=self.headers,
+            content_type="text/html",
+            charset="utf-8",
+            text="" if validated else self.text,
+            truncated=False,
+        )
+
+
+async def _length(page: Page) -> int:
+    return len(page.text)
+
+
+def _use_fetcher(monkeypatch, fetcher: _FakeFetcher) -> None:
+    monkeypatch.setattr(page_cache, "get_fetcher", lambda: fetcher)
+
+
+def test_fresh_page_is_served_from_disk(tmp_path, monkeypatch):
+    fetcher = _FakeFetcher({"cache-control": "max-age=3600"})
+    _use_fetcher(monkeypatch, fetcher)
+
+    async def run():
+        cache = PageCache(str(tmp_path))
+        first = await cache.extract("https://example.com/", "length", _length)
+        restarted = PageCache(str(tmp_path))
+        second = await restarted.extract("https://example.com/", "length", _length)
+        return first, second, restarted.stats
+
+    first, second, stats = asyncio.run(run())
+
+    assert first == second == len("<p>Hello.</p>")
+    assert len(fetcher.requests) == 1
+    assert (stats.fresh_hits, stats.extraction_hits) == (1, 1)
+
+
+def test_stale_page_is_revalidated(tmp_path, monkeypatch):
+    fetcher = _FakeFetcher({"cache-control": "no-cache", "etag": '"v1"'})
+    _use_fetcher(monkeypatch, fetcher)
+
+    async def run():
+        cache = PageCache(str(tmp_path))
+        await cache.extract("https://example.com/", "length", _length)
+        result = await cache.extract("https://example.com/", "length", _length)
+        return result, cache.stats
+
+    result, stats = asyncio.run(run())
+
+    assert result == len("<p>Hello.</p>")
+    assert fetcher.requests[1] == {"If-None-Match": '"v1"'}
+    assert (stats.downloads, stats.revalidated, stats.extraction_hits) == (1, 1, 1)
+
+
+def test_no_store_page_is_not_written(tmp_path, monkeypatch):
+    _use_fetcher(monkeypatch, _FakeFetcher({"cache-control": "no-store"}))
+
+    async def run():
+        return await PageCache(str(tmp_path)).extract(
+            "https://example.com/", "length", _length
+        )
+
+    assert asyncio.run(run()) == len("<p>Hello.</p>")
+    assert os.listdir(tmp_path) == []
+
+
+def test_concurrent_writes_of_the_same_page(tmp_path, monkeypatch):
+    _use_fetcher(monkeypatch, _FakeFetcher({"cache-control": "max-age=3600"}))
+
+    async def run():
+        cache = PageCache(str(tmp_path))
+        return await asyncio.gather(
+            *(
+                cache.extract("https://example.com/", "length", _length)
+                for _ in range(20)
+            )
+        )
+
+    assert set(asyncio.run(run())) == {len("<p>Hello.</p>")}
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_a_failed_extraction_write_still_returns_the_extraction(tmp_path, monkeypatch):
+    _use_fetcher(monkeypatch, _FakeFetcher({"cache-control": "max-age=3600"}))
+    cache = PageCache(str(tmp_path))
+    write = cache._write
+
+    def write_pages_only(path: str, text: str) -> None:
+        if path.endswith(".length.json.gz"):
+            raise OSError("No space left on device")
+        write(path, text)
+
+    monkeypatch.setattr(cache, "_write", write_pages_only)
+
+    async def run():
+        return await cache.extract("https://example.com/", "length", _length)
+
+    assert asyncio.run(run()) == len("<p>Hello.</p>")
+    assert asyncio.run(run()) == len("<p>Hello.</p>")
+    assert (cache.stats.extractions, cache.stats.extraction_hits) == (2, 0)
+
+
+def test_writing_an_extraction_evicts_old_files(tmp_path, monkeypatch):
+    _use_fetcher(monkeypatch, _FakeFetcher({"cache-control": "max-age=3600"}))
+    cache = PageCache(str(tmp_path), max_age_seconds=60)
+
+    async def extract(variant: str) -> int:
+        return await cache.extract("https://example.com/", variant, _length)
+
+    asyncio.run(extract("length"))
+    old = tmp_path / "old.body.gz"
+    old.write_bytes(b"")
+    os.utime(old, (0, 0))
+    # The page is fresh, so only the new extraction is written.
+    asyncio.run(extract("size"))
+
+    assert not old.exists()
+    assert cache.stats.fresh_hits == 1
+
+
+def test_freshness_seconds():
+    assert page_cache._freshness_seconds({"cache-control": "max-age=60"}) == 60
+    assert (
+        page_cache._freshness_seconds({"cache-control": "max-age=60", "age": "50"})
+        == 10
+    )
+    assert page_cache._freshness_seconds({"cache-control": "no-store"}) is None
+    assert page_cache._freshness_seconds({"cache-control": "no-cache"}) == 0
+    assert page_cache._freshness_seconds({}) == 0
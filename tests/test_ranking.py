@@ -0,0 +1,45 @@
+from functions.ranking import Bm25Index, tokenize
+
+
+def test_tokenize_splits_words_and_folds_case():
+    assert tokenize("Chilli-Crab, STRASSE!") == ["chilli", "crab", "strasse"]
+
+
+def test_documents_are_ranked_by_relevance():
+    index = Bm25Index(
+        [
+            "Chilli crab is a seafood dish.",
+            "The weather in Singapore is hot.",
+            "Crab, crab and more crab: a crab festival.",
+        ]
+    )
+
+    ranked = index.rank("crab")
+
+    # The document repeating the term ranks first; the others do not match.
+    assert [i for i, _ in ranked] == [2, 0]
+    assert ranked[0][1] > ranked[1][1] > 0
+
+
+def test_rare_terms_weigh_more_than_common_ones():
+    index = Bm25Index(
+        ["durian season", "durian market", "durian stall", "mango season"]
+    )
+
+    ranked = index.rank("durian mango")
+
+    assert ranked[0][0] == 3
+
+
+def test_longer_documents_score_lower_for_the_same_counts():
+    index = Bm25Index(["laksa", "laksa " + "noodles " * 20])
+
+    assert [i for i, _ in index.rank("laksa")] == [0, 1]
+
+
+def test_top_k_and_no_matches():
+    index = Bm25Index(["a b", "b c", "c d"])
+
+    assert len(index.rank("b c", top_k=1)) == 1
+    assert index.rank("zebra") == []
+    assert Bm25Index([]).rank("anything") == []
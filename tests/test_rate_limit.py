@@ -0,0 +1,84 @@
+import asyncio
+from goog import rate_limit
+from goog.rate_limit import RateLimiter
+import pytest
+
+
+def test_limits_must_be_positive(monkeypatch):
+    monkeypatch.setattr(rate_limit, "_LIMITERS", {})
+
+    with pytest.raises(ValueError):
+        rate_limit.configure_rate_limit(
+            "gemini-1.5-flash-latest", requests_per_minute=0
+        )
+    with pytest.raises(ValueError):
+        RateLimiter(requests_per_minute=60, tokens_per_minute=0)
+    assert rate_limit.get_rate_limiter("gemini-1.5-flash-latest") is None
+
+
+def test_requests_wait_for_the_bucket_to_refill():
+    # Refills one request every 0.1 seconds.
+    limiter = RateLimiter(requests_per_minute=600)
+    limiter._requests = 0
+
+    waited = asyncio.run(limiter.acquire())
+
+    assert 0.05 < waited < 0.5
+    assert limiter.stats.acquired == 1
+    assert limiter.stats.max_wait_seconds == waited
+
+
+def test_tokens_wait_for_the_bucket_to_refill():
+    # Refills 100 tokens every 0.1 seconds.
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60_000)
+
+    async def run():
+        await limiter.acquire(60_000)
+        return await limiter.acquire(100)
+
+    assert 0.05 < asyncio.run(run()) < 0.5
+
+
+def test_waiters_are_served_in_order():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60_000)
+    limiter._tokens = 0
+    order = []
+
+    async def acquire(name: str, tokens: int) -> None:
+        await limiter.acquire(tokens)
+        order.append(name)
+
+    async def run():
+        # The large request is not overtaken by the small ones behind it.
+        await asyncio.gather(acquire("large", 200), acquire("small", 1))
+
+    asyncio.run(run())
+
+    assert order == ["large", "small"]
+
+
+def test_record_usage_corrects_the_token_bucket():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=60_000)
+
+    async def run():
+        await limiter.acquire(1_000)
+        limiter.record_usage(1_000, 31_000)
+
+    asyncio.run(run())
+
+    # The 30 000 tokens under the estimate are taken too, give or take the refill.
+    assert 29_000 < limiter._tokens < 29_500
+
+
+def test_a_limiter_is_shared_by_event_loops():
+    limiter = RateLimiter(requests_per_minute=6_000)
+
+    async def run():
+        # Empty, so that the waiters contend for the lock.
+        limiter._requests = 0
+        await asyncio.gather(*(limiter.acquire() for _ in range(3)))
+
+    asyncio.run(run())
+    asyncio.run(run())
+
+    assert limiter.stats.acquired == 6
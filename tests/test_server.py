@@ -0,0 +1,292 @@
+import asyncio
+from goog.events import FinalResult, TextDelta
+import json
+from main.server import Server
+import os
+import pytest
+
+
+async def _echo(message: str):
+    yield TextDelta(text=message)
+    yield FinalResult(output=message.upper())
+
+
+async def _slow(message: str):
+    yield TextDelta(text=message)
+    await asyncio.sleep(0.5)
+    yield FinalResult(output=message)
+
+
+async def _silent(message: str):
+    return
+    yield
+
+
+async def _http(
+    port: int, method: str, path: str, body: bytes = b"", **headers: str
+) -> tuple[int, dict[str, str], bytes]:
+    """Sends a request over a new connection and reads the whole response."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    head = "".join(f"{name}: {value}\r\n" for name, value in headers.items())
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+        f"Content-Length: {headers.get('Content-Length', len(body))}\r\n{head}\r\n".encode()
+        + body
+    )
+    status_line, _, rest = (await reader.read()).partition(b"\r\n")
+    writer.close()
+    head_lines, _, response_body = rest.partition(b"\r\n\r\n")
+    response_headers = dict(
+        line.split(": ", 1) for line in head_lines.decode().split("\r\n") if line
+    )
+    if response_headers.get("Transfer-Encoding") == "chunked":
+        response_body = _unchunk(response_body)
+    return int(status_line.split()[1]), response_headers, response_body
+
+
+def _unchunk(body: bytes) -> bytes:
+    data = b""
+    while True:
+        size_line, _, body = body.partition(b"\r\n")
+        size = int(size_line, 16)
+        if size == 0:
+            return data
+        data += body[:size]
+        body = body[size + 2 :]
+
+
+async def _message(port: int, session_id: str, message: str, stream: bool = False):
+    return await _http(
+        port,
+        "POST",
+        f"/sessions/{session_id}/messages",
+        json.dumps({"message": message, "stream": stream}).encode(),
+    )
+
+
+def _run_server(test, handler=_echo, **kwargs):
+    """Runs a test coroutine against a server on a free port."""
+
+    async def run():
+        server = Server(handler, **kwargs)
+        listening = await server.start()
+        try:
+            async with listening:
+                port = listening.sockets[0].getsockname()[1]
+                _, _, body = await _http(port, "POST", "/sessions")
+                return await test(server, port, json.loads(body)["session_id"])
+        finally:
+            await server.close()
+
+    return asyncio.run(run())
+
+
+def test_reply():
+    async def test(server, port, session_id):
+        status, _, body = await _message(port, session_id, "hello")
+        _, _, history = await _http(port, "GET", f"/sessions/{session_id}")
+        return status, json.loads(body), json.loads(history), server.stats
+
+    status, body, history, stats = _run_server(test)
+
+    assert (status, body) == (200, {"output": "HELLO"})
+    assert history == {"history": [{"message": "hello", "output": "HELLO"}]}
+    assert (stats.completed, stats.in_flight) == (1, 0)
+
+
+def test_streamed_reply():
+    async def test(server, port, session_id):
+        return await _message(port, session_id, "hello", stream=True)
+
+    status, headers, body = _run_server(test)
+
+    assert (status, headers["Content-Type"]) == (200, "application/x-ndjson")
+    assert [json.loads(line) for line in body.splitlines()] == [
+        {"type": "TextDelta", "text": "hello"},
+        {"type": "FinalResult", "output": "HELLO"},
+    ]
+
+
+def test_streamed_reply_without_events():
+    async def test(server, port, session_id):
+        return await _message(port, session_id, "hello", stream=True)
+
+    status, _, body = _run_server(test, handler=_silent)
+
+    assert (status, body) == (200, b"")
+
+
+def test_busy_session():
+    async def test(server, port, session_id):
+        running = asyncio.create_task(_message(port, session_id, "first"))
+        await asyncio.sleep(0.1)
+        busy = await _message(port, session_id, "second")
+        return busy, await running
+
+    busy, first = _run_server(test, handler=_slow)
+
+    assert (busy[0], first[0]) == (409, 200)
+
+
+def test_admission_control():
+    async def test(server, port, session_id):
+        _, _, other = await _http(port, "POST", "/sessions")
+        running = asyncio.create_task(_message(port, session_id, "first"))
+        await asyncio.sleep(0.1)
+        full = await _message(port, json.loads(other)["session_id"], "second")
+        await running
+        return full, server.stats
+
+    full, stats = _run_server(test, handler=_slow, max_in_flight=1)
+
+    assert (full[0], full[1]["Retry-After"]) == (503, "1")
+    assert (stats.completed, stats.rejected, stats.in_flight) == (1, 1, 0)
+
+
+def test_request_timeout():
+    async def test(server, port, session_id):
+        return await _message(port, session_id, "hello"), server.stats
+
+    (status, _, body), stats = _run_server(
+        test, handler=_slow, request_timeout_seconds=0.1
+    )
+
+    assert (status, json.loads(body)) == (504, {"error": "The request timed out."})
+    assert (stats.timed_out, stats.in_flight) == (1, 0)
+
+
+def test_streamed_request_timeout():
+    async def test(server, port, session_id):
+        return await _message(port, session_id, "hello", stream=True)
+
+    status, _, body = _run_server(test, handler=_slow, request_timeout_seconds=0.1)
+
+    assert status == 200
+    assert [json.loads(line)["type"] for line in body.splitlines()] == [
+        "TextDelta",
+        "Error",
+    ]
+
+
+@pytest.mark.parametrize("length", ["abc", "-1"])
+def test_malformed_content_length(length):
+    async def test(server, port, session_id):
+        return await _http(port, "POST", "/sessions", **{"Content-Length": length})
+
+    status, _, _ = _run_server(test)
+
+    assert status == 400
+
+
+def test_chunked_request_body():
+    async def test(server, port, session_id):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps({"message": "hello"}).encode()
+        request = (
+            f"POST /sessions/{session_id}/messages HTTP/1.1\r\nHost: localhost\r\n"
+            "Transfer-Encoding: chunked\r\n\r\n"
+        ).encode() + b"%x;ext=1\r\n%s\r\n0\r\nTrailer: x\r\n\r\n" % (len(body), body)
+        # Two requests over the kept-alive connection.
+        writer.write(request + request.replace(b"hello", b"again"))
+        replies = [await reader.readuntil(b"}") for _ in range(2)]
+        writer.close()
+        return [reply.partition(b"\r\n\r\n")[2] for reply in replies]
+
+    assert _run_server(test) == [b'{"output": "HELLO"}', b'{"output": "AGAIN"}']
+
+
+def test_unsupported_transfer_encoding_closes_the_connection():
+    async def test(server, port, session_id):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            b"POST /sessions HTTP/1.1\r\nHost: localhost\r\n"
+            b"Transfer-Encoding: gzip, chunked\r\n\r\n"
+        )
+        # The server closes the connection after its reply.
+        reply = await reader.read()
+        writer.close()
+        return reply
+
+    reply = _run_server(test)
+
+    assert reply.startswith(b"HTTP/1.1 501 ")
+    assert b"Connection: close" in reply
+
+
+def test_server_close_stops_reaping_sessions():
+    async def test(server, port, session_id):
+        return server._reaper
+
+    reaper = _run_server(test)
+
+    assert reaper.cancelled()
+
+
+def _frame(opcode: int, data: bytes, fin: bool = True) -> bytes:
+    mask = os.urandom(4)
+    return (
+        bytes([(0x80 if fin else 0) | opcode, 0x80 | len(data)])
+        + mask
+        + bytes(byte ^ mask[i % 4] for i, byte in enumerate(data))
+    )
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> tuple[int, bytes]:
+    first, length = await reader.readexactly(2)
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), "big")
+    return first & 0x0F, await reader.readexactly(length)
+
+
+async def _websocket(port: int, session_id: str):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"GET /sessions/{session_id}/ws HTTP/1.1\r\nHost: localhost\r\n"
+        "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+        "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n".encode()
+    )
+    head = await reader.readuntil(b"\r\n\r\n")
+    assert b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in head
+    return reader, writer
+
+
+def test_websocket_answers_pings_while_a_request_runs():
+    async def test(server, port, session_id):
+        reader, writer = await _websocket(port, session_id)
+        # A fragmented message with a ping in between the fragments.
+        writer.write(
+            _frame(0x1, b"hel", fin=False) + _frame(0x9, b"ping") + _frame(0x0, b"lo")
+        )
+        frames = [await _read_frame(reader), await _read_frame(reader)]
+        # The request is still running.
+        writer.write(_frame(0x9, b"again"))
+        frames.append(await _read_frame(reader))
+        frames.append(await _read_frame(reader))
+        writer.write(_frame(0x8, b"\x03\xe8"))
+        frames.append(await _read_frame(reader))
+        writer.close()
+        return frames
+
+    frames = _run_server(test, handler=_slow)
+
+    assert frames[0] == (0xA, b"ping")
+    assert (frames[1][0], json.loads(frames[1][1])) == (
+        0x1,
+        {"type": "TextDelta", "text": "hello"},
+    )
+    assert frames[2] == (0xA, b"again")
+    assert json.loads(frames[3][1]) == {"type": "FinalResult", "output": "hello"}
+    assert frames[4] == (0x8, b"\x03\xe8")
+
+
+def test_websocket_closes_on_an_unmasked_frame():
+    async def test(server, port, session_id):
+        reader, writer = await _websocket(port, session_id)
+        writer.write(bytes([0x81, 5]) + b"hello")
+        frame = await _read_frame(reader)
+        writer.close()
+        return frame
+
+    opcode, payload = _run_server(test)
+
+    assert (opcode, payload[:2]) == (0x8, (1002).to_bytes(2, "big"))
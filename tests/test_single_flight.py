@@ -0,0 +1,192 @@
+import asyncio
+from google.ai import generativelanguage as glm
+from goog.decorators import memoize, never_dedupe
+from goog.function_calling import FunctionCalling
+from goog.single_flight import SingleFlight
+from goog.tool_policy import ToolPolicy
+
+calls: list[int] = []
+
+
+async def _double(x: int) -> int:
+    calls.append(x)
+    await asyncio.sleep(0.05)
+    return 2 * x
+
+
+@never_dedupe
+async def _double_always(x: int) -> int:
+    return await _double(x)
+
+
+@memoize(ttl_seconds=0.2)
+async def _double_memoized(x: int) -> int:
+    return await _double(x)
+
+
+def _call(group: SingleFlight, function, x: int):
+    return group.call(function, {"x": x}, {"x": x})
+
+
+def test_identical_calls_share_one_run():
+    calls.clear()
+    group = SingleFlight()
+
+    async def run():
+        return await asyncio.gather(
+            _call(group, _double, 1), _call(group, _double, 1), _call(group, _double, 2)
+        )
+
+    assert asyncio.run(run()) == [2, 2, 4]
+    assert sorted(calls) == [1, 2]
+    assert (group.stats.calls, group.stats.shared) == (3, 1)
+
+
+def test_never_dedupe_always_runs():
+    calls.clear()
+    group = SingleFlight()
+
+    async def run():
+        return await asyncio.gather(
+            _call(group, _double_always, 1), _call(group, _double_always, 1)
+        )
+
+    assert asyncio.run(run()) == [2, 2]
+    assert calls == [1, 1]
+
+
+def test_memoized_results_expire():
+    calls.clear()
+    group = SingleFlight()
+
+    async def run():
+        results = [
+            await _call(group, _double_memoized, 1),
+            await _call(group, _double_memoized, 1),
+        ]
+        await asyncio.sleep(0.25)
+        results.append(await _call(group, _double_memoized, 1))
+        return results
+
+    assert asyncio.run(run()) == [2, 2, 2]
+    assert calls == [1, 1]
+    assert group.stats.memo_hits == 1
+
+
+def test_calls_are_keyed_by_qualified_name():
+    calls.clear()
+    group = SingleFlight()
+
+    def make_tool(scale: int):
+        @memoize()
+        async def tool(x: int) -> int:
+            calls.append(x)
+            return scale * x
+
+        return tool
+
+    async def run():
+        return [
+            await _call(group, make_tool(2), 1),
+            await _call(group, make_tool(2), 1),
+        ]
+
+    # The second tool is a new function object, but the same tool.
+    assert asyncio.run(run()) == [2, 2]
+    assert calls == [1]
+
+
+def test_identical_calls_are_joined_before_taking_a_slot():
+    calls.clear()
+    tools = FunctionCalling(
+        functions=[_double], policy=ToolPolicy(max_concurrency={"_double": 1})
+    )
+    parts = [
+        glm.Part(function_call=glm.FunctionCall(name="_double", args={"x": x}))
+        for x in [1, 1, 1, 2]
+    ]
+
+    async def run():
+        return await tools.call_parallelly(parts)
+
+    responses = asyncio.run(run())
+
+    assert [part.function_response.response["result"] for part in responses] == [
+        2,
+        2,
+        2,
+        4,
+    ]
+    assert sorted(calls) == [1, 2]
+    # The joined calls did not queue for the slot of the one they joined.
+    metrics = tools.policy.metrics["_double"]
+    assert metrics.calls == 4
+    assert metrics.max_queue_seconds < 0.09
+
+
+def test_a_call_is_cancelled_with_its_last_caller():
+    cancelled = []
+
+    async def wait(x: int) -> int:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(x)
+            raise
+        return x
+
+    group = SingleFlight()
+
+    async def run():
+        first = asyncio.ensure_future(_call(group, wait, 1))
+        second = asyncio.ensure_future(_call(group, wait, 1))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        # The call still has a caller.
+        running = not cancelled
+        second.cancel()
+        await asyncio.gather(first, second, return_exceptions=True)
+        return running, list(cancelled)
+
+    assert asyncio.run(run()) == (True, [1])
+
+
+async def _fail() -> str:
+    raise ValueError("Failed.")
+
+
+def test_siblings_of_a_failed_call_are_cancelled_and_free_their_slots():
+    cancelled = []
+
+    async def _slow_lookup(query: str) -> str:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(query)
+            raise
+        return query
+
+    policy = ToolPolicy(
+        max_concurrency={"_slow_lookup": 1}, cancel_siblings_on_error=True
+    )
+    tools = FunctionCalling(functions=[_slow_lookup, _fail], policy=policy)
+    parts = [
+        glm.Part(
+            function_call=glm.FunctionCall(name="_slow_lookup", args={"query": "a"})
+        ),
+        glm.Part(function_call=glm.FunctionCall(name="_fail")),
+    ]
+
+    async def run():
+        responses = await tools.call_parallelly(parts)
+        # The slot of the cancelled call is free again.
+        async with asyncio.timeout(1):
+            async with policy.slot("_slow_lookup"):
+                pass
+        return responses
+
+    responses = asyncio.run(run())
+
+    assert "skipped" in responses[0].function_response.response
+    assert cancelled == ["a"]
@@ -0,0 +1,152 @@
+import asyncio
+from google.ai import generativelanguage as glm
+from goog.model_spec import ModelSpec
+from goog.tokens import (
+    RequestTooLargeError,
+    TokenPolicy,
+    _fair_share,
+    estimate_function_response_tokens,
+    estimate_request_tokens,
+    estimate_tokens,
+    truncate_function_response,
+)
+import pytest
+
+
+def lookup(query: str) -> str:
+    """Looks something up.
+
+    Args:
+        query: What to look up.
+    """
+    return query
+
+
+_MODEL = ModelSpec(
+    model_name="gemini-1.5-flash-latest",
+    system_instruction="Be brief.",
+    tools=[lookup],
+)
+
+
+def _conversation(*results: str) -> list[glm.Content]:
+    contents = [glm.Content(parts=[glm.Part(text="Look these up.")], role="user")]
+    for result in results:
+        contents.append(
+            glm.Content(
+                parts=[
+                    glm.Part(
+                        function_response=glm.FunctionResponse(
+                            name="lookup", response={"result": result}
+                        )
+                    )
+                ],
+                role="user",
+            )
+        )
+    return contents
+
+
+def _response_sizes(contents: list[glm.Content]) -> list[int]:
+    return [
+        estimate_function_response_tokens(part.function_response)
+        for content in contents
+        for part in content.parts
+        if "function_response" in part
+    ]
+
+
+def test_request_estimate_counts_the_model_settings():
+    contents = _conversation("a result")
+
+    assert estimate_request_tokens(contents) == estimate_tokens(contents)
+    assert estimate_request_tokens(
+        contents, system_instruction=_MODEL.system_instruction, tools=_MODEL.tools
+    ) > estimate_tokens(contents)
+
+
+def test_fair_share_removes_the_excess_from_the_longest():
+    # Capping at 60 removes 40 from the first and none from the others.
+    assert _fair_share([100, 50, 20], 40) == 60
+    # Capping at 40 removes 60 + 10.
+    assert _fair_share([100, 50, 20], 70) == 40
+    assert _fair_share([100, 50, 20], 0) == 100
+
+
+def test_fair_share_gives_up_when_truncating_everything_is_not_enough():
+    assert _fair_share([100, 50], 1_000) is None
+    assert _fair_share([], 1) is None
+
+
+def test_fit_leaves_a_small_request_alone():
+    contents = _conversation("short")
+
+    fitted, metrics = asyncio.run(TokenPolicy().fit(_MODEL, contents))
+
+    assert fitted == contents
+    assert metrics.truncated_responses == 0
+    assert metrics.tokens_after == metrics.estimated_tokens
+
+
+def test_fit_truncates_the_longest_responses_first():
+    contents = _conversation("x" * 4_000, "y" * 400, "z" * 40)
+    limit = (
+        estimate_request_tokens(
+            contents, system_instruction=_MODEL.system_instruction, tools=_MODEL.tools
+        )
+        - 500
+    )
+
+    fitted, metrics = asyncio.run(
+        TokenPolicy(max_request_tokens=limit).fit(_MODEL, contents)
+    )
+
+    assert metrics.tokens_after <= limit
+    assert fitted[2:] == contents[2:]
+    assert "truncated_result" in fitted[1].parts[0].function_response.response
+    # The conversation passed in is not modified.
+    assert contents == _conversation("x" * 4_000, "y" * 400, "z" * 40)
+
+
+def test_fit_does_not_depend_on_the_order_of_the_responses():
+    policy = TokenPolicy(max_request_tokens=600)
+
+    forward, _ = asyncio.run(
+        policy.fit(_MODEL, _conversation("a" * 2_000, "b" * 1_500))
+    )
+    backward, _ = asyncio.run(
+        policy.fit(_MODEL, _conversation("b" * 1_500, "a" * 2_000))
+    )
+
+    assert sorted(_response_sizes(forward)) == sorted(_response_sizes(backward))
+
+
+def test_fit_caps_every_function_response():
+    contents = _conversation("x" * 4_000, "short")
+
+    fitted, metrics = asyncio.run(
+        TokenPolicy(max_function_response_tokens=100).fit(_MODEL, contents)
+    )
+
+    assert metrics.truncated_responses == 1
+    assert max(_response_sizes(fitted)) <= 100
+    assert fitted[2] == contents[2]
+
+
+def test_fit_raises_when_truncating_is_not_enough():
+    with pytest.raises(RequestTooLargeError):
+        asyncio.run(
+            TokenPolicy(max_request_tokens=10).fit(_MODEL, _conversation("x" * 400))
+        )
+
+
+def test_truncating_again_keeps_the_original_size():
+    response = glm.FunctionResponse(name="lookup", response={"result": "x" * 1_000})
+
+    once = truncate_function_response(response, 100)
+    twice = truncate_function_response(once, 50)
+
+    assert len(once.response["truncated_result"]) == 100
+    assert len(twice.response["truncated_result"]) == 50
+    assert twice.response["original_chars"] == once.response["original_chars"]
+    assert truncate_function_response(twice, 50) is None
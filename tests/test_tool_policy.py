@@ -0,0 +1,104 @@
+import asyncio
+import contextvars
+from goog.decorators import run_in
+from goog.tool_policy import ToolPolicy
+import os
+import threading
+
+_caller: contextvars.ContextVar[str] = contextvars.ContextVar("caller", default="")
+
+
+def _thread_tool() -> tuple[str, bool]:
+    return _caller.get(), threading.current_thread() is threading.main_thread()
+
+
+@run_in("process")
+def _process_tool() -> int:
+    return os.getpid()
+
+
+def test_function_limits_are_shared_by_policies_with_the_same_limit():
+    running = []
+    peak = []
+
+    async def call(policy: ToolPolicy) -> None:
+        async with policy.slot("scrape"):
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.pop()
+
+    async def run():
+        # As when a policy is built for each call of an agent.
+        await asyncio.gather(
+            *(call(ToolPolicy(max_concurrency={"scrape": 2})) for _ in range(6))
+        )
+
+    asyncio.run(run())
+
+    assert max(peak) == 2
+
+
+def test_function_limits_work_on_a_new_event_loop():
+    policy = ToolPolicy(max_concurrency={"scrape": 1})
+
+    async def run():
+        async def call():
+            async with policy.slot("scrape"):
+                await asyncio.sleep(0)
+
+        await asyncio.gather(call(), call())
+
+    asyncio.run(run())
+    # The semaphore of the first loop is not reused on the second.
+    asyncio.run(run())
+
+
+def test_session_slots_bound_the_calls_of_a_session():
+    policy = ToolPolicy(max_in_flight=1)
+    order = []
+
+    async def call(name: str, session_slots: asyncio.Semaphore | None) -> None:
+        async with policy.slot(name, session_slots):
+            order.append(f"start {name}")
+            await asyncio.sleep(0.01)
+            order.append(f"end {name}")
+
+    async def run():
+        slots = policy.new_session_slots()
+        await asyncio.gather(call("a", slots), call("b", slots))
+
+    asyncio.run(run())
+
+    assert order == ["start a", "end a", "start b", "end b"]
+
+
+def test_sync_tools_run_on_a_thread_with_the_context_of_the_caller():
+    async def run():
+        _caller.set("agent")
+        return await ToolPolicy().run(_thread_tool, {})
+
+    assert asyncio.run(run()) == ("agent", False)
+
+
+def test_process_tools_run_in_the_shared_process_pool():
+    assert asyncio.run(ToolPolicy().run(_process_tool, {})) != os.getpid()
+
+
+def test_timeouts_default_to_the_policy_timeout():
+    policy = ToolPolicy(timeout_seconds=10, timeouts={"slow": 60})
+
+    assert policy.timeout_for("slow") == 60
+    assert policy.timeout_for("fast") == 10
+
+
+def test_record_keeps_the_metrics_of_each_function():
+    policy = ToolPolicy()
+
+    policy.record("scrape", queue_seconds=1, run_seconds=3)
+    policy.record("scrape", queue_seconds=3, run_seconds=1, timed_out=True)
+
+    metrics = policy.metrics["scrape"]
+    assert (metrics.calls, metrics.timeouts, metrics.errors) == (2, 1, 0)
+    assert metrics.average_queue_seconds == 2
+    assert metrics.max_run_seconds == 3
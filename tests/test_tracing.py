@@ -0,0 +1,85 @@
+import asyncio
+from goog import tracing
+
+
+async def _numbers(span, count: int):
+    for i in range(count):
+        with tracing.span("step", "tool", i=i):
+            await asyncio.sleep(0)
+        yield i
+
+
+async def _nested(span):
+    async for i in tracing.span_stream("inner", "model", lambda s: _numbers(s, 2)):
+        yield i
+
+
+def test_stream_spans_nest_under_the_stream():
+    async def run():
+        with tracing.trace() as tracer:
+            with tracing.span("root", "agent"):
+                items = []
+                async for i in tracing.span_stream("outer", "agent", _nested):
+                    # The consumer is not within the stream's span.
+                    with tracing.span("consumer", "tool"):
+                        items.append(i)
+        return items, tracer.spans
+
+    items, spans = asyncio.run(run())
+    by_name = {}
+    for span in spans:
+        by_name.setdefault(span.name, []).append(span)
+
+    assert items == [0, 1]
+    root, outer, inner = by_name["root"][0], by_name["outer"][0], by_name["inner"][0]
+    assert outer.parent_id == root.span_id
+    assert inner.parent_id == outer.span_id
+    assert {span.parent_id for span in by_name["step"]} == {inner.span_id}
+    assert {span.parent_id for span in by_name["consumer"]} == {root.span_id}
+
+
+def test_stream_closed_from_another_task():
+    async def run():
+        with tracing.trace() as tracer:
+            stream = tracing.span_stream("outer", "agent", lambda s: _numbers(s, 5))
+            assert await anext(stream) == 0
+            await asyncio.create_task(stream.aclose())
+            with tracing.span("after", "tool"):
+                pass
+        return tracer.spans
+
+    spans = asyncio.run(run())
+
+    assert [span.status for span in spans if span.name == "outer"] == ["ok"]
+    assert [span.parent_id for span in spans if span.name == "after"] == [None]
+
+
+def test_stream_error_is_recorded():
+    async def failing(span):
+        yield 1
+        raise ValueError("boom")
+
+    async def run():
+        with tracing.trace() as tracer:
+            try:
+                async for _ in tracing.span_stream("outer", "agent", failing):
+                    pass
+            except ValueError:
+                pass
+        return tracer.spans
+
+    (span,) = asyncio.run(run())
+
+    assert (span.status, span.attributes["error"]) == ("error", "ValueError: boom")
+
+
+def test_stream_without_tracing():
+    async def run():
+        return [
+            i
+            async for i in tracing.span_stream(
+                "outer", "agent", lambda s: _numbers(s, 3)
+            )
+        ]
+
+    assert asyncio.run(run()) == [0, 1, 2]
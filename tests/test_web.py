@@ -0,0 +1,160 @@
+import asyncio
+import collections
+from functions import web
+from functions.fetch import Page
+import pytest
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Replaces the search with one of 30 results, recording the searches."""
+    searches = []
+
+    def search(query: str, num_results: int) -> list[tuple[str, str, str]]:
+        searches.append((query, num_results))
+        return [
+            (f"https://example.com/{i}", f"Title {i}", f"Description {i}")
+            for i in range(min(num_results, 30))
+        ]
+
+    monkeypatch.setattr(web, "_search", search)
+    monkeypatch.setattr(web, "_search_cache", collections.OrderedDict())
+    return searches
+
+
+def test_queries_are_normalized():
+    assert web._normalize_query("  Singapore\tWEATHER \n") == "singapore weather"
+    assert web._normalize_query("Straße") == web._normalize_query("STRASSE")
+
+
+def test_num_results_are_rounded_up_to_a_bucket():
+    assert [web._bucket_num_results(n) for n in (1, 5, 6, 20, 21, 50, 51)] == [
+        5,
+        5,
+        10,
+        20,
+        50,
+        50,
+        51,
+    ]
+
+
+def test_queries_differing_in_case_and_spaces_share_a_search(searches):
+    async def run():
+        return [
+            await web._cached_search("Singapore weather", 3),
+            await web._cached_search("  singapore   WEATHER ", 3),
+        ]
+
+    first, second = asyncio.run(run())
+
+    assert first == second
+    assert len(first) == 3
+    # The search asked for the whole bucket.
+    assert searches == [("Singapore weather", 5)]
+
+
+def test_a_longer_cached_search_serves_a_shorter_request(searches):
+    async def run():
+        longer = await web._cached_search("durian", 8)
+        shorter = await web._cached_search("durian", 4)
+        return longer, shorter
+
+    longer, shorter = asyncio.run(run())
+
+    assert shorter == longer[:4]
+    assert searches == [("durian", 10)]
+
+
+def test_a_shorter_cached_search_does_not_serve_a_longer_request(searches):
+    async def run():
+        await web._cached_search("durian", 4)
+        return await web._cached_search("durian", 8)
+
+    assert len(asyncio.run(run())) == 8
+    assert searches == [("durian", 5), ("durian", 10)]
+
+
+def test_a_search_with_fewer_results_than_requested_serves_any_request(searches):
+    async def run():
+        await web._cached_search("rare", 50)
+        return await web._cached_search("rare", 100)
+
+    # The search found only 30 results; asking for more finds no more.
+    assert len(asyncio.run(run())) == 30
+    assert searches == [("rare", 50)]
+
+
+def test_expired_searches_are_repeated(monkeypatch, searches):
+    async def run():
+        await web._cached_search("durian", 4)
+        monkeypatch.setattr(web, "_SEARCH_CACHE_TTL_SECONDS", -1)
+        await web._cached_search("durian", 4)
+
+    asyncio.run(run())
+
+    assert len(searches) == 2
+
+
+_PAGE = """<html><head><title>Hawker food</title></head><body>
+<h1 id="crab">Chilli crab</h1><p>Chilli crab is cooked in a sweet and spicy sauce.</p>
+<h1 id="rice">Chicken rice</h1><p>Chicken rice is poached chicken with rice.</p>
+<h1 id="laksa">Laksa</h1><p>Laksa is a spicy noodle soup.</p>
+</body></html>"""
+
+
+@pytest.fixture
+def served_page(monkeypatch):
+    """Serves _PAGE for any URL, without a page cache."""
+
+    class Fetcher:
+        async def fetch(self, url, content_types=None):
+            return Page(
+                url=url,
+                status=200,
+                headers={},
+                content_type="text/html",
+                charset="utf-8",
+                text=_PAGE,
+                truncated=False,
+            )
+
+    monkeypatch.setattr(web, "get_page_cache", lambda: None)
+    monkeypatch.setattr(web, "get_fetcher", Fetcher)
+    monkeypatch.setattr(web, "_PASSAGE_MAX_WORDS", 12)
+
+
+def test_scrape_without_a_query_returns_the_whole_page(served_page):
+    scraped = asyncio.run(web.web_scrape("https://example.com/food"))
+
+    assert scraped.startswith("URL: https://example.com/food\nTitle: Hawker food\n")
+    assert "Chicken rice" in scraped and "Laksa" in scraped
+
+
+def test_scrape_with_a_query_returns_the_matching_passages_in_page_order(
+    served_page,
+):
+    scraped = asyncio.run(web.web_scrape("https://example.com/food", "spicy crab"))
+
+    assert scraped.split("\n\n") == [
+        "URL: https://example.com/food\nTitle: Hawker food\n"
+        "Passages most relevant to 'spicy crab':",
+        "[https://example.com/food#crab]\n"
+        "Chilli crab Chilli crab is cooked in a sweet and spicy sauce.",
+        "[https://example.com/food#laksa]\nLaksa Laksa is a spicy noodle soup.",
+    ]
+
+
+def test_scrape_keeps_the_passages_within_the_token_budget(monkeypatch, served_page):
+    # Room for one passage only.
+    monkeypatch.setattr(web, "_PASSAGE_TOKEN_BUDGET", 20)
+
+    scraped = asyncio.run(web.web_scrape("https://example.com/food", "spicy crab"))
+
+    assert "#crab" in scraped and "#laksa" not in scraped
+
+
+def test_scrape_with_an_unmatched_query(served_page):
+    scraped = asyncio.run(web.web_scrape("https://example.com/food", "durian"))
+
+    assert scraped.endswith("No passage of the page matches 'durian'.")